@@ -0,0 +1,88 @@
+from collections import deque
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 准入控制設定（CoDel）：觀察區間內的最小排隊延遲都超過目標時，視為過載
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_TARGET_MS = float(os.getenv('ADMISSION_TARGET_MS', '200'))
+ADMISSION_INTERVAL_MS = float(os.getenv('ADMISSION_INTERVAL_MS', '2000'))
+SOJOURN_SAMPLES = 1000
+
+class CoDelController:
+    """依排隊延遲（CoDel）決定出佇列的工作是否要卸載
+
+    每個 interval 檢查一次區間內的最小排隊延遲：仍低於 target 表示佇列能自行消化，
+    只卸載排隊超過 interval 的工作；高於 target 表示持續過載，排隊超過 target
+    的工作一律卸載，讓佇列很快回到目標延遲。webhook 的事件來源不會因卸載而放慢，
+    因此不採用 TCP 版 CoDel 逐步提高丟棄頻率的做法。
+    """
+
+    def __init__(self, target_ms=ADMISSION_TARGET_MS, interval_ms=ADMISSION_INTERVAL_MS,
+                 enabled=ADMISSION_ENABLED):
+        self.target = target_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.enabled = enabled
+        self.overloaded = False
+        self.admitted = 0
+        self.shed = 0
+        self.overload_periods = 0
+        self._window_end = None
+        self._window_min = float('inf')
+        self._sojourns = deque(maxlen=SOJOURN_SAMPLES)
+        self._lock = threading.Lock()
+
+    def should_shed(self, sojourn, now=None):
+        """工作出佇列時呼叫；回傳 True 表示改用簡短回應"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._sojourns.append(sojourn)
+            self._observe(sojourn, now)
+            limit = self.target if self.overloaded else self.interval
+            shed = self.enabled and sojourn > limit
+            if shed:
+                self.shed += 1
+            else:
+                self.admitted += 1
+            return shed
+
+    def _observe(self, sojourn, now):
+        if self._window_end is None:
+            self._window_end = now + self.interval
+        self._window_min = min(self._window_min, sojourn)
+        if now < self._window_end:
+            return
+
+        overloaded = self._window_min > self.target
+        if overloaded and not self.overloaded:
+            self.overload_periods += 1
+            logger.warning(f"排隊延遲最低 {self._window_min * 1000:.0f} ms 仍超過目標，開始卸載")
+        elif self.overloaded and not overloaded:
+            logger.info("排隊延遲已回到目標內，停止卸載")
+        self.overloaded = overloaded
+        self._window_end = now + self.interval
+        self._window_min = float('inf')
+
+    def get_stats(self):
+        with self._lock:
+            samples = sorted(self._sojourns)
+        percentile = lambda p: round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 1) if samples else 0
+        return {
+            'enabled': self.enabled,
+            'target_ms': self.target * 1000,
+            'interval_ms': self.interval * 1000,
+            'overloaded': self.overloaded,
+            'overload_periods': self.overload_periods,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'sojourn_p50_ms': percentile(0.5),
+            'sojourn_p99_ms': percentile(0.99),
+        }
@@ -0,0 +1,249 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import uuid
+import logging
+import numpy as np
+from dotenv import load_dotenv
+from line_messaging import messenger, MULTICAST_MAX_RECIPIENTS
+from follower_registry import registry, ALERT_SEGMENT
+from scheduler import schedule
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 異常偵測設定
+ANOMALY_ENABLED = os.getenv('ANOMALY_ENABLED', 'true').lower() == 'true'
+ANOMALY_INTERVAL = float(os.getenv('ANOMALY_INTERVAL', '1'))         # 批次評分間隔（秒）
+ANOMALY_HALF_LIFE = float(os.getenv('ANOMALY_HALF_LIFE', '150'))     # EWMA 半衰期（秒）
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', '4'))
+ANOMALY_WARMUP = int(os.getenv('ANOMALY_WARMUP', '30'))              # 累積幾筆後才以 z 分數判斷
+ANOMALY_MAX_TEMPERATURE = float(os.getenv('ANOMALY_MAX_TEMPERATURE', '35'))
+ANOMALY_MAX_HUMIDITY = float(os.getenv('ANOMALY_MAX_HUMIDITY', '85'))
+ANOMALY_MAX_RATE = float(os.getenv('ANOMALY_MAX_RATE', '3'))         # 每分鐘變化上限（°C 或 %）
+ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', '1800'))
+METRICS = (('temperature', '溫度', '°C', ANOMALY_MAX_TEMPERATURE),
+           ('humidity', '濕度', '%', ANOMALY_MAX_HUMIDITY))
+# 變異數下限，避免讀數長時間不變時一個單位的跳動就被視為異常（DHT11 解析度為 1）
+MIN_VARIANCE = 1.0
+# 變化率以短半衰期的 EWMA 計算，DHT11 的 1 度跳動不會被當成急遽變化
+RATE_HALF_LIFE = 20.0
+# 每種異常在陣列中的欄位順序
+KINDS = ('high', 'spike', 'rate')
+ALERT_KEY_NAMESPACE = uuid.UUID('0b5e7c1e-8d2a-4f63-a1c4-6e2d9f7b3a15')
+
+class AnomalyDetector:
+    """以 EWMA 平均／變異數與變化率，對所有裝置的讀數批次向量化評分
+
+    每個裝置佔陣列的一列，收到的讀數先排入佇列，定期整批以 NumPy 計算；
+    同一裝置、欄位與異常種類在冷卻時間內只會通知一次。
+    """
+
+    def __init__(self, notify=None, half_life=ANOMALY_HALF_LIFE, capacity=64):
+        self.notify = notify
+        self.half_life = half_life
+        self.readings = 0
+        self.batches = 0
+        self.anomalies = 0
+        self.alerts = 0
+        self.suppressed = 0
+        self.score_seconds = 0.0
+        self._slots = {}     # 裝置 -> 列索引
+        self._devices = []
+        metrics = len(METRICS)
+        self._mean = np.zeros((capacity, metrics))
+        self._var = np.zeros((capacity, metrics))
+        self._fast = np.zeros((capacity, metrics))
+        self._last_ts = np.zeros(capacity)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._pending = []
+        self._last_alert = {}  # (裝置, 欄位, 種類) -> 上次通知時間
+        self._lock = threading.Lock()
+
+    def observe(self, values, device='default', timestamp=None):
+        """加入一筆讀數，實際評分在 score() 整批進行"""
+        timestamp = time.time() if timestamp is None else timestamp
+        # 讀數已在 ingest_reading 驗證，缺少欄位時直接拋出，避免 0 被當成真實讀數而觸發異常
+        row = tuple(float(values[name]) for name, _, _, _ in METRICS)
+        with self._lock:
+            self._pending.append((device, timestamp, row))
+
+    def _slot(self, device):
+        slot = self._slots.get(device)
+        if slot is None:
+            slot = len(self._devices)
+            if slot == len(self._count):
+                # 容量不足時加倍
+                for name in ('_mean', '_var', '_fast', '_last_ts', '_count'):
+                    array = getattr(self, name)
+                    setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+            self._slots[device] = slot
+            self._devices.append(device)
+        return slot
+
+    def score(self, now=None):
+        """對佇列中的讀數整批評分，回傳本批次發出的警報"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return []
+        started = time.perf_counter()
+        slots = np.fromiter((self._slot(device) for device, _, _ in pending), dtype=np.int64, count=len(pending))
+        timestamps = np.fromiter((ts for _, ts, _ in pending), dtype=np.float64, count=len(pending))
+        values = np.array([row for _, _, row in pending], dtype=np.float64)
+
+        # 同一裝置在一個批次內可能有多筆，依到達順序分輪處理，每輪每個裝置最多一筆
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+        ranks = np.empty(len(pending), dtype=np.int64)
+        ranks[order] = np.arange(len(pending)) - np.repeat(group_start, np.diff(np.r_[group_start, len(pending)]))
+
+        flags = []
+        for rank in range(int(ranks.max()) + 1):
+            batch = ranks == rank
+            flags.append((batch, self._score_round(slots[batch], timestamps[batch], values[batch])))
+
+        alerts = self._collect_alerts(slots, values, flags, time.time() if now is None else now)
+        self.readings += len(pending)
+        self.batches += 1
+        self.score_seconds += time.perf_counter() - started
+        if alerts and self.notify is not None:
+            self.notify(alerts)
+        return alerts
+
+    def _score_round(self, slots, timestamps, values):
+        """以更新前的統計量評分，再更新 EWMA；回傳 (n, 欄位數, 種類數) 的布林陣列"""
+        mean, var, fast = self._mean[slots], self._var[slots], self._fast[slots]
+        count = self._count[slots]
+        seen = (count > 0)[:, None]
+        warm = (count >= ANOMALY_WARMUP)[:, None]
+
+        z = np.abs(values - mean) / np.sqrt(np.maximum(var, MIN_VARIANCE))
+        elapsed = np.maximum(timestamps - self._last_ts[slots], 1.0)[:, None]
+        fast_alpha = np.where(seen, 1 - np.exp2(-elapsed / RATE_HALF_LIFE), 1.0)
+        new_fast = fast + fast_alpha * (values - fast)
+        rate = np.abs(new_fast - fast) / elapsed * 60
+        limits = np.array([limit for _, _, _, limit in METRICS])
+        flags = np.stack([
+            values > limits,
+            warm & (z > ANOMALY_Z_THRESHOLD),
+            warm & (rate > ANOMALY_MAX_RATE),
+        ], axis=-1)
+
+        # 依實際間隔換算平滑係數，讀數間隔不固定時半衰期仍一致
+        alpha = np.where(seen, 1 - np.exp2(-elapsed / self.half_life), 1.0)
+        diff = values - mean
+        increment = alpha * diff
+        self._mean[slots] = mean + increment
+        self._var[slots] = np.where(seen, (1 - alpha) * (var + diff * increment), 0.0)
+        self._fast[slots] = new_fast
+        self._last_ts[slots] = timestamps
+        self._count[slots] = count + 1
+        return flags
+
+    def _collect_alerts(self, slots, values, flags, now):
+        alerts = []
+        for batch, round_flags in flags:
+            rows, metrics, kinds = np.nonzero(round_flags)
+            if len(rows) == 0:
+                continue
+            batch_slots = slots[batch]
+            batch_values = values[batch]
+            for row, metric, kind in zip(rows.tolist(), metrics.tolist(), kinds.tolist()):
+                self.anomalies += 1
+                slot = int(batch_slots[row])
+                device = self._devices[slot]
+                key = (device, METRICS[metric][0], KINDS[kind])
+                if now - self._last_alert.get(key, float('-inf')) < ALERT_COOLDOWN:
+                    self.suppressed += 1
+                    continue
+                self._last_alert[key] = now
+                alerts.append({
+                    'device': device,
+                    'metric': METRICS[metric][0],
+                    'kind': KINDS[kind],
+                    'value': float(batch_values[row, metric]),
+                    'mean': round(float(self._mean[slot, metric]), 1),
+                    'time': now,
+                })
+        self.alerts += len(alerts)
+        return alerts
+
+    def get_stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'devices': len(self._devices),
+            'readings': self.readings,
+            'pending': pending,
+            'batches': self.batches,
+            'anomalies': self.anomalies,
+            'alerts': self.alerts,
+            'suppressed': self.suppressed,
+            'us_per_reading': round(self.score_seconds / self.readings * 1e6, 2) if self.readings else 0,
+        }
+
+def format_alert(device, alerts):
+    """同一裝置在同一批次的警報合併為一則訊息"""
+    labels = {name: (label, unit) for name, label, unit, _ in METRICS}
+    reasons = {'high': '超過上限', 'spike': '偏離近期平均', 'rate': '變化過快'}
+    by_metric = {}
+    for alert in alerts:
+        by_metric.setdefault(alert['metric'], []).append(alert)
+    lines = [f"⚠️ 環境異常警報（{device}）"]
+    for metric, metric_alerts in by_metric.items():
+        label, unit = labels[metric]
+        first = metric_alerts[0]
+        causes = "、".join(reasons[alert['kind']] for alert in metric_alerts)
+        lines.append(f"{label} {first['value']:.1f}{unit}：{causes}（近期平均 {first['mean']:.1f}{unit}）")
+    lines.append("輸入「取消訂閱警報」即可停止通知。")
+    return "\n".join(lines)
+
+class AlertNotifier:
+    """將警報 multicast 給訂閱者，在背景依序送出，不會拖慢評分"""
+
+    def __init__(self, audience=lambda: registry.members(ALERT_SEGMENT)):
+        self.audience = audience
+        self.messages = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alerts')
+
+    def __call__(self, alerts):
+        by_device = {}
+        for alert in alerts:
+            by_device.setdefault(alert['device'], []).append(alert)
+        for device, device_alerts in by_device.items():
+            self._executor.submit(self._send, device, device_alerts)
+
+    def _send(self, device, alerts):
+        recipients = sorted(self.audience())
+        if not recipients:
+            return
+        text = format_alert(device, alerts)
+        # retry key 由警報內容決定，重試不會重複送達
+        alert_id = ':'.join(f"{a['device']}:{a['metric']}:{a['kind']}:{a['time']:.0f}" for a in alerts)
+        for i in range(0, len(recipients), MULTICAST_MAX_RECIPIENTS):
+            retry_key = str(uuid.uuid5(ALERT_KEY_NAMESPACE, f"{alert_id}:{i}"))
+            if messenger.multicast(recipients[i:i + MULTICAST_MAX_RECIPIENTS], [text], retry_key):
+                self.messages += 1
+
+# 全域共用的異常偵測器
+anomaly_detector = AnomalyDetector(notify=AlertNotifier())
+
+def subscribe(user_id):
+    registry.set_profile(user_id, alerts=True)
+    return "已訂閱環境異常警報，溫濕度過高或急遽變化時會通知您。輸入「取消訂閱警報」即可停止。"
+
+def unsubscribe(user_id):
+    registry.set_profile(user_id, alerts=False)
+    return "已取消環境異常警報。"
+
+def start():
+    """啟動讀數的定期批次評分"""
+    if not ANOMALY_ENABLED:
+        return
+    schedule('anomaly-detection', ANOMALY_INTERVAL, anomaly_detector.score, initial_delay=ANOMALY_INTERVAL, jitter=0)
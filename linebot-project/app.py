@@ -1,12 +1,10 @@
-from flask import Flask, request, abort, jsonify
-from linebot.v3 import WebhookHandler
+from flask import Flask, Response, request, abort, jsonify
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, ReplyMessageRequest, TextMessage
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
 from functools import wraps
 import os
 from dotenv import load_dotenv
 import logging
+import math
 from logging.handlers import RotatingFileHandler
 import time
 
@@ -14,6 +12,29 @@ import time
 import gemini_service
 import firebase_service
 import services
+import scheduler
+import weather_service
+import traffic_service
+import digest
+from follower_registry import registry
+import environment_rollups
+from environment_rollups import rollup_engine, RAW_WINDOW_SECONDS
+import sensor_archive
+from sensor_archive import archive
+import anomaly_detector
+from anomaly_detector import anomaly_detector as detector
+from stream_hub import stream_hub, topics_for, ALL_TOPIC
+import fleet_summary
+from fleet_summary import fleet_summary as fleet
+from conversation_context import context_store
+from text_normalizer import text_normalizer, normalize
+from http_client import http_client
+import circuit_breaker
+import deadline
+from event_dedup import deduplicator
+from event_dispatcher import dispatcher, event_key
+from line_messaging import messenger
+from webhook_parser import WebhookRouter
 
 load_dotenv()
 
@@ -42,8 +63,29 @@ if not LINE_CHANNEL_SECRET or not LINE_CHANNEL_ACCESS_TOKEN:
     app.logger.error("錯誤：在 .env 檔案中找不到 LINE_CHANNEL_SECRET 或 LINE_CHANNEL_ACCESS_TOKEN")
     exit()
 
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+# 輕量解析 webhook，只有需要的事件類型才建立完整的 SDK 模型
+handler = WebhookRouter(LINE_CHANNEL_SECRET)
+
+_background_started = False
+
+def start_background():
+    """載入好友名單並啟動背景資料更新；只能在實際處理請求的單一程序中呼叫一次
+
+    匯入模組時不會自動啟動，Werkzeug reloader 的監看程序或多個 worker 各自匯入時
+    才不會重複輪詢外部 API、重複發送摘要。
+    """
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    weather_service.start()
+    traffic_service.start(services.gmaps, services.api_limiter)
+    registry.load()
+    digest.start()
+    environment_rollups.start()
+    sensor_archive.start()
+    anomaly_detector.start()
+    fleet_summary.start()
 
 # 全域變數用於儲存 Arduino 數據
 latest_arduino_data = {
@@ -67,10 +109,12 @@ def handle_errors(f):
 @handle_errors
 def webhook():
     signature = request.headers['X-Line-Signature']
-    body = request.get_data(as_text=True)
-    app.logger.info("請求內容：" + body)
+    body = request.get_data()
+    app.logger.info("請求內容：" + body.decode('utf-8'))
     try:
-        handler.handle(body, signature)
+        # 回覆權杖有效期限從收到 webhook 開始計算；事件排入分片時會一併帶入期限
+        with deadline.scope(deadline.REPLY_DEADLINE_SECONDS):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         app.logger.error("無效的簽名。請檢查您的頻道存取權杖/頻道密鑰。")
         abort(400)
@@ -79,15 +123,71 @@ def webhook():
         abort(500)
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessageContent)
+@app.route("/metrics", methods=['GET'])
+@handle_errors
+def metrics():
+    return jsonify({
+        'http': http_client.get_stats(),
+        'circuit_breakers': circuit_breaker.get_all_stats(),
+        'gemini': gemini_service.generation_stats.get_stats(),
+        'gemini_cache': gemini_service.cache_stats(),
+        'gemini_batching': gemini_service.prompt_batcher.get_stats() if gemini_service.prompt_batcher else None,
+        'conversation_context': context_store.get_stats(),
+        'weather': weather_service.weather_engine.get_stats(),
+        'traffic': traffic_service.traffic_engine.get_stats(),
+        'places': services.places_index.get_stats(),
+        'news_cache': services.get_news.cache_stats,
+        'text_normalization': text_normalizer.get_stats(),
+        'webhook_dedup': deduplicator.get_stats(),
+        'event_dispatch': dispatcher.get_stats(),
+        'admission': dispatcher.admission.get_stats(),
+        'line_messaging': messenger.get_stats(),
+        'digest': digest.digest_job.get_stats(),
+        'followers': registry.get_stats(),
+        'webhook_events': handler.get_stats(),
+        'environment_rollups': rollup_engine.get_stats(),
+        'sensor_archive': archive.get_stats(),
+        'anomaly_detection': detector.get_stats(),
+        'live_stream': stream_hub.get_stats(),
+        'fleet_summary': fleet.get_stats(),
+        'scheduled_tasks': scheduler.get_all_stats()
+    })
+
+BUSY_REPLY = "系統忙碌中，請稍後再試。"
+
+def send_reply(event, reply_text):
+    """透過 LINE Bot 發送回應；回覆權杖過期時改用 push"""
+    messenger.send(event.reply_token, event_key(event), reply_text, received_at=event.timestamp / 1000)
+
+def reply_busy(event):
+    """負載過高時的簡短回應，不呼叫 Gemini 也不寫入 Firestore"""
+    send_reply(event, BUSY_REPLY)
+
+@handler.add('follow')
+@deduplicator.skip_duplicates
+def handle_follow(event):
+    registry.follow(event.source.user_id)
+
+@handler.add('unfollow')
+@deduplicator.skip_duplicates
+def handle_unfollow(event):
+    # 封鎖也會收到 unfollow 事件
+    registry.unfollow(event.source.user_id)
+
+@handler.add('message', 'text')
+@deduplicator.skip_duplicates
+@dispatcher.serialize_by_user(shed=reply_busy)
 def handle_message(event):
     user_id = event.source.user_id
     user_message = event.message.text
+    # 路由與快取鍵都使用正規化後的文字，簡體、全形與多餘空白不會造成分歧
+    text = normalize(user_message)
     reply_text = "抱歉，我不明白您的意思。"  # 預設回應
+    registry.seen(user_id)
 
     try:
         # 檢查訊息類型並處理
-        if user_message.lower() == "arduino":
+        if text.lower() == "arduino":
             if latest_arduino_data['temperature'] is not None and latest_arduino_data['humidity'] is not None:
                 reply_text = f"""
 感測器數據：
@@ -98,94 +198,126 @@ def handle_message(event):
 """
             else:
                 reply_text = "目前尚未收到 Arduino 感測器的數據。"
+
+        elif text.startswith("取消訂閱早報"):
+            reply_text = digest.unsubscribe(user_id)
+
+        elif text.startswith("訂閱早報"):
+            location = text[len("訂閱早報"):].strip() or "台北"
+            reply_text = digest.subscribe(user_id, location)
+
+        elif text.startswith("取消訂閱警報"):
+            reply_text = anomaly_detector.unsubscribe(user_id)
+
+        elif text.startswith("訂閱警報"):
+            reply_text = anomaly_detector.subscribe(user_id)
                 
-        elif "天氣" in user_message or "天气" in user_message:
+        elif "天氣" in text:
             location = "台北"  # 預設地點
             # 提取城市名稱
-            if "天氣" in user_message:
-                parts = user_message.split("天氣")
-                if len(parts) > 1 and parts[0].strip():
-                    location = parts[0].strip()
-            elif "天气" in user_message:
-                parts = user_message.split("天气")
-                if len(parts) > 1 and parts[0].strip():
-                    location = parts[0].strip()
+            parts = text.split("天氣")
+            if len(parts) > 1 and parts[0].strip():
+                location = parts[0].strip()
             
             app.logger.info(f"查詢天氣資訊，地點：{location}")
             reply_text = services.get_weather(location)
+            # 以第一次查詢的縣市作為使用者所在地的初步推測
+            city = digest.resolve_city(location)
+            if city:
+                registry.set_profile(user_id, city=city, overwrite_city=False)
             
-        elif "新聞" in user_message or "新闻" in user_message:
+        elif "新聞" in text:
             category = "general"
-            if "科技" in user_message:
+            if "科技" in text:
                 category = "technology"
-            elif "運動" in user_message or "运动" in user_message:
+            elif "運動" in text:
                 category = "sports"
-            elif "娛樂" in user_message or "娱乐" in user_message:
+            elif "娛樂" in text:
                 category = "entertainment"
             reply_text = services.get_news(category)
             
-        elif "交通" in user_message:
+        elif "交通" in text:
             location = "台北"
-            if "交通" in user_message and len(user_message.split("交通")) > 1:
-                location = user_message.split("交通")[0].strip()
+            if len(text.split("交通")) > 1:
+                location = text.split("交通")[0].strip()
             reply_text = services.get_traffic_info(location)
             
-        elif "旅遊" in user_message or "景点" in user_message or "景點" in user_message:
+        elif "旅遊" in text or "景點" in text:
             location = "台北"
-            if "旅遊" in user_message and len(user_message.split("旅遊")) > 1:
-                location = user_message.split("旅遊")[0].strip()
-            elif "景点" in user_message and len(user_message.split("景点")) > 1:
-                location = user_message.split("景点")[0].strip()
-            elif "景點" in user_message and len(user_message.split("景點")) > 1:
-                location = user_message.split("景點")[0].strip()
+            if "旅遊" in text and len(text.split("旅遊")) > 1:
+                location = text.split("旅遊")[0].strip()
+            elif "景點" in text and len(text.split("景點")) > 1:
+                location = text.split("景點")[0].strip()
             reply_text = services.get_travel_info(location)
             
-        elif "環境狀況" in user_message or "室内数据" in user_message or "室內數據" in user_message:
+        elif "全市環境" in text or (
+                "環境狀況" in text and fleet.summary()['devices'] > 1):
+            # 多個感測器時回覆全市摘要，直接讀取每次更新時快取的結果
+            reply_text = fleet_summary.format_summary(fleet.summary())
+
+        # 「据」在繁體中也是常用字（拮据），正規化時不轉換，簡體的「数据」會成為「數据」
+        elif "環境狀況" in text or "室內數據" in text or "室內數据" in text:
             if latest_arduino_data['temperature'] is not None and latest_arduino_data['humidity'] is not None:
                 reply_text = gemini_service.report_environment_data(latest_arduino_data)
             else:
                 reply_text = "目前尚未收到環境感測器的數據。"
         else:
-            # 使用 Gemini 進行一般對話
-            reply_text = gemini_service.generate_text(f"使用者說：「{user_message}」。請以市民助理的身份自然地回應。")
+            # 使用 Gemini 進行一般對話，附上摘要與最近幾輪對話
+            # 只有不含對話脈絡的提示才能與其他使用者合併為微批次
+            reply_text = gemini_service.generate_text(context_store.build_prompt(user_id, text),
+                                                      shared=not context_store.has_context(user_id))
 
+    except deadline.DeadlineExceeded as e:
+        app.logger.warning(f"處理訊息超過回覆期限，改用快速回應：{e}")
+        reply_text = "抱歉，目前查詢需要較長時間，請稍後再試一次。"
     except Exception as e:
         app.logger.error(f"處理訊息時發生錯誤：{e}")
         reply_text = "處理您的請求時發生內部錯誤，請稍後再試。"
 
-    # 將對話儲存到 Firebase
-    try:
-        firebase_service.save_conversation(user_id, user_message, reply_text)
-    except Exception as e:
-        app.logger.error(f"儲存到 Firebase 時發生錯誤：{e}")
+    send_reply(event, reply_text)
 
-    # 透過 LINE Bot 發送回應
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+    # 回應送出後再更新對話脈絡並儲存到 Firebase，不受回覆期限限制
+    with deadline.scope(None):
+        context_store.add_turn(user_id, text, reply_text)
         try:
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
-                )
-            )
+            firebase_service.save_conversation(user_id, user_message, reply_text)
         except Exception as e:
-            app.logger.error(f"發送 LINE 回應時發生錯誤：{e}")
+            app.logger.error(f"儲存到 Firebase 時發生錯誤：{e}")
+
+def ingest_reading(data):
+    """更新最新的感測器數據並加入彙總；數據格式無效時回傳 False
+
+    溫濕度在這裡統一轉為有限的浮點數，驗證失敗時不會寫入任何彙總、封存或推播。
+    """
+    global latest_arduino_data
+    if not isinstance(data, dict):
+        return False
+    try:
+        values = {name: float(data[name]) for name in ('temperature', 'humidity')}
+    except (KeyError, TypeError, ValueError):
+        return False
+    if not all(math.isfinite(value) for value in values.values()):
+        return False
+    latest_arduino_data = {**values, 'timestamp': data.get('timestamp', millis())}
+    # 原始讀數寫入本機封存，Firestore 只由彙總定期批次寫入
+    device = data.get('device_id', 'default')
+    rollup_engine.add(values, device=device)
+    archive.append(values, device=device)
+    detector.observe(values, device=device)
+    fleet.update(device, values, area=data.get('area'))
+    stream_hub.publish(topics_for(device, data.get('area')), 'reading', {
+        'device': device,
+        'area': data.get('area'),
+        **latest_arduino_data,
+    })
+    return True
 
 @app.route("/arduino/data", methods=['POST'])
 @handle_errors
 def receive_arduino_data():
-    global latest_arduino_data
     try:
         data = request.get_json()
-        app.logger.info(f"收到 Arduino 數據：{data}")
-        if data and 'temperature' in data and 'humidity' in data:
-            latest_arduino_data = {
-                'temperature': data.get('temperature'),
-                'humidity': data.get('humidity'),
-                'timestamp': data.get('timestamp', millis())
-            }
-            app.logger.info(f"更新 latest_arduino_data：{latest_arduino_data}")
+        if ingest_reading(data):
             return "數據接收成功", 200
         else:
             app.logger.warning("收到無效的 Arduino 數據。")
@@ -196,35 +328,60 @@ def receive_arduino_data():
 
 @app.route('/sensor-data', methods=['POST'])
 def receive_sensor_data():
-    global latest_arduino_data
     try:
-        app.logger.info("收到 /sensor-data 端點的請求")
-        app.logger.info(f"請求標頭：{dict(request.headers)}")
-        app.logger.info(f"請求數據：{request.get_data(as_text=True)}")
-        
         data = request.get_json()
-        app.logger.info(f"收到感測器數據：{data}")
-        
-        if not data or 'humidity' not in data or 'temperature' not in data:
+        if not ingest_reading(data):
             app.logger.warning("收到無效的數據格式")
             return jsonify({'error': '無效的數據格式'}), 400
-
-        latest_arduino_data = {
-            'temperature': data.get('temperature'),
-            'humidity': data.get('humidity'),
-            'timestamp': data.get('timestamp', millis())
-        }
-        app.logger.info(f"更新 latest_arduino_data：{latest_arduino_data}")
-
-        # 準備回應
-        response = jsonify({'status': 'success', 'message': '數據接收成功'})
-        app.logger.info(f"發送回應：{response.get_data(as_text=True)}")
-        return response
+        return jsonify({'status': 'success', 'message': '數據接收成功'})
 
     except Exception as e:
         app.logger.error(f"處理感測器數據時發生錯誤：{str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stream', methods=['GET'])
+def stream_readings():
+    """以 Server-Sent Events 即時推送讀數，可用 device 或 area 參數篩選"""
+    device = request.args.get('device')
+    area = request.args.get('area')
+    topic = f"device:{device}" if device else f"area:{area}" if area else ALL_TOPIC
+    subscriber = stream_hub.subscribe(topic)
+    if subscriber is None:
+        return jsonify({'error': '即時串流連線數已達上限'}), 503
+    return Response(stream_hub.stream(subscriber), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/environment/summary', methods=['GET'])
+@handle_errors
+def environment_summary():
+    """全市各區的體感溫度、露點與體感最高的地點"""
+    return jsonify(fleet.summary())
+
+@app.route('/environment/history', methods=['GET'])
+@handle_errors
+def environment_history():
+    """查詢環境數據歷史，依解析度自動選用原始讀數、分鐘或小時彙總"""
+    minutes = request.args.get('minutes', 60, type=int)
+    resolution = request.args.get('resolution', 60, type=int)
+    device = request.args.get('device', 'default')
+    if resolution < 60 and minutes * 60 > RAW_WINDOW_SECONDS:
+        # 超出記憶體視窗的原始讀數改從本機封存讀取
+        end = millis()
+        columns = archive.scan(end - minutes * 60 * 1000, end, device=device)
+        names = list(columns)
+        rows = [dict(zip(names, values)) for values in zip(*(columns[name].tolist() for name in names))]
+        return jsonify({'level': 'archive', 'data': rows})
+    level, rows = rollup_engine.history(minutes * 60, resolution=resolution, device=device)
+    return jsonify({'level': level, 'data': rows})
+
+# 以 WSGI 伺服器（gunicorn 單一 worker）部署時，由環境變數指定在此程序啟動背景工作
+if __name__ != "__main__" and os.getenv('START_BACKGROUND_JOBS', 'false').lower() == 'true':
+    start_background()
+
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    # 開啟 reloader 時父程序只負責監看檔案，背景工作只在實際服務的子程序啟動
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background()
+    app.run(host='0.0.0.0', port=port, debug=debug)
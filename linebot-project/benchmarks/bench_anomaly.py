@@ -0,0 +1,45 @@
+"""量測異常偵測每筆讀數的評分成本
+
+模擬多個裝置每 2 秒回報一次，每秒整批評分一次，不會發送任何通知：
+    python benchmarks/bench_anomaly.py --devices 5000 --seconds 120
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from anomaly_detector import AnomalyDetector
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=5000)
+    parser.add_argument('--seconds', type=int, default=120)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    detector = AnomalyDetector()
+    devices = [f"device-{i}" for i in range(args.devices)]
+    base = 25 + rng.integers(-3, 4, args.devices)
+    observe_seconds = 0.0
+    for second in range(args.seconds):
+        # 每秒有一半的裝置回報
+        reporting = range(second % 2, args.devices, 2)
+        noise = rng.integers(-1, 2, args.devices) * (rng.random(args.devices) < 0.1)
+        started = time.perf_counter()
+        for i in reporting:
+            detector.observe({'temperature': float(base[i] + noise[i]), 'humidity': 60.0},
+                             device=devices[i], timestamp=1000.0 + second)
+        observe_seconds += time.perf_counter() - started
+        detector.score(now=1000.0 + second)
+
+    stats = detector.get_stats()
+    print(f"{'讀數':<12}{stats['readings']:>12,}")
+    print(f"{'排入 µs／筆':<12}{observe_seconds / stats['readings'] * 1e6:>12.2f}")
+    print(f"{'評分 µs／筆':<12}{stats['us_per_reading']:>12.2f}")
+    print(f"{'異常／通知':<12}{stats['anomalies']:>8} / {stats['alerts']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""量測每日摘要的渲染次數與 multicast 批次數，並檢查發送時間窗
+
+以模擬的訂閱者分佈執行一次摘要，Firestore 進度、天氣、新聞與 LINE 發送都以記憶體替代，不會發送任何訊息：
+    python benchmarks/bench_digest.py --subscribers 20000 --cities 22
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import digest
+import firebase_service
+import services
+from digest import DigestJob, TAIWAN_TZ
+
+class FakeMessenger:
+    def __init__(self):
+        self.calls = 0
+
+    def multicast(self, to, texts, retry_key):
+        self.calls += 1
+        return True
+
+def use_fakes(checkpoints):
+    """以記憶體中的進度與固定內容取代外部服務"""
+    def save(run_id, segment, progress):
+        checkpoints.setdefault(run_id, {})[segment] = progress
+
+    firebase_service.get_digest_checkpoint = lambda run_id: dict(checkpoints.get(run_id, {}))
+    firebase_service.save_digest_checkpoint = save
+    services.get_news = lambda category="general": "今日新聞"
+    services.get_weather = lambda city: f"{city} 晴"
+    digest.messenger = FakeMessenger()
+
+def check_send_window():
+    """晚間才啟動時不補發當日早報，但已開始的發送仍會繼續"""
+    checkpoints = {}
+    use_fakes(checkpoints)
+    audience = lambda: {'臺北市': ['U1', 'U2']}
+    at = lambda hour, minute: datetime(2026, 10, 19, hour, minute, tzinfo=TAIWAN_TZ)
+
+    job = DigestJob(audience=audience, send_time='07:00', send_window=60)
+    assert job.due_run_id(at(6, 59)) is None
+    assert job.due_run_id(at(7, 30)) == '2026-10-19'
+
+    # 22:00 才啟動且當日沒有進度：略過，之後的檢查也不再讀取進度
+    late = DigestJob(audience=audience, send_time='07:00', send_window=60)
+    assert late.due_run_id(at(22, 0)) is None
+    assert late.runs_skipped == 1 and late.last_run_id == '2026-10-19'
+    firebase_service.get_digest_checkpoint = lambda run_id: {'臺北市': 'U1'}
+    assert late.due_run_id(at(22, 1)) is None
+
+    # 早上中斷、晚間重啟：有未完成的進度時從中斷處繼續
+    checkpoints['2026-10-19'] = {'臺北市': 'U1'}
+    use_fakes(checkpoints)
+    resumed = DigestJob(audience=audience, send_time='07:00', send_window=60)
+    run_id = resumed.due_run_id(at(22, 0))
+    assert run_id == '2026-10-19'
+    resumed.run(run_id)
+    assert resumed.recipients == 1 and checkpoints[run_id]['completed'] is True
+    assert DigestJob(audience=audience, send_time='07:00').due_run_id(at(22, 0)) is None
+    print("send window: late start skipped, unfinished run resumed")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=20000)
+    parser.add_argument('--cities', type=int, default=22)
+    args = parser.parse_args()
+
+    check_send_window()
+
+    rng = np.random.default_rng(0)
+    picks = np.minimum(rng.zipf(1.5, args.subscribers), args.cities) - 1
+    segments = {}
+    for index, city in enumerate(picks.tolist()):
+        segments.setdefault(f"city-{city}", []).append(f"U{index:08d}")
+
+    checkpoints = {}
+    use_fakes(checkpoints)
+    job = DigestJob(audience=lambda: segments)
+    started = time.perf_counter()
+    job.run('bench')
+    elapsed = time.perf_counter() - started
+    print(f"subscribers: {args.subscribers}, cities: {len(segments)}")
+    print(f"renders: {job.renders}, multicast calls: {digest.messenger.calls}, "
+          f"recipients: {job.recipients}, {elapsed * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""比較 Gemini 微批次開啟前後的延遲與上游呼叫次數
+
+使用模擬的 Gemini 模型（固定延遲），不會呼叫真正的 API：
+    python benchmarks/bench_microbatch.py --requests 200 --rate 40 --window-ms 30
+
+開始前先確認：兩位使用者的提示合併為一批時，模型回傳錯位的編號不會讓回應交錯給對方，
+且帶有對話脈絡（shared=False）的提示不會進入批次。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gemini_service
+from micro_batcher import MicroBatcher
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """固定延遲的模擬模型；每則回應引用對應的提示，批次提示回傳帶編號的 JSON 陣列
+
+    swap=True 時把批次回應的內容與編號一起對調，模擬模型把回應配錯對象。
+    """
+
+    def __init__(self, latency, swap=False):
+        self.latency = latency
+        self.swap = swap
+        self.calls = 0
+        self.batched_prompts = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        time.sleep(self.latency)
+        items = re.findall(r'^\[(\d+)\] (.*)$', prompt, re.MULTILINE)
+        with self._lock:
+            self.calls += 1
+            self.batched_prompts += [item for _, item in items]
+        if items:
+            replies = [{'id': int(i), 'reply': f"回應：{item}"} for i, item in items]
+            if self.swap:
+                replies.reverse()
+            text = json.dumps(replies, ensure_ascii=False)
+        else:
+            text = "回應：" + prompt.rsplit("使用者訊息：", 1)[-1]
+        return iter([FakeResponse(text)]) if stream else FakeResponse(text)
+
+def check_isolation():
+    """兩位使用者同時送出提示，確認回應不會交錯，帶對話脈絡的提示不會被合併"""
+    model = FakeModel(0.05, swap=True)
+    gemini_service.model = model
+    gemini_service.prompt_batcher = MicroBatcher('gemini', 200, 8, gemini_service._generate_batch,
+                                                 gemini_service._generate_single, workers=4)
+    prompts = {'shared-a': ("使用者 A 的問題", True), 'shared-b': ("使用者 B 的問題", True),
+               'context': ("最近的對話：使用者 C 的私人內容", False)}
+    replies = {}
+
+    def ask(name):
+        prompt, shared = prompts[name]
+        replies[name] = gemini_service.generate_text(prompt, shared=shared)
+
+    threads = [threading.Thread(target=ask, args=(name,)) for name in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, (prompt, _) in prompts.items():
+        assert replies[name] == f"回應：{prompt}", (name, replies[name])
+    assert not any("使用者 C" in prompt for prompt in model.batched_prompts), model.batched_prompts
+    gemini_service.generate_text.__wrapped__.cache_clear()
+
+def run(model, requests, rate):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(i):
+        started = time.perf_counter()
+        gemini_service.generate_text(f"測試訊息 {i} {random.random()}", shared=True)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    model.calls = 0
+    threads = []
+    for i in range(requests):
+        thread = threading.Thread(target=worker, args=(i,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(random.expovariate(rate))
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'avg_ms': sum(latencies) / len(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+        'upstream_calls': model.calls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=40, help="每秒抵達的請求數")
+    parser.add_argument('--window-ms', type=int, default=30)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    check_isolation()
+    model = FakeModel(args.llm_latency)
+    gemini_service.model = model
+
+    gemini_service.prompt_batcher = None
+    baseline = run(model, args.requests, args.rate)
+
+    batcher = MicroBatcher('gemini', args.window_ms, args.max_batch,
+                           gemini_service._generate_batch, gemini_service._generate_single, workers=32)
+    gemini_service.prompt_batcher = batcher
+    batched = run(model, args.requests, args.rate)
+
+    print(f"{'模式':<10}{'平均延遲 ms':>12}{'p95 ms':>10}{'上游呼叫':>10}")
+    print(f"{'逐一呼叫':<10}{baseline['avg_ms']:>12.1f}{baseline['p95_ms']:>10.1f}{baseline['upstream_calls']:>10}")
+    print(f"{'微批次':<10}{batched['avg_ms']:>12.1f}{batched['p95_ms']:>10.1f}{batched['upstream_calls']:>10}")
+    print(f"批次大小分佈：{batcher.get_stats()['batch_sizes']}")
+    print(f"平均排隊等待：{batcher.get_stats()['avg_wait_ms']} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""比較訊息正規化前後的快取命中率與每則訊息的正規化成本
+
+以 Zipf 分布抽出常見問題，每則隨機套用簡體、全形、空白與標點的寫法差異，量測兩種鍵：
+- 路由關鍵字與查詢參數（天氣、新聞、景點等由服務快取回答的問題）：鍵只取決於訊息本身
+- Gemini 的 lru_cache 鍵：與 app.py 相同，以 context_store.build_prompt(user_id, text) 組成，
+  包含該使用者的對話摘要與最近幾輪對話，命中的主要是還沒有對話紀錄的提示，
+  命中率取決於使用者數與每人訊息數（--users），通常遠低於前者
+    python benchmarks/bench_normalizer.py --messages 50000 --users 2000 --cache-size 100
+"""
+import argparse
+import os
+import sys
+import time
+from functools import lru_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from text_normalizer import TextNormalizer
+from conversation_context import ConversationContextStore
+
+# (繁體, 簡體) 兩種寫法的常見問題；前者由路由交給服務，後者交給 Gemini 對話
+ROUTED_QUESTIONS = [
+    ("台北天氣", "台北天气"), ("台中天氣", "台中天气"), ("高雄天氣", "高雄天气"),
+    ("新聞", "新闻"), ("運動新聞", "运动新闻"), ("娛樂新聞", "娱乐新闻"), ("科技新聞", "科技新闻"),
+    ("台北景點", "台北景点"), ("花蓮景點", "花莲景点"), ("台北交通", "台北交通"),
+    ("室內數據", "室内数据"), ("環境狀況", "环境状况"),
+]
+CHAT_QUESTIONS = [
+    ("今天適合出門嗎", "今天适合出门吗"), ("推薦一家好吃的餐廳", "推荐一家好吃的餐厅"),
+    ("明天會下雨嗎", "明天会下雨吗"), ("週末去哪裡玩", "周末去哪里玩"),
+    ("怎麼預防中暑", "怎么预防中暑"), ("颱風要來了嗎", "台风要来了吗"),
+]
+FULL_WIDTH = str.maketrans({chr(code): chr(code + 0xFEE0) for code in range(0x21, 0x7F)})
+
+def variant(text, rng):
+    """模擬使用者輸入的寫法差異：空白、全形、重複或全形標點"""
+    roll = rng.random()
+    if roll < 0.5:
+        return text
+    if roll < 0.65:
+        middle = len(text) // 2
+        return text[:middle] + " " + text[middle:]
+    if roll < 0.8:
+        return text + rng.choice(["？", "?", "？？", "!!", "！", "。"])
+    if roll < 0.9:
+        return " " + text + "  "
+    return text.translate(FULL_WIDTH) + "～"
+
+def sample(questions, count, simplified, rng):
+    picks = np.minimum(rng.zipf(1.3, count), len(questions)) - 1
+    return [variant(questions[i][int(rng.random() < simplified)], rng) for i in picks]
+
+def hit_rate(keys, cache_size):
+    @lru_cache(maxsize=cache_size)
+    def lookup(key):
+        return key
+    for key in keys:
+        lookup(key)
+    info = lookup.cache_info()
+    return info.hits / (info.hits + info.misses)
+
+def gemini_keys(users, messages, rng):
+    """依 app.py 的流程組出每則訊息的 Gemini 快取鍵
+
+    相同提示得到相同回覆（快取命中時即是如此），不同提示的回覆各不相同。
+    """
+    store = ConversationContextStore()
+    replies = {}
+    keys = []
+    for user, text in zip(rng.integers(0, users, len(messages)).tolist(), messages):
+        prompt = store.build_prompt(user, text)
+        keys.append(prompt)
+        store.add_turn(user, text, replies.setdefault(prompt, f"回覆 {len(replies)}"))
+    return keys
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--cache-size', type=int, default=100)
+    parser.add_argument('--simplified', type=float, default=0.3, help='使用簡體字的訊息比例')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    normalizer = TextNormalizer()
+    routed = sample(ROUTED_QUESTIONS, args.messages, args.simplified, rng)
+    started = time.perf_counter()
+    routed_normalized = [normalizer.normalize(message) for message in routed]
+    elapsed = time.perf_counter() - started
+
+    print(f"messages: {args.messages}, users: {args.users}, lru {args.cache_size}")
+    print(f"routed keys: distinct raw {len(set(routed))}, normalized {len(set(routed_normalized))}; "
+          f"hit rate raw {hit_rate(routed, args.cache_size):.1%}, "
+          f"normalized {hit_rate(routed_normalized, args.cache_size):.1%}")
+
+    chat = sample(CHAT_QUESTIONS, args.messages, args.simplified, rng)
+    chat_normalized = [normalizer.normalize(message) for message in chat]
+    raw_keys = gemini_keys(args.users, chat, np.random.default_rng(2))
+    normalized_keys = gemini_keys(args.users, chat_normalized, np.random.default_rng(2))
+    print(f"gemini keys (build_prompt with history): hit rate raw {hit_rate(raw_keys, args.cache_size):.1%}, "
+          f"normalized {hit_rate(normalized_keys, args.cache_size):.1%}")
+    print(f"normalize: {elapsed / args.messages * 1e6:.2f} us/message")
+
+if __name__ == '__main__':
+    main()
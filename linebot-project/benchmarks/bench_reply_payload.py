@@ -0,0 +1,57 @@
+"""比較 SDK 模型建構與預先序列化回覆內容的 CPU 成本
+
+只量測組出請求內容的時間，不會呼叫 LINE API：
+    python benchmarks/bench_reply_payload.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from linebot.v3.messaging import ApiClient, Configuration, ReplyMessageRequest, TextMessage
+from line_messaging import render_messages, reply_body
+
+TEXTS = {
+    '罐頭回覆': "系統忙碌中，請稍後再試。",
+    '新聞摘要': "📰 最新新聞：\n\n" + "".join(
+        f"{i}. 測試新聞標題第 {i} 則，內容約三十個字的長度\n   來源：測試來源\n   連結：https://example.com/news/{i}\n\n"
+        for i in range(1, 6)
+    ),
+}
+
+def sdk_body(api_client, token, text):
+    """SDK 的做法：每次建立 pydantic 模型，再轉為 dict 與 JSON"""
+    request = ReplyMessageRequest(reply_token=token, messages=[TextMessage(text=text)])
+    return json.dumps(api_client.sanitize_for_serialization(request)).encode('utf-8')
+
+def fast_body(token, text):
+    return reply_body(token, render_messages(text))
+
+def measure(func, tokens):
+    started = time.perf_counter()
+    for token in tokens:
+        func(token)
+    return (time.perf_counter() - started) / len(tokens) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    api_client = ApiClient(Configuration(access_token='benchmark'))
+    tokens = [uuid.uuid4().hex for _ in range(args.iterations)]
+
+    print(f"{'內容':<10}{'SDK µs':>10}{'預先序列化 µs':>16}{'倍數':>8}")
+    for name, text in TEXTS.items():
+        # 兩種做法產生的內容必須相同
+        assert json.loads(sdk_body(api_client, tokens[0], text)) == json.loads(fast_body(tokens[0], text))
+        sdk = measure(lambda token: sdk_body(api_client, token, text), tokens)
+        fast = measure(lambda token: fast_body(token, text), tokens)
+        print(f"{name:<10}{sdk:>10.2f}{fast:>16.2f}{sdk / fast:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""量測感測器封存格式的壓縮率、寫入與範圍查詢速度
+
+以模擬的 DHT11 讀數（每 2 秒一筆）寫入暫存目錄，不會動到正式封存：
+    python benchmarks/bench_sensor_archive.py --days 7
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from sensor_archive import SensorArchive
+
+def simulate(count, seed=0):
+    """溫濕度偶爾以 1 度／1% 變動，時間間隔帶有數十毫秒的抖動"""
+    rng = np.random.default_rng(seed)
+    steps = lambda: np.cumsum(rng.integers(-1, 2, count) * (rng.random(count) < 0.05))
+    timestamps = 1_700_000_000_000 + np.arange(count) * 2000 + rng.integers(-30, 30, count)
+    return timestamps, 25 + steps(), 60 + steps()
+
+def check_restart(directory):
+    """重啟後續寫未滿的檔尾區塊，不能遺失重啟前的讀數"""
+    archive = SensorArchive(directory)
+    for i in range(10):
+        archive.append({'temperature': 25, 'humidity': 60}, device='restart', timestamp=i * 2000)
+    archive.flush()
+    archive = SensorArchive(directory)
+    for i in range(10, 15):
+        archive.append({'temperature': 26, 'humidity': 61}, device='restart', timestamp=i * 2000)
+    archive.flush()
+    result = SensorArchive(directory).scan(0, 15 * 2000, device='restart')
+    assert np.array_equal(result['timestamp'], np.arange(15) * 2000), result['timestamp']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    count = int(args.days * 86400 / 2)
+    timestamps, temperatures, humidities = simulate(count)
+    with tempfile.TemporaryDirectory() as directory:
+        archive = SensorArchive(directory)
+        started = time.perf_counter()
+        for ts, temperature, humidity in zip(timestamps.tolist(), temperatures.tolist(), humidities.tolist()):
+            archive.append({'temperature': temperature, 'humidity': humidity}, timestamp=ts)
+        archive.flush()
+        append_us = (time.perf_counter() - started) / count * 1e6
+
+        size = os.path.getsize(archive.path('default'))
+        json_size = sum(len(json.dumps({'temperature': t, 'humidity': h, 'timestamp': ts}))
+                        for ts, t, h in zip(timestamps[:1000].tolist(), temperatures[:1000].tolist(),
+                                            humidities[:1000].tolist())) / 1000 * count
+
+        # 封存內容必須與原始讀數相同
+        result = SensorArchive(directory).scan(int(timestamps[0]), int(timestamps[-1]))
+        assert np.array_equal(result['timestamp'], timestamps)
+        assert np.allclose(result['temperature'], temperatures)
+        check_restart(directory)
+
+        rng = np.random.default_rng(1)
+        print(f"{'讀數':<8}{count:>12,}")
+        print(f"{'每筆位元組':<8}{size / count:>12.2f}（JSON 約 {json_size / count:.0f}）")
+        print(f"{'每筆寫入 µs':<8}{append_us:>12.2f}")
+        for hours in (1, 24):
+            span = hours * 3600 * 1000
+            starts = rng.integers(int(timestamps[0]), int(timestamps[-1]) - span, args.queries)
+            started = time.perf_counter()
+            for start in starts.tolist():
+                archive.scan(start, start + span)
+            elapsed = (time.perf_counter() - started) / args.queries * 1e3
+            print(f"{f'{hours} 小時查詢 ms':<8}{elapsed:>12.3f}")
+
+if __name__ == "__main__":
+    main()
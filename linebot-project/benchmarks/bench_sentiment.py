@@ -0,0 +1,76 @@
+"""比較 process_message 三種情緒分析模式的延遲與 LLM 呼叫次數
+
+使用模擬的 Gemini 模型（固定延遲），不會呼叫真正的 API：
+    python benchmarks/bench_sentiment.py --llm-latency 0.8 --messages 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gemini_service
+import sentiment
+import services
+
+SAMPLE_MESSAGES = [
+    "今天好開心，謝謝你的幫忙！",
+    "塞車塞到受不了，真的很煩",
+    "請問明天適合出門嗎",
+    "我不太開心，工作壓力好大",
+    "推薦一下台中好玩的地方",
+]
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """以固定延遲模擬 Gemini 的生成呼叫"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        time.sleep(self.latency)
+        if "輸出格式" in prompt:
+            text = json.dumps({"reply": "了解，以下是我的建議。", "sentiment": "neutral"}, ensure_ascii=False)
+        else:
+            text = "了解，以下是我的建議。"
+        return iter([FakeResponse(text)]) if stream else FakeResponse(text)
+
+def run_mode(mode, model, count):
+    services.SENTIMENT_MODE = mode
+    model.calls = 0
+    started = time.perf_counter()
+    for i in range(count):
+        # 每則訊息不同，避免命中 generate_text 的 lru_cache
+        services.process_message(f"{SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)]} #{mode}{i}")
+    elapsed = time.perf_counter() - started
+    return elapsed / count, model.calls / count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="模擬每次 LLM 呼叫的秒數")
+    parser.add_argument('--messages', type=int, default=10)
+    args = parser.parse_args()
+
+    model = FakeModel(args.llm_latency)
+    gemini_service.model = model
+
+    number = 20000
+    per_call = timeit.timeit(lambda: sentiment.classify(SAMPLE_MESSAGES[3]), number=number) / number
+    print(f"本地詞典分類：{per_call * 1e6:.1f} µs / 則")
+
+    print(f"{'模式':<10}{'平均延遲 (秒)':>14}{'LLM 呼叫 / 則':>14}")
+    for mode in ('llm', 'combined', 'local'):
+        latency, calls = run_mode(mode, model, args.messages)
+        print(f"{mode:<10}{latency:>14.3f}{calls:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""比較 SDK WebhookParser 與輕量解析器的每事件解析時間
+
+以本機產生並簽章的 webhook 內容量測，不需要連線：
+    python benchmarks/bench_webhook_parser.py --events 5 --iterations 5000
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from linebot.v3 import WebhookParser
+from webhook_parser import FastWebhookParser
+
+SECRET = 'benchmark-channel-secret'
+
+def text_event(i):
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'source': {'type': 'user', 'userId': f"U{uuid.uuid4().hex}"},
+        'webhookEventId': f"01H{uuid.uuid4().hex[:23].upper()}",
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': uuid.uuid4().hex,
+        'message': {'id': str(10 ** 17 + i), 'type': 'text', 'quoteToken': uuid.uuid4().hex, 'text': f"台北天氣 {i}"},
+    }
+
+def measure(func, iterations, events):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / (iterations * events) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=5, help="每個 webhook 內的事件數")
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    body = json.dumps({'destination': 'Ubench', 'events': [text_event(i) for i in range(args.events)]},
+                      ensure_ascii=False).encode('utf-8')
+    signature = base64.b64encode(hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).digest()).decode('ascii')
+    text_body = body.decode('utf-8')
+
+    sdk_parser = WebhookParser(SECRET)
+    fast_parser = FastWebhookParser(SECRET)
+
+    # 兩者取出的路由欄位必須相同
+    for sdk_event, fast_event in zip(sdk_parser.parse(text_body, signature), fast_parser.parse(body, signature)):
+        assert sdk_event.source.user_id == fast_event.source.user_id
+        assert sdk_event.message.text == fast_event.message.text
+        assert sdk_event.reply_token == fast_event.reply_token
+        assert sdk_event.webhook_event_id == fast_event.webhook_event_id
+
+    def hydrate_all():
+        for event in fast_parser.parse(body, signature):
+            event.model
+
+    sdk = measure(lambda: sdk_parser.parse(text_body, signature), args.iterations, args.events)
+    fast = measure(lambda: fast_parser.parse(body, signature), args.iterations, args.events)
+    lazy = measure(hydrate_all, args.iterations, args.events)
+
+    print(f"{'解析方式':<16}{'每事件 µs':>12}")
+    print(f"{'SDK WebhookParser':<16}{sdk:>12.2f}")
+    print(f"{'輕量解析':<16}{fast:>12.2f}")
+    print(f"{'輕量解析＋建立模型':<16}{lazy:>12.2f}")
+    print(f"文字事件加速 {sdk / fast:.1f} 倍")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+import deadline
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 預設斷路器設定，可用 CIRCUIT_<名稱>_<設定> 針對個別依賴覆寫
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv('CIRCUIT_RECOVERY_TIMEOUT', '30'))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv('CIRCUIT_PROBE_INTERVAL', '5'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，呼叫被直接拒絕"""
+
+class CircuitBreaker:
+    """單一外部依賴的斷路器（closed / open / half-open）"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout=CIRCUIT_RECOVERY_TIMEOUT, probe_interval=CIRCUIT_PROBE_INTERVAL):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_probe = 0.0
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """判斷目前是否允許呼叫；half-open 時限制探測頻率"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                self.last_probe = 0.0
+                logger.info(f"斷路器 {self.name} 進入 half-open 狀態")
+
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and now - self.last_probe >= self.probe_interval:
+                self.last_probe = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"斷路器 {self.name} 探測成功，恢復 closed 狀態")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"斷路器 {self.name} 開啟（連續失敗 {self.failures} 次）")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """透過斷路器呼叫函數，開啟時拋出 CircuitOpenError"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} 服務暫時無法使用")
+        try:
+            result = func(*args, **kwargs)
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            # 因請求期限耗盡而中斷的呼叫不代表依賴異常
+            if not deadline.expired():
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def get_stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'times_opened': self.times_opened,
+        }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def _setting(name, key, default, cast):
+    value = os.getenv(f'CIRCUIT_{name.upper()}_{key}')
+    return cast(value) if value else default
+
+def get_breaker(name):
+    """取得（或建立）指定依賴的斷路器"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=_setting(name, 'FAILURE_THRESHOLD', CIRCUIT_FAILURE_THRESHOLD, int),
+                recovery_timeout=_setting(name, 'RECOVERY_TIMEOUT', CIRCUIT_RECOVERY_TIMEOUT, float),
+                probe_interval=_setting(name, 'PROBE_INTERVAL', CIRCUIT_PROBE_INTERVAL, float)
+            )
+            _breakers[name] = breaker
+        return breaker
+
+def get_all_stats():
+    """回傳所有斷路器的狀態"""
+    return {name: breaker.get_stats() for name, breaker in list(_breakers.items())}
@@ -0,0 +1,165 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import logging
+from dotenv import load_dotenv
+from gemini_service import generate_text
+import firebase_service
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 對話脈絡設定
+CONTEXT_MAX_USERS = int(os.getenv('CONTEXT_MAX_USERS', '5000'))
+CONTEXT_MAX_TURNS = int(os.getenv('CONTEXT_MAX_TURNS', '6'))
+CONTEXT_TURN_CHARS = int(os.getenv('CONTEXT_TURN_CHARS', '200'))
+CONTEXT_SUMMARY_CHARS = int(os.getenv('CONTEXT_SUMMARY_CHARS', '300'))
+
+class UserContext:
+    """單一使用者的對話脈絡：較早對話的摘要加上最近幾輪原文"""
+
+    def __init__(self, turns=(), max_turns=CONTEXT_MAX_TURNS):
+        self.summary = ""
+        self.turns = deque(turns)
+        self.max_turns = max_turns
+        self.summarizing = False
+
+class ConversationContextStore:
+    """以 LRU 保存使用者對話脈絡，只有冷使用者才從 Firestore 載入"""
+
+    def __init__(self, loader=None, summarizer=None, max_users=CONTEXT_MAX_USERS,
+                 max_turns=CONTEXT_MAX_TURNS):
+        self.loader = loader
+        self.summarizer = summarizer
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self.hits = 0
+        self.hydrations = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # 摘要在背景執行，不佔用回覆路徑
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='context-summary')
+
+    def get(self, user_id):
+        """取得使用者脈絡；記憶體中沒有時從 Firestore 載入"""
+        with self._lock:
+            context = self._users.get(user_id)
+            if context is not None:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return context
+
+        context = UserContext(self._hydrate(user_id), self.max_turns)
+        with self._lock:
+            # 載入期間其他執行緒可能已建立脈絡
+            existing = self._users.get(user_id)
+            if existing is not None:
+                return existing
+            self._users[user_id] = context
+            self.hydrations += 1
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return context
+
+    def _hydrate(self, user_id):
+        if self.loader is None:
+            return []
+        try:
+            records = self.loader(user_id, limit=self.max_turns)
+        except Exception as e:
+            logger.warning(f"載入使用者 {user_id} 的對話記錄失敗: {e}")
+            return []
+        # Firestore 依時間倒序回傳，轉為由舊到新
+        return [
+            (record.get('user_message', ''), _clip(record.get('bot_response', '')))
+            for record in reversed(records)
+        ]
+
+    def add_turn(self, user_id, user_message, bot_response):
+        """記錄一輪對話，超出保留輪數的舊對話交由背景摘要"""
+        context = self.get(user_id)
+        with self._lock:
+            context.turns.append((user_message, _clip(bot_response)))
+            if len(context.turns) <= context.max_turns or context.summarizing:
+                return
+            old_turns = []
+            while len(context.turns) > context.max_turns // 2:
+                old_turns.append(context.turns.popleft())
+            context.summarizing = True
+        self._executor.submit(self._compact, context, old_turns)
+
+    def _compact(self, context, old_turns):
+        try:
+            summary = None
+            if self.summarizer is not None:
+                summary = self.summarizer(context.summary, old_turns)
+            context.summary = summary or _fallback_summary(context.summary, old_turns)
+        except Exception as e:
+            logger.warning(f"生成對話摘要失敗: {e}")
+            context.summary = _fallback_summary(context.summary, old_turns)
+        finally:
+            context.summarizing = False
+
+    def build_prompt(self, user_id, user_message):
+        """組合包含摘要與最近對話的提示"""
+        context = self.get(user_id)
+        with self._lock:
+            summary = context.summary
+            turns = list(context.turns)
+
+        lines = []
+        if summary:
+            lines.append(f"先前對話摘要：{summary}")
+        if turns:
+            lines.append("最近的對話：")
+            for said, replied in turns:
+                lines.append(f"使用者：{said}")
+                lines.append(f"助理：{replied}")
+        lines.append(f"使用者說：「{user_message}」。請以市民助理的身份自然地回應。")
+        return "\n".join(lines)
+
+    def has_context(self, user_id):
+        """使用者是否有對話摘要或最近的對話；沒有時提示不含個人內容"""
+        context = self.get(user_id)
+        with self._lock:
+            return bool(context.summary or context.turns)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'hits': self.hits,
+                'hydrations': self.hydrations,
+            }
+
+def _clip(text, limit=CONTEXT_TURN_CHARS):
+    text = text or ""
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def _fallback_summary(previous, turns, limit=CONTEXT_SUMMARY_CHARS):
+    """無法使用 LLM 時，以使用者先前的提問作為摘要"""
+    topics = "；".join(said for said, _ in turns)
+    summary = f"{previous}；{topics}" if previous else topics
+    return summary[-limit:]
+
+def summarize_with_gemini(previous, turns):
+    """以 Gemini 將舊對話壓縮為摘要"""
+    dialogue = "\n".join(f"使用者：{said}\n助理：{replied}" for said, replied in turns)
+    prompt = f"""請將以下對話整理成不超過 {CONTEXT_SUMMARY_CHARS} 字的摘要，保留使用者的需求、地點與偏好。
+既有摘要：{previous or "無"}
+新的對話：
+{dialogue}"""
+    summary = generate_text(prompt, temperature=0.3)
+    if not summary or summary.startswith("抱歉"):
+        return None
+    return summary[:CONTEXT_SUMMARY_CHARS]
+
+# 全域共用的對話脈絡
+context_store = ConversationContextStore(
+    loader=firebase_service.get_user_conversations,
+    summarizer=summarize_with_gemini
+)
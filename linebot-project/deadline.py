@@ -0,0 +1,73 @@
+import contextvars
+from contextlib import contextmanager
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# LINE 回覆權杖只在收到 webhook 後的短時間內有效，保留安全餘裕
+REPLY_DEADLINE_SECONDS = float(os.getenv('REPLY_DEADLINE_SECONDS', '25'))
+
+class DeadlineExceeded(Exception):
+    """請求期限已過，繼續處理的結果已無法送達"""
+
+class Deadline:
+    """單一請求的截止時間"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+_current = contextvars.ContextVar('request_deadline', default=None)
+
+@contextmanager
+def scope(seconds=REPLY_DEADLINE_SECONDS):
+    """在區塊內設定請求期限；seconds 為 None 時解除期限"""
+    token = _current.set(Deadline(seconds) if seconds is not None else None)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+def current():
+    return _current.get()
+
+def remaining(default=None):
+    """剩餘秒數；沒有期限時回傳 default"""
+    deadline = _current.get()
+    return default if deadline is None else deadline.remaining()
+
+def expired():
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+def check(what="請求"):
+    """期限已過時拋出 DeadlineExceeded"""
+    if expired():
+        raise DeadlineExceeded(f"{what}已超過回覆期限")
+
+def can_wait(seconds):
+    """等待指定秒數後是否仍在期限內"""
+    deadline = _current.get()
+    return deadline is None or deadline.remaining() > seconds
+
+def clamp_timeout(timeout):
+    """將逾時設定（秒數或 (連線, 讀取) tuple）限制在剩餘期限內"""
+    deadline = _current.get()
+    if deadline is None:
+        return timeout
+    left = deadline.remaining()
+    if left <= 0:
+        raise DeadlineExceeded("請求已超過回覆期限")
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)
+    return min(timeout, left)
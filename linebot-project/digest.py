@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone
+import os
+import uuid
+import logging
+from dotenv import load_dotenv
+import firebase_service
+import services
+from line_messaging import messenger, MULTICAST_MAX_RECIPIENTS
+from scheduler import schedule
+from weather_service import weather_engine
+from follower_registry import registry
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每日摘要設定：multicast 會計入頻道的每月訊息額度，預設不啟用
+DIGEST_ENABLED = os.getenv('DIGEST_ENABLED', 'false').lower() == 'true'
+DIGEST_TIME = os.getenv('DIGEST_TIME', '07:00')  # 台灣時間
+# 只在發送時間後的這段分鐘數內開始當日發送，避免晚間才啟動時送出早報；已開始但未完成的發送不受限制
+DIGEST_SEND_WINDOW = int(os.getenv('DIGEST_SEND_WINDOW', '60'))
+DIGEST_CHECK_INTERVAL = 60
+TAIWAN_TZ = timezone(timedelta(hours=8))
+LINE_TEXT_LIMIT = 5000
+# retry key 由執行日、分群與批次的第一位收件者決定，重啟後重送同一批次會得到相同的 key
+RETRY_KEY_NAMESPACE = uuid.UUID('6f1c2a52-3d0e-4c7b-9a55-0b8f3c1d2e47')
+
+def resolve_city(location):
+    """將使用者輸入的地名轉為縣市名稱"""
+    name = weather_engine.resolve(location)
+    return weather_engine.locations[name][2] if name else None
+
+def subscribe(user_id, location):
+    """訂閱每日摘要，回傳回覆訊息"""
+    city = resolve_city(location)
+    if city is None:
+        return f"找不到 {location}，請輸入台灣的縣市或鄉鎮市區，例如「訂閱早報 台中」。"
+    registry.set_profile(user_id, city=city, digest=True)
+    return f"已訂閱 {city} 的每日天氣與新聞摘要，每天 {DIGEST_TIME} 發送。輸入「取消訂閱早報」即可停止。"
+
+def unsubscribe(user_id):
+    registry.set_profile(user_id, digest=False)
+    return "已取消每日天氣與新聞摘要。"
+
+def render_digest(city, news):
+    """每個縣市只產生一次摘要內容，分成天氣與新聞兩則訊息"""
+    weather = services.get_weather(city)
+    return [f"☀️ 今日天氣與新聞\n\n{weather}"[:LINE_TEXT_LIMIT], news[:LINE_TEXT_LIMIT]]
+
+def chunks(recipients, after=None, size=MULTICAST_MAX_RECIPIENTS):
+    """排序後切分；after 為上次送達的最後一位收件者，只切分排在其後的收件者"""
+    ordered = sorted(recipient for recipient in recipients if after is None or recipient > after)
+    return [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+class DigestJob:
+    """每日依縣市分群發送摘要，進度（已送達的最後一位收件者）記錄在 Firestore，中斷後從其後繼續
+
+    進度以收件者而非批次序號記錄，重啟前後訂閱者有增減時批次邊界雖會改變，
+    已送達的收件者仍不會重複收到，也不會有人被跳過。
+    """
+
+    def __init__(self, audience=registry.digest_audience, send_time=DIGEST_TIME, send_window=DIGEST_SEND_WINDOW):
+        self.audience = audience
+        hour, minute = send_time.split(':')
+        self.send_time = (int(hour), int(minute))
+        self.send_window = send_window
+        self.last_run_id = None
+        self.runs_skipped = 0
+        self.renders = 0
+        self.chunks_sent = 0
+        self.recipients_skipped = 0
+        self.recipients = 0
+
+    def due_run_id(self, now=None):
+        """在發送時間窗內回傳當日的 run id，否則回傳 None
+
+        超過時間窗後只繼續已開始但未完成的發送；當日尚未開始時直接略過，不再補發。
+        """
+        now = now or datetime.now(TAIWAN_TZ)
+        late = (now.hour - self.send_time[0]) * 60 + now.minute - self.send_time[1]
+        if late < 0:
+            return None
+        run_id = now.strftime('%Y-%m-%d')
+        if run_id == self.last_run_id:
+            return None
+        if late < self.send_window:
+            return run_id
+
+        checkpoint = firebase_service.get_digest_checkpoint(run_id)
+        if checkpoint and not checkpoint.get('completed'):
+            return run_id
+        if not checkpoint:
+            self.runs_skipped += 1
+            logger.warning(f"已超過摘要發送時間 {self.send_time[0]:02d}:{self.send_time[1]:02d} 達 {late} 分鐘，略過 {run_id} 的摘要")
+        self.last_run_id = run_id
+        return None
+
+    def tick(self):
+        run_id = self.due_run_id()
+        if run_id is not None:
+            self.run(run_id)
+
+    def run(self, run_id):
+        checkpoint = firebase_service.get_digest_checkpoint(run_id)
+        if checkpoint.get('completed'):
+            self.last_run_id = run_id
+            return
+
+        segments = self.audience()
+        news = services.get_news('general')
+        self.renders += 1
+        for city, recipients in sorted(segments.items()):
+            if not city or not recipients:
+                continue
+            last_sent = checkpoint.get(city)
+            batches = chunks(recipients, after=last_sent)
+            if not batches:
+                continue
+            messages = render_digest(city, news)
+            self.renders += 1
+            self.recipients_skipped += len(recipients) - sum(map(len, batches))
+            for index, batch in enumerate(batches):
+                retry_key = str(uuid.uuid5(RETRY_KEY_NAMESPACE, f"{run_id}:{city}:{batch[0]}"))
+                if not messenger.multicast(batch, messages, retry_key):
+                    # 留待下次檢查時從這一批重試
+                    logger.error(f"{city} 第 {index + 1} 批摘要發送失敗，稍後重試")
+                    return
+                firebase_service.save_digest_checkpoint(run_id, city, batch[-1])
+                self.chunks_sent += 1
+                self.recipients += len(batch)
+            logger.info(f"{city} 摘要已發送給 {sum(map(len, batches))} 位訂閱者（{len(batches)} 批）")
+
+        firebase_service.save_digest_checkpoint(run_id, 'completed', True)
+        self.last_run_id = run_id
+
+    def get_stats(self):
+        return {
+            'enabled': DIGEST_ENABLED,
+            'send_time': DIGEST_TIME,
+            'last_run': self.last_run_id,
+            'runs_skipped': self.runs_skipped,
+            'renders': self.renders,
+            'chunks_sent': self.chunks_sent,
+            'recipients_skipped': self.recipients_skipped,
+            'recipients': self.recipients,
+        }
+
+# 全域共用的每日摘要工作
+digest_job = DigestJob()
+
+def start():
+    """啟動每日摘要的定時檢查"""
+    if not DIGEST_ENABLED:
+        return
+    schedule('daily-digest', DIGEST_CHECK_INTERVAL, digest_job.tick, initial_delay=30, jitter=0)
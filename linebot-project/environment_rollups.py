@@ -0,0 +1,203 @@
+from collections import deque
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+import firebase_service
+from scheduler import schedule
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 環境數據彙總設定：原始讀數只保留在記憶體，Firestore 只寫入分鐘與小時彙總
+RAW_WINDOW_SECONDS = int(os.getenv('RAW_WINDOW_SECONDS', '600'))
+ROLLUP_FLUSH_INTERVAL = int(os.getenv('ROLLUP_FLUSH_INTERVAL', '60'))
+MINUTE_ROLLUPS_KEPT = 24 * 60  # 記憶體保留一天的分鐘彙總
+HOUR_ROLLUPS_KEPT = 30 * 24    # 記憶體保留三十天的小時彙總
+METRICS = ('temperature', 'humidity')
+LEVELS = {'minute': 60, 'hour': 3600}
+
+class Rollup:
+    """單一時間區間的彙總：筆數、最小、最大、平均與最後一筆"""
+
+    __slots__ = ('device', 'level', 'start', 'count', 'min', 'max', 'sum', 'last')
+
+    def __init__(self, device, level, start):
+        self.device = device
+        self.level = level
+        self.start = start
+        self.count = 0
+        self.min = {}
+        self.max = {}
+        self.sum = {}
+        self.last = {}
+
+    def add(self, values):
+        self.count += 1
+        for metric, value in values.items():
+            self.min[metric] = min(self.min.get(metric, value), value)
+            self.max[metric] = max(self.max.get(metric, value), value)
+            self.sum[metric] = self.sum.get(metric, 0) + value
+            self.last[metric] = value
+
+    def merge(self, other):
+        """將較細的彙總併入（分鐘併入小時）"""
+        self.count += other.count
+        for metric in other.sum:
+            self.min[metric] = min(self.min.get(metric, other.min[metric]), other.min[metric])
+            self.max[metric] = max(self.max.get(metric, other.max[metric]), other.max[metric])
+            self.sum[metric] = self.sum.get(metric, 0) + other.sum[metric]
+            self.last[metric] = other.last[metric]
+
+    @property
+    def doc_id(self):
+        # 以裝置、層級與起始時間作為文件 ID，重送時覆寫同一份文件
+        return f"{self.device}_{self.level}_{self.start}"
+
+    def to_dict(self):
+        return {
+            'device': self.device,
+            'level': self.level,
+            'start': self.start,
+            'count': self.count,
+            **{f"{metric}_min": self.min[metric] for metric in self.min},
+            **{f"{metric}_max": self.max[metric] for metric in self.max},
+            **{f"{metric}_mean": round(self.sum[metric] / self.count, 2) for metric in self.sum},
+            **{f"{metric}_last": self.last[metric] for metric in self.last},
+        }
+
+class RollupEngine:
+    """收集感測器讀數，產生分鐘／小時彙總並批次寫入 Firestore"""
+
+    def __init__(self, writer=None, reader=None, raw_window=RAW_WINDOW_SECONDS):
+        self.writer = writer
+        self.reader = reader
+        self.raw_window = raw_window
+        self.readings = 0
+        self.rollups_written = 0
+        self.batches = 0
+        self.write_failures = 0
+        self._raw = {}       # 裝置 -> deque[(時間, 讀數)]
+        self._open = {}      # (裝置, 層級) -> 尚未結束的 Rollup
+        self._closed = {level: {} for level in LEVELS}  # 層級 -> 裝置 -> deque[Rollup]
+        self._pending = []   # 已結束、等待寫入的 Rollup
+        self._lock = threading.Lock()
+
+    def add(self, values, device='default', now=None):
+        """加入一筆讀數，values 例如 {'temperature': 25.1, 'humidity': 60}"""
+        now = time.time() if now is None else now
+        values = {metric: float(values[metric]) for metric in METRICS if values.get(metric) is not None}
+        with self._lock:
+            self.readings += 1
+            raw = self._raw.setdefault(device, deque())
+            raw.append((now, values))
+            while raw and raw[0][0] < now - self.raw_window:
+                raw.popleft()
+            self._rollover(device, now)
+            self._open[(device, 'minute')].add(values)
+
+    def _rollover(self, device, now):
+        """時間跨過分鐘或小時邊界時結束舊的彙總；呼叫端須持有鎖"""
+        for level, seconds in LEVELS.items():
+            start = int(now // seconds * seconds)
+            current = self._open.get((device, level))
+            if current is not None and current.start == start:
+                continue
+            if current is not None:
+                if level == 'minute' and (device, 'hour') in self._open:
+                    self._open[(device, 'hour')].merge(current)
+                self._close(current)
+            self._open[(device, level)] = Rollup(device, level, start)
+
+    def _close(self, rollup):
+        if rollup.count == 0:
+            return
+        kept = MINUTE_ROLLUPS_KEPT if rollup.level == 'minute' else HOUR_ROLLUPS_KEPT
+        self._closed[rollup.level].setdefault(rollup.device, deque(maxlen=kept)).append(rollup)
+        self._pending.append(rollup)
+
+    def flush(self, now=None):
+        """結束已過時的彙總，並以批次寫入 Firestore"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for device in {device for device, _ in self._open}:
+                self._rollover(device, now)
+            pending, self._pending = self._pending, []
+        if not pending or self.writer is None:
+            return
+        try:
+            self.writer([rollup.to_dict() | {'id': rollup.doc_id} for rollup in pending])
+            self.rollups_written += len(pending)
+            self.batches += 1
+        except Exception as e:
+            # 寫入失敗時放回佇列，下次再試；文件 ID 固定，不會重複
+            self.write_failures += 1
+            logger.error(f"寫入環境數據彙總失敗: {e}")
+            with self._lock:
+                self._pending = pending + self._pending
+
+    def latest(self, device='default'):
+        with self._lock:
+            raw = self._raw.get(device)
+            if not raw:
+                return None
+            timestamp, values = raw[-1]
+            return {**values, 'timestamp': int(timestamp * 1000)}
+
+    def history(self, seconds, resolution=60, device='default', now=None):
+        """查詢過去 seconds 秒的資料，從能滿足 resolution（秒）的最粗層級回答
+
+        回傳 (層級, 資料列表)；原始讀數只在查詢範圍落在記憶體視窗內時使用。
+        """
+        now = time.time() if now is None else now
+        since = now - seconds
+        if resolution < LEVELS['minute'] and seconds <= self.raw_window:
+            with self._lock:
+                raw = list(self._raw.get(device, ()))
+            return 'raw', [{**values, 'timestamp': int(ts * 1000)} for ts, values in raw if ts >= since]
+
+        level = 'hour' if resolution >= LEVELS['hour'] else 'minute'
+        kept = (MINUTE_ROLLUPS_KEPT if level == 'minute' else HOUR_ROLLUPS_KEPT) * LEVELS[level]
+        if seconds <= kept or self.reader is None:
+            with self._lock:
+                rollups = [rollup.to_dict() for rollup in self._closed[level].get(device, ())
+                           if rollup.start >= since]
+                current = self._open.get((device, level))
+                if level == 'hour' and current is not None:
+                    # 進行中的小時尚未併入本分鐘的讀數，查詢時一併計入
+                    current = self._merged_hour(device, current)
+                if current is not None and current.count:
+                    rollups.append(current.to_dict())
+            return level, rollups
+        return level, self.reader(level, since, now, device)
+
+    def _merged_hour(self, device, hour):
+        merged = Rollup(device, 'hour', hour.start)
+        merged.merge(hour)
+        minute = self._open.get((device, 'minute'))
+        if minute is not None and minute.count:
+            merged.merge(minute)
+        return merged
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'readings': self.readings,
+                'raw_window': sum(len(raw) for raw in self._raw.values()),
+                'pending': len(self._pending),
+                'rollups_written': self.rollups_written,
+                'batches': self.batches,
+                'write_failures': self.write_failures,
+            }
+
+# 全域共用的環境數據彙總
+rollup_engine = RollupEngine(writer=firebase_service.save_environment_rollups,
+                             reader=firebase_service.get_environment_rollups)
+
+def start():
+    """啟動彙總資料的定期批次寫入"""
+    schedule('environment-rollups', ROLLUP_FLUSH_INTERVAL, rollup_engine.flush, initial_delay=ROLLUP_FLUSH_INTERVAL)
@@ -0,0 +1,177 @@
+from collections import deque
+from functools import wraps
+import hashlib
+import math
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 事件去重設定
+DEDUP_BACKEND = os.getenv('DEDUP_BACKEND', 'memory').lower()  # memory、bloom 或 redis
+DEDUP_TTL = int(os.getenv('DEDUP_TTL', '600'))
+DEDUP_BUCKETS = int(os.getenv('DEDUP_BUCKETS', '10'))
+DEDUP_MAX_EVENTS = int(os.getenv('DEDUP_MAX_EVENTS', '100000'))
+DEDUP_FALSE_POSITIVE_RATE = float(os.getenv('DEDUP_FALSE_POSITIVE_RATE', '0.0001'))
+REDIS_URL = os.getenv('REDIS_URL')
+
+class SeenSet:
+    """依時間分桶的已處理事件集合；整桶過期後直接丟棄，大小受上限限制"""
+
+    def __init__(self, ttl=DEDUP_TTL, buckets=DEDUP_BUCKETS, max_events=DEDUP_MAX_EVENTS):
+        self.ttl = ttl
+        self.bucket_seconds = ttl / buckets
+        self.buckets = buckets
+        self.bucket_capacity = max(max_events // buckets, 1)
+        self._buckets = deque()  # (開始時間, 集合)
+        self._lock = threading.Lock()
+
+    def _rotate(self, now):
+        if (not self._buckets or now - self._buckets[-1][0] >= self.bucket_seconds
+                or len(self._buckets[-1][1]) >= self.bucket_capacity):
+            self._buckets.append((now, self._new_bucket()))
+        # 整桶過期或桶數超過上限時丟棄最舊的桶
+        while now - self._buckets[0][0] >= self.ttl or len(self._buckets) > self.buckets:
+            self._buckets.popleft()
+
+    def _new_bucket(self):
+        return set()
+
+    def check_and_add(self, key):
+        """回傳 key 是否已出現過；未出現時記錄下來"""
+        with self._lock:
+            self._rotate(time.monotonic())
+            if any(key in bucket for _, bucket in self._buckets):
+                return True
+            self._buckets[-1][1].add(key)
+            return False
+
+    def size(self):
+        with self._lock:
+            return sum(len(bucket) for _, bucket in self._buckets)
+
+class BloomBucket:
+    """固定大小的 Bloom filter，以雙重雜湊產生 k 個位置"""
+
+    def __init__(self, capacity, false_positive_rate):
+        self.bits = max(int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+class BloomSeenSet(SeenSet):
+    """以 Bloom filter 取代集合的分桶去重，記憶體用量固定，可能有少量誤判為重複"""
+
+    def __init__(self, ttl=DEDUP_TTL, buckets=DEDUP_BUCKETS, max_events=DEDUP_MAX_EVENTS,
+                 false_positive_rate=DEDUP_FALSE_POSITIVE_RATE):
+        super().__init__(ttl, buckets, max_events)
+        # 查詢時會檢查所有桶，整體誤判率約為各桶誤判率之和
+        self.false_positive_rate = false_positive_rate / buckets
+
+    def _new_bucket(self):
+        return BloomBucket(self.bucket_capacity, self.false_positive_rate)
+
+class RedisSeenSet:
+    """以 Redis SET NX EX 記錄事件，多個 worker 共用同一份去重資料"""
+
+    def __init__(self, url=REDIS_URL, ttl=DEDUP_TTL, prefix='linebot:event:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def check_and_add(self, key):
+        return not self.client.set(self.prefix + key, 1, nx=True, ex=self.ttl)
+
+    def size(self):
+        return None
+
+def create_seen_set(backend=DEDUP_BACKEND):
+    """依設定建立去重後端；Redis 無法使用時退回記憶體集合"""
+    if backend == 'redis':
+        try:
+            seen = RedisSeenSet()
+            seen.client.ping()
+            logger.info("事件去重使用 Redis")
+            return seen
+        except Exception as e:
+            logger.error(f"Redis 初始化失敗，事件去重改用記憶體: {e}")
+    elif backend == 'bloom':
+        return BloomSeenSet()
+    return SeenSet()
+
+class EventDeduplicator:
+    """以 webhookEventId 過濾重送的 webhook 事件"""
+
+    def __init__(self, seen=None):
+        self.seen = seen if seen is not None else create_seen_set()
+        self.events = 0
+        self.duplicates = 0
+        self.redeliveries = 0
+        self.errors = 0
+
+    def is_duplicate(self, event):
+        event_id = getattr(event, 'webhook_event_id', None)
+        delivery_context = getattr(event, 'delivery_context', None)
+        self.events += 1
+        if delivery_context is not None and delivery_context.is_redelivery:
+            self.redeliveries += 1
+        if not event_id:
+            return False
+        try:
+            duplicate = self.seen.check_and_add(event_id)
+        except Exception as e:
+            # 去重失敗時寧可重複處理，也不要漏掉訊息
+            self.errors += 1
+            logger.warning(f"檢查重複事件失敗: {e}")
+            return False
+        if duplicate:
+            self.duplicates += 1
+            logger.info(f"略過重複的 webhook 事件 {event_id}")
+        return duplicate
+
+    def skip_duplicates(self, func):
+        """事件處理函式的裝飾器，重複事件直接略過"""
+        @wraps(func)
+        def wrapper(event, *args, **kwargs):
+            if self.is_duplicate(event):
+                return None
+            return func(event, *args, **kwargs)
+        return wrapper
+
+    def get_stats(self):
+        return {
+            'backend': type(self.seen).__name__,
+            'tracked': self.seen.size(),
+            'events': self.events,
+            'duplicates': self.duplicates,
+            'redeliveries': self.redeliveries,
+            'errors': self.errors,
+        }
+
+# 全域共用的事件去重器
+deduplicator = EventDeduplicator()
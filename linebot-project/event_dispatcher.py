@@ -0,0 +1,101 @@
+from functools import wraps
+import contextvars
+import os
+import queue
+import threading
+import time
+import zlib
+import logging
+from dotenv import load_dotenv
+from admission import CoDelController
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 事件分派設定：處理時間多半在等外部 API，分片數可以比 CPU 核心數多
+EVENT_SHARDS = int(os.getenv('EVENT_SHARDS', '16'))
+
+def event_key(event):
+    """取得事件的排序鍵：同一位使用者（或群組、聊天室）的事件依序處理"""
+    source = getattr(event, 'source', None)
+    for attr in ('user_id', 'group_id', 'room_id'):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return ''
+
+class Shard:
+    """單一工作執行緒加上佇列，佇列內的工作依序執行"""
+
+    def __init__(self, index, admission=None):
+        self.index = index
+        self.admission = admission
+        self.processed = 0
+        self.failures = 0
+        self.max_depth = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"event-shard-{index}", daemon=True)
+        self._thread.start()
+
+    def put(self, func, args, context, shed=None):
+        self._queue.put((func, args, context, shed, time.monotonic()))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            func, args, context, shed, enqueued = self._queue.get()
+            sojourn = time.monotonic() - enqueued
+            if shed is not None and self.admission is not None and self.admission.should_shed(sojourn):
+                # 排隊太久，改用簡短回應而不跑完整流程
+                func = shed
+            try:
+                context.run(func, *args)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"事件處理失敗（分片 {self.index}）: {e}")
+            finally:
+                self.processed += 1
+
+class ShardedDispatcher:
+    """依使用者雜湊分片的事件分派器：不同使用者平行處理，同一使用者維持順序"""
+
+    def __init__(self, shards=EVENT_SHARDS, admission=None):
+        self.admission = admission if admission is not None else CoDelController()
+        self.shards = [Shard(i, self.admission) for i in range(shards)]
+
+    def shard_for(self, key):
+        return self.shards[zlib.crc32(key.encode('utf-8')) % len(self.shards)]
+
+    def submit(self, key, func, *args, shed=None):
+        """將工作排入 key 對應的分片；會帶上目前的 contextvars（例如回覆期限）
+
+        shed 為負載過高時改為執行的簡短處理函式，未提供時一律執行 func。
+        """
+        self.shard_for(key).put(func, args, contextvars.copy_context(), shed)
+
+    def serialize_by_user(self, shed=None):
+        """事件處理函式的裝飾器，改為排入使用者所屬的分片後立即返回"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(event):
+                self.submit(event_key(event), func, event, shed=shed)
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        return {
+            'shards': len(self.shards),
+            'queued': sum(shard.depth() for shard in self.shards),
+            'max_depth': max(shard.max_depth for shard in self.shards),
+            'processed': sum(shard.processed for shard in self.shards),
+            'failures': sum(shard.failures for shard in self.shards),
+        }
+
+# 全域共用的事件分派器
+dispatcher = ShardedDispatcher()
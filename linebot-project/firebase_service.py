@@ -6,6 +6,8 @@ import logging
 from datetime import datetime, timedelta
 from functools import wraps
 import time
+from circuit_breaker import get_breaker, CircuitOpenError
+import deadline
 
 load_dotenv()
 
@@ -15,6 +17,7 @@ logger = logging.getLogger(__name__)
 
 # Firebase 配置
 FIREBASE_CREDENTIALS_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH', 'firebase-service-account-key.json')
+FIRESTORE_TIMEOUT = float(os.getenv('FIRESTORE_TIMEOUT', '10'))
 
 # 初始化 Firebase
 try:
@@ -26,17 +29,27 @@ except Exception as e:
     logger.error(f"初始化 Firebase 時發生錯誤: {e}")
     raise
 
+# Firestore 斷路器：開啟時直接拋出 CircuitOpenError，不再重試
+firestore_breaker = get_breaker('firestore')
+
+def request_timeout():
+    """Firestore 呼叫的逾時秒數，不超過目前請求的剩餘期限"""
+    return deadline.clamp_timeout(FIRESTORE_TIMEOUT)
+
 # 重試裝飾器
 def retry_on_error(max_retries=3, delay=1):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
+                deadline.check("Firestore 呼叫")
                 try:
-                    return func(*args, **kwargs)
+                    return firestore_breaker.call(func, *args, **kwargs)
+                except (CircuitOpenError, deadline.DeadlineExceeded):
+                    raise
                 except Exception as e:
-                    if attempt == max_retries - 1:
-                        logger.error(f"重試 {max_retries} 次後失敗: {e}")
+                    if attempt == max_retries - 1 or not deadline.can_wait(delay):
+                        logger.error(f"重試 {attempt + 1} 次後失敗: {e}")
                         raise
                     logger.warning(f"第 {attempt + 1} 次嘗試失敗: {e}")
                     time.sleep(delay)
@@ -54,7 +67,7 @@ def save_conversation(user_id, user_message, bot_response):
             'user_message': user_message,
             'bot_response': bot_response,
             'timestamp': firestore.SERVER_TIMESTAMP
-        })
+        }, timeout=request_timeout())
         logger.info(f"已儲存使用者 {user_id} 的對話記錄")
     except Exception as e:
         logger.error(f"儲存對話記錄時發生錯誤: {e}")
@@ -68,7 +81,7 @@ def get_user_conversations(user_id, limit=10):
             .where('user_id', '==', user_id)\
             .order_by('timestamp', direction=firestore.Query.DESCENDING)\
             .limit(limit)\
-            .stream()
+            .stream(timeout=request_timeout())
         
         return [doc.to_dict() for doc in conversations]
     except Exception as e:
@@ -83,12 +96,44 @@ def save_environment_data(data):
         data_ref.set({
             **data,
             'timestamp': firestore.SERVER_TIMESTAMP
-        })
+        }, timeout=request_timeout())
         logger.info("環境數據儲存成功")
     except Exception as e:
         logger.error(f"儲存環境數據時發生錯誤: {e}")
         raise
 
+@retry_on_error()
+def save_environment_rollups(rollups):
+    """以批次寫入儲存環境數據的分鐘／小時彙總（每批最多 500 筆）"""
+    try:
+        collection = db.collection('environment_rollups')
+        for i in range(0, len(rollups), 500):
+            batch = db.batch()
+            for rollup in rollups[i:i + 500]:
+                data = dict(rollup)
+                batch.set(collection.document(data.pop('id')), data)
+            batch.commit(timeout=request_timeout())
+        logger.info(f"已寫入 {len(rollups)} 筆環境數據彙總")
+    except Exception as e:
+        logger.error(f"儲存環境數據彙總時發生錯誤: {e}")
+        raise
+
+@retry_on_error()
+def get_environment_rollups(level, start, end, device='default'):
+    """查詢指定層級與時間範圍的環境數據彙總"""
+    try:
+        rollups = db.collection('environment_rollups')\
+            .where('device', '==', device)\
+            .where('level', '==', level)\
+            .where('start', '>=', start)\
+            .where('start', '<', end)\
+            .order_by('start')\
+            .stream(timeout=request_timeout())
+        return [doc.to_dict() for doc in rollups]
+    except Exception as e:
+        logger.error(f"獲取環境數據彙總時發生錯誤: {e}")
+        raise
+
 @retry_on_error()
 def get_latest_environment_data():
     """獲取最新的環境數據"""
@@ -96,7 +141,7 @@ def get_latest_environment_data():
         data = db.collection('environment_data')\
             .order_by('timestamp', direction=firestore.Query.DESCENDING)\
             .limit(1)\
-            .stream()
+            .stream(timeout=request_timeout())
         
         for doc in data:
             return doc.to_dict()
@@ -105,6 +150,49 @@ def get_latest_environment_data():
         logger.error(f"獲取最新環境數據時發生錯誤: {e}")
         raise
 
+@retry_on_error()
+def save_follower(user_id, record):
+    """更新單一好友的資料（是否為好友、所在縣市、摘要訂閱）"""
+    try:
+        db.collection('followers').document(user_id).set({
+            **record,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        }, timeout=request_timeout())
+    except Exception as e:
+        logger.error(f"儲存好友資料時發生錯誤: {e}")
+        raise
+
+@retry_on_error()
+def get_followers():
+    """讀取所有好友資料，回傳 user_id -> 資料"""
+    try:
+        return {doc.id: doc.to_dict() for doc in db.collection('followers').stream(timeout=request_timeout())}
+    except Exception as e:
+        logger.error(f"獲取好友資料時發生錯誤: {e}")
+        raise
+
+@retry_on_error()
+def get_digest_checkpoint(run_id):
+    """讀取摘要發送進度"""
+    try:
+        doc = db.collection('digest_checkpoints').document(run_id).get(timeout=request_timeout())
+        return doc.to_dict() if doc.exists else {}
+    except Exception as e:
+        logger.error(f"讀取摘要發送進度時發生錯誤: {e}")
+        raise
+
+@retry_on_error()
+def save_digest_checkpoint(run_id, segment, progress):
+    """記錄某個分群的發送進度（已送達的最後一位收件者）"""
+    try:
+        db.collection('digest_checkpoints').document(run_id).set({
+            segment: progress,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }, merge=True, timeout=request_timeout())
+    except Exception as e:
+        logger.error(f"儲存摘要發送進度時發生錯誤: {e}")
+        raise
+
 # 清理舊數據的函數
 @retry_on_error()
 def cleanup_old_data(days=30):
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta, timezone
+import os
+import threading
+import time
+import logging
+import numpy as np
+from dotenv import load_dotenv
+from scheduler import schedule
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 全市環境摘要設定
+FLEET_REFRESH_INTERVAL = int(os.getenv('FLEET_REFRESH_INTERVAL', '60'))
+FLEET_STALE_SECONDS = int(os.getenv('FLEET_STALE_SECONDS', '600'))
+FLEET_HOT_SPOTS = int(os.getenv('FLEET_HOT_SPOTS', '5'))
+UNASSIGNED_AREA = '未分區'
+TAIWAN_TZ = timezone(timedelta(hours=8))
+MAX_DISTRICT_LINES = 15  # LINE 訊息中最多列出的區域數，依體感溫度由高到低
+
+# 體感溫度（°C）分級，依美國國家氣象局熱指數的警戒區間
+HEAT_LEVELS = ((27, '舒適'), (32, '注意'), (41, '極度注意'), (54, '危險'), (float('inf'), '極度危險'))
+# 露點（°C）分級
+DEW_POINT_LEVELS = ((10, '乾燥'), (16, '舒適'), (18, '略悶'), (21, '悶熱'), (24, '非常悶熱'), (float('inf'), '極度悶熱'))
+
+def heat_index(temperature, humidity):
+    """以 Rothfusz 迴歸（含低濕與高濕修正）計算體感溫度，輸入與輸出皆為攝氏陣列"""
+    t = np.asarray(temperature, dtype=np.float64) * 9 / 5 + 32
+    rh = np.asarray(humidity, dtype=np.float64)
+    simple = 0.5 * (t + 61 + (t - 68) * 1.2 + rh * 0.094)
+    full = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+            - 0.00683783 * t * t - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+            + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+    dry = (rh < 13) & (t >= 80) & (t <= 112)
+    full = full - np.where(dry, (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17), 0)
+    humid = (rh > 85) & (t >= 80) & (t <= 87)
+    full = full + np.where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+    result = np.where((simple + t) / 2 >= 80, full, simple)
+    return (result - 32) * 5 / 9
+
+def dew_point(temperature, humidity):
+    """以 Magnus 公式計算露點（°C）"""
+    t = np.asarray(temperature, dtype=np.float64)
+    rh = np.clip(np.asarray(humidity, dtype=np.float64), 1, 100)
+    gamma = np.log(rh / 100) + 17.62 * t / (243.12 + t)
+    return 243.12 * gamma / (17.62 - gamma)
+
+def level_of(value, levels):
+    for upper, label in levels:
+        if value < upper:
+            return label
+    return levels[-1][1]
+
+class FleetSummary:
+    """保存每個裝置的最新讀數，定期以一次 NumPy 運算產生全市各區的舒適度摘要"""
+
+    def __init__(self, stale_seconds=FLEET_STALE_SECONDS, hot_spots=FLEET_HOT_SPOTS):
+        self.stale_seconds = stale_seconds
+        self.hot_spots = hot_spots
+        self.updates = 0
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+        self._latest = {}    # 裝置 -> (區域, 溫度, 濕度, 時間)
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def update(self, device, values, area=None, timestamp=None):
+        """收到讀數時呼叫，只記錄最新值"""
+        timestamp = time.time() if timestamp is None else timestamp
+        self._latest[device] = (area or UNASSIGNED_AREA, float(values['temperature']),
+                                float(values['humidity']), timestamp)
+        self.updates += 1
+
+    def refresh(self, now=None):
+        """重新計算全市摘要，結果快取到下一次更新"""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        latest = list(self._latest.items())
+        fresh = [(device, row) for device, row in latest if now - row[3] <= self.stale_seconds]
+        snapshot = {'generated_at': now, 'devices': len(fresh), 'districts': [], 'hot_spots': []}
+        if fresh:
+            devices = [device for device, _ in fresh]
+            areas, codes = np.unique([row[0] for _, row in fresh], return_inverse=True)
+            temperature = np.fromiter((row[1] for _, row in fresh), dtype=np.float64, count=len(fresh))
+            humidity = np.fromiter((row[2] for _, row in fresh), dtype=np.float64, count=len(fresh))
+            heat = heat_index(temperature, humidity)
+            dew = dew_point(temperature, humidity)
+
+            # 各區平均與最高體感溫度
+            counts = np.bincount(codes, minlength=len(areas))
+            means = {name: np.bincount(codes, weights=column, minlength=len(areas)) / counts
+                     for name, column in (('temperature', temperature), ('humidity', humidity),
+                                          ('heat_index', heat), ('dew_point', dew))}
+            peak = np.full(len(areas), -np.inf)
+            np.maximum.at(peak, codes, heat)
+            for i in np.argsort(-means['heat_index']):
+                snapshot['districts'].append({
+                    'area': str(areas[i]),
+                    'devices': int(counts[i]),
+                    'temperature': round(float(means['temperature'][i]), 1),
+                    'humidity': round(float(means['humidity'][i]), 1),
+                    'heat_index': round(float(means['heat_index'][i]), 1),
+                    'max_heat_index': round(float(peak[i]), 1),
+                    'dew_point': round(float(means['dew_point'][i]), 1),
+                    'comfort': level_of(means['heat_index'][i], HEAT_LEVELS),
+                    'mugginess': level_of(means['dew_point'][i], DEW_POINT_LEVELS),
+                })
+
+            # 只對前幾名排序，不必排序整個車隊
+            top = min(self.hot_spots, len(fresh))
+            hottest = np.argpartition(-heat, top - 1)[:top]
+            for i in hottest[np.argsort(-heat[hottest])]:
+                snapshot['hot_spots'].append({
+                    'device': devices[i],
+                    'area': str(areas[codes[i]]),
+                    'temperature': float(temperature[i]),
+                    'humidity': float(humidity[i]),
+                    'heat_index': round(float(heat[i]), 1),
+                    'dew_point': round(float(dew[i]), 1),
+                })
+        with self._lock:
+            self._snapshot = snapshot
+            self.refreshes += 1
+            self.refresh_seconds += time.perf_counter() - started
+        return snapshot
+
+    def summary(self):
+        """回傳快取的摘要；尚未產生時立即計算一次"""
+        with self._lock:
+            snapshot = self._snapshot
+        return snapshot if snapshot is not None else self.refresh()
+
+    def get_stats(self):
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                'devices': len(self._latest),
+                'updates': self.updates,
+                'refreshes': self.refreshes,
+                'avg_refresh_ms': round(self.refresh_seconds / self.refreshes * 1000, 2) if self.refreshes else 0,
+                'districts': len(snapshot['districts']) if snapshot else 0,
+            }
+
+def format_summary(snapshot):
+    """將全市摘要整理成 LINE 訊息"""
+    if not snapshot['devices']:
+        return "目前沒有感測器回報最新數據。"
+    lines = [f"🌡️ 全市環境摘要（{snapshot['devices']} 個感測器）", ""]
+    for district in snapshot['districts'][:MAX_DISTRICT_LINES]:
+        lines.append(f"{district['area']}：體感 {district['heat_index']:.1f}°C（{district['comfort']}），"
+                     f"溫度 {district['temperature']:.1f}°C、濕度 {district['humidity']:.0f}%、"
+                     f"露點 {district['dew_point']:.1f}°C（{district['mugginess']}）")
+    if len(snapshot['districts']) > MAX_DISTRICT_LINES:
+        lines.append(f"……其餘 {len(snapshot['districts']) - MAX_DISTRICT_LINES} 區較為涼爽")
+    if snapshot['hot_spots']:
+        lines += ["", "🔥 體感最高的地點："]
+        for rank, spot in enumerate(snapshot['hot_spots'], 1):
+            lines.append(f"{rank}. {spot['area']} {spot['device']}：體感 {spot['heat_index']:.1f}°C"
+                         f"（{spot['temperature']:.0f}°C／{spot['humidity']:.0f}%）")
+    updated = datetime.fromtimestamp(snapshot['generated_at'], TAIWAN_TZ).strftime('%H:%M')
+    lines += ["", f"更新時間：{updated}"]
+    return "\n".join(lines)
+
+# 全域共用的全市環境摘要
+fleet_summary = FleetSummary()
+
+def start():
+    """啟動全市摘要的定期更新"""
+    schedule('fleet-summary', FLEET_REFRESH_INTERVAL, fleet_summary.refresh, initial_delay=FLEET_REFRESH_INTERVAL)
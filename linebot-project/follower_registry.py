@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import firebase_service
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ALL_FOLLOWERS = 'all'
+DIGEST_SEGMENT = 'digest'
+ALERT_SEGMENT = 'alerts'
+
+class FollowerRegistry:
+    """由 follow／unfollow 事件維護的好友名單，依縣市等分群保存在記憶體
+
+    每個分群是一個 frozenset，修改時整個換新（copy-on-write），查詢分群成員是 O(1)
+    且不需要鎖；每位使用者的變更在背景逐筆寫入 Firestore。
+    """
+
+    def __init__(self, loader=None, saver=None):
+        self.loader = loader
+        self.saver = saver
+        self.follows = 0
+        self.unfollows = 0
+        self.writes = 0
+        self._users = {}     # user_id -> {'city': ..., 'digest': ...}
+        self._segments = {}  # 分群名稱 -> frozenset(user_id)
+        self._lock = threading.Lock()
+        # 寫入依序執行，同一位使用者的變更不會亂序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='followers')
+
+    def load(self):
+        """啟動時從 Firestore 載入好友名單"""
+        if self.loader is None:
+            return
+        try:
+            records = self.loader()
+        except Exception as e:
+            logger.error(f"載入好友名單失敗: {e}")
+            return
+        segments = {}
+        with self._lock:
+            for user_id, record in records.items():
+                if not record.get('following', True):
+                    continue
+                profile = {'city': record.get('city'), 'digest': bool(record.get('digest')),
+                           'alerts': bool(record.get('alerts'))}
+                self._users[user_id] = profile
+                for segment in self._segments_of(profile):
+                    segments.setdefault(segment, set()).add(user_id)
+            self._segments = {name: frozenset(members) for name, members in segments.items()}
+        logger.info(f"已載入 {len(self._users)} 位好友")
+
+    def _segments_of(self, profile):
+        segments = [ALL_FOLLOWERS]
+        if profile['city']:
+            segments.append(profile['city'])
+        if profile['digest']:
+            segments.append(DIGEST_SEGMENT)
+        if profile.get('alerts'):
+            segments.append(ALERT_SEGMENT)
+        return segments
+
+    def _update(self, user_id, profile):
+        """以新的資料取代使用者，並更新受影響的分群；呼叫端須持有鎖"""
+        old = self._users.get(user_id)
+        old_segments = set(self._segments_of(old)) if old else set()
+        new_segments = set(self._segments_of(profile)) if profile else set()
+        if profile is None:
+            self._users.pop(user_id, None)
+        else:
+            self._users[user_id] = profile
+        for segment in old_segments - new_segments:
+            self._segments[segment] = self._segments.get(segment, frozenset()) - {user_id}
+        for segment in new_segments - old_segments:
+            self._segments[segment] = self._segments.get(segment, frozenset()) | {user_id}
+
+    def _persist(self, user_id, record):
+        if self.saver is None:
+            return
+        self.writes += 1
+        self._executor.submit(self._save, user_id, record)
+
+    def _save(self, user_id, record):
+        try:
+            self.saver(user_id, record)
+        except Exception as e:
+            logger.error(f"儲存好友 {user_id} 失敗: {e}")
+
+    def follow(self, user_id):
+        with self._lock:
+            profile = self._users.get(user_id) or {'city': None, 'digest': False, 'alerts': False}
+            self._update(user_id, profile)
+            self.follows += 1
+        self._persist(user_id, {'following': True, **profile})
+
+    def unfollow(self, user_id):
+        """取消好友或封鎖：從所有分群移除，之後的 multicast 不會再送給他"""
+        with self._lock:
+            self._update(user_id, None)
+            self.unfollows += 1
+        self._persist(user_id, {'following': False, 'city': None, 'digest': False, 'alerts': False})
+
+    def seen(self, user_id):
+        """收到訊息時呼叫；上線前就加入好友的使用者也會被登記"""
+        if user_id in self._users:
+            return
+        self.follow(user_id)
+
+    def set_profile(self, user_id, city=None, digest=None, alerts=None, overwrite_city=True):
+        """更新使用者所在縣市、摘要與環境警報的訂閱狀態；未提供的欄位保持不變"""
+        with self._lock:
+            old = self._users.get(user_id) or {'city': None, 'digest': False, 'alerts': False}
+            profile = {'alerts': False, **old}
+            if city is not None and (overwrite_city or not old['city']):
+                profile['city'] = city
+            if digest is not None:
+                profile['digest'] = digest
+            if alerts is not None:
+                profile['alerts'] = alerts
+            if profile == old and user_id in self._users:
+                return
+            self._update(user_id, profile)
+        self._persist(user_id, {'following': True, **profile})
+
+    def members(self, segment):
+        """回傳分群成員（唯讀集合），例如 members('臺中市')"""
+        return self._segments.get(segment, frozenset())
+
+    def city_of(self, user_id):
+        profile = self._users.get(user_id)
+        return profile['city'] if profile else None
+
+    def digest_audience(self):
+        """依縣市分組的摘要訂閱者，供每日摘要的 multicast 使用"""
+        subscribers = self.members(DIGEST_SEGMENT)
+        segments = {}
+        for user_id in subscribers:
+            city = self.city_of(user_id)
+            if city:
+                segments.setdefault(city, []).append(user_id)
+        return segments
+
+    def get_stats(self):
+        segments = dict(self._segments)
+        return {
+            'followers': len(segments.get(ALL_FOLLOWERS, ())),
+            'digest_subscribers': len(segments.get(DIGEST_SEGMENT, ())),
+            'alert_subscribers': len(segments.get(ALERT_SEGMENT, ())),
+            'segments': {name: len(members) for name, members in segments.items()
+                         if name not in (ALL_FOLLOWERS, DIGEST_SEGMENT, ALERT_SEGMENT)},
+            'follows': self.follows,
+            'unfollows': self.unfollows,
+            'writes': self.writes,
+        }
+
+# 全域共用的好友名單
+registry = FollowerRegistry(loader=firebase_service.get_followers, saver=firebase_service.save_follower)
@@ -2,8 +2,16 @@ import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import logging
-from functools import lru_cache
+from functools import lru_cache, wraps
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import json
+import re
+import threading
 import time
+from circuit_breaker import get_breaker, CircuitOpenError
+import deadline
+from micro_batcher import MicroBatcher
 
 load_dotenv()
 
@@ -13,6 +21,30 @@ logger = logging.getLogger(__name__)
 
 # Gemini API 配置
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_STREAM = os.getenv('GEMINI_STREAM', 'true').lower() == 'true'
+GEMINI_MAX_OUTPUT_TOKENS = int(os.getenv('GEMINI_MAX_OUTPUT_TOKENS', '1024'))
+
+# 回覆長度預算：LINE 文字訊息上限 5000 字，但聊天泡泡適合更短的回答
+LINE_REPLY_CHAR_BUDGET = int(os.getenv('LINE_REPLY_CHAR_BUDGET', '600'))
+LINE_REPLY_SENTENCE_BUDGET = int(os.getenv('LINE_REPLY_SENTENCE_BUDGET', '0'))  # 0 表示不限句數
+
+# 微批次：在窗口內合併同時抵達的提示（0 表示停用）
+GEMINI_MICROBATCH_WINDOW_MS = int(os.getenv('GEMINI_MICROBATCH_WINDOW_MS', '0'))
+GEMINI_MICROBATCH_MAX = int(os.getenv('GEMINI_MICROBATCH_MAX', '8'))
+
+DEFAULT_REPLY = "您好！我是 AI 市民助理，很高興為您服務。"
+SENTENCE_END = re.compile(r'[。！？!?\n]')
+JSON_BLOCK = re.compile(r'[\[{].*[\]}]', re.DOTALL)
+
+# 系統提示，確保使用繁體中文
+SYSTEM_PROMPT = f"""請使用繁體中文回應，並以友善、專業的市民助理身份回答。
+請注意以下幾點：
+1. 保持友善和專業的語氣
+2. 回答要簡潔明瞭，長度不超過 {LINE_REPLY_CHAR_BUDGET} 字
+3. 如果是問候語，要熱情回應
+4. 如果是問題，要給出實用的建議"""
+# 批次產生結構化資料時使用，不含聊天回覆的長度限制
+DATA_SYSTEM_PROMPT = "請使用繁體中文，依照指定格式輸出完整的結構化資料，不要省略任何項目。"
 
 if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY 未在環境變數中找到")
@@ -26,20 +58,155 @@ else:
         logger.error(f"初始化 Gemini API 時發生錯誤: {e}")
         model = None
 
-# 重試裝飾器
-def retry_on_error(max_retries=3, delay=1):
+# Gemini 斷路器：服務異常時直接回傳備用訊息，避免佔用工作執行緒
+gemini_breaker = get_breaker('gemini')
+
+class GenerationStats:
+    """記錄首字延遲與總生成時間"""
+
+    def __init__(self, maxlen=500):
+        self.first_token = deque(maxlen=maxlen)
+        self.total = deque(maxlen=maxlen)
+        self.count = 0
+        self.truncated = 0
+        self.chars = 0
+        self._lock = threading.Lock()
+
+    def record(self, first_token_seconds, total_seconds, chars, truncated):
+        with self._lock:
+            self.first_token.append(first_token_seconds)
+            self.total.append(total_seconds)
+            self.count += 1
+            self.chars += chars
+            if truncated:
+                self.truncated += 1
+
+    def _percentile(self, samples, p):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 3)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'generations': self.count,
+                'truncated': self.truncated,
+                'avg_chars': round(self.chars / self.count, 1) if self.count else 0,
+                'first_token_p50': self._percentile(self.first_token, 0.5),
+                'first_token_p95': self._percentile(self.first_token, 0.95),
+                'total_p50': self._percentile(self.total, 0.5),
+                'total_p95': self._percentile(self.total, 0.95),
+            }
+
+generation_stats = GenerationStats()
+
+def budget_reached(text, max_chars=LINE_REPLY_CHAR_BUDGET, max_sentences=LINE_REPLY_SENTENCE_BUDGET):
+    """判斷文字是否已達回覆長度預算"""
+    if max_chars and len(text) >= max_chars:
+        return True
+    return bool(max_sentences) and len(SENTENCE_END.findall(text)) >= max_sentences
+
+def truncate_reply(text, max_chars=LINE_REPLY_CHAR_BUDGET, max_sentences=LINE_REPLY_SENTENCE_BUDGET):
+    """在句尾截斷文字，使其符合回覆預算；回傳 (文字, 是否截斷)"""
+    text = text.strip()
+    cut = len(text)
+    if max_sentences:
+        ends = [m.end() for m in SENTENCE_END.finditer(text)]
+        if len(ends) > max_sentences:
+            cut = ends[max_sentences - 1]
+    if max_chars and cut > max_chars:
+        ends = [m.end() for m in SENTENCE_END.finditer(text, 0, max_chars)]
+        cut = ends[-1] if ends else max_chars
+    if cut >= len(text):
+        return text, False
+    truncated = text[:cut].rstrip()
+    if not SENTENCE_END.search(truncated[-1:]):
+        truncated += "…"
+    return truncated, True
+
+def _chunk_text(response):
+    try:
+        return response.text or ""
+    except ValueError as e:
+        # 回應被安全設定攔截時沒有文字內容
+        logger.warning(f"Gemini 回應沒有文字內容: {e}")
+        return ""
+
+def _generate(full_prompt, temperature, budget=True, max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS):
+    """呼叫 Gemini 生成文字；串流模式在達到回覆預算時提前停止（budget=False 時讀取完整內容）"""
+    started = time.monotonic()
+    response = model.generate_content(
+        full_prompt,
+        generation_config=genai.types.GenerationConfig(
+            temperature=temperature,
+            top_p=0.8,
+            top_k=40,
+            max_output_tokens=max_output_tokens,
+        ),
+        stream=GEMINI_STREAM
+    )
+
+    if not GEMINI_STREAM:
+        first_token = time.monotonic() - started
+        text = _chunk_text(response)
+        stopped_early = False
+    else:
+        first_token = None
+        parts = []
+        stopped_early = False
+        for chunk in response:
+            if first_token is None:
+                first_token = time.monotonic() - started
+            parts.append(_chunk_text(chunk))
+            # 已足夠填滿一則訊息就不再讀取剩餘內容
+            if budget and budget_reached("".join(parts)):
+                stopped_early = True
+                break
+            # 回覆期限已到時中斷；不完整的內容不能當作結果回傳，否則會被 lru_cache 保存
+            if deadline.expired():
+                total = time.monotonic() - started
+                generation_stats.record(first_token, total, len("".join(parts)), True)
+                raise deadline.DeadlineExceeded("Gemini 串流已超過回覆期限")
+        text = "".join(parts)
+
+    truncated = False
+    if budget:
+        text, truncated = truncate_reply(text)
+    total = time.monotonic() - started
+    generation_stats.record(first_token if first_token is not None else total, total,
+                            len(text), stopped_early or truncated)
+    return text
+
+_UNSET = object()
+
+# 重試裝飾器；fallback 指定服務無法使用時的回傳值
+def retry_on_error(max_retries=3, delay=1, fallback=_UNSET):
+    unavailable = "抱歉，AI 服務暫時無法使用。" if fallback is _UNSET else fallback
+    failed = "抱歉，AI 服務暫時無法使用，請稍後再試。" if fallback is _UNSET else fallback
+
     def decorator(func):
+        @wraps(func)
         def wrapper(*args, **kwargs):
             if model is None:
-                return "抱歉，AI 服務暫時無法使用。"
+                return unavailable
                 
             for attempt in range(max_retries):
+                deadline.check("Gemini 呼叫")
                 try:
                     return func(*args, **kwargs)
+                except CircuitOpenError as e:
+                    logger.warning(f"Gemini 斷路器開啟，略過呼叫: {e}")
+                    return failed
+                except deadline.DeadlineExceeded:
+                    raise
                 except Exception as e:
                     if attempt == max_retries - 1:
                         logger.error(f"重試 {max_retries} 次後失敗: {e}")
-                        return "抱歉，AI 服務暫時無法使用，請稍後再試。"
+                        return failed
+                    # 剩餘時間不足以再試一次時直接放棄
+                    if not deadline.can_wait(delay):
+                        raise deadline.DeadlineExceeded(f"Gemini 重試已超過回覆期限: {e}")
                     logger.warning(f"第 {attempt + 1} 次嘗試失敗: {e}")
                     time.sleep(delay)
             return None
@@ -48,41 +215,126 @@ def retry_on_error(max_retries=3, delay=1):
 
 @retry_on_error()
 @lru_cache(maxsize=100)
-def generate_text(prompt, temperature=0.7):
-    """生成文字回應"""
+def generate_text(prompt, temperature=0.7, shared=False):
+    """生成文字回應
+
+    shared=True 表示提示不含任何使用者的對話脈絡，才允許與其他使用者的提示合併為微批次；
+    帶有對話摘要或歷史的提示一律單獨呼叫，避免一位使用者的內容出現在另一位的請求中。
+    """
     if model is None:
         return "抱歉，AI 服務暫時無法使用。"
         
     try:
-        # 添加系統提示，確保使用繁體中文
-        system_prompt = """請使用繁體中文回應，並以友善、專業的市民助理身份回答。
-請注意以下幾點：
-1. 保持友善和專業的語氣
-2. 回答要簡潔明瞭
-3. 如果是問候語，要熱情回應
-4. 如果是問題，要給出實用的建議"""
-        
-        full_prompt = f"{system_prompt}\n\n使用者訊息：{prompt}"
-        
-        response = model.generate_content(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=temperature,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=1024,
-            )
-        )
-        
-        if not response.text:
-            return "您好！我是 AI 市民助理，很高興為您服務。"
-            
-        return response.text
+        if prompt_batcher is not None and shared:
+            future = prompt_batcher.submit(temperature, prompt)
+            try:
+                text = future.result(timeout=deadline.remaining())
+            except FutureTimeoutError:
+                raise deadline.DeadlineExceeded("等待 Gemini 批次結果超過回覆期限")
+        else:
+            text = _generate_single(temperature, prompt)
+    except (CircuitOpenError, deadline.DeadlineExceeded):
+        raise
     except Exception as e:
+        # 交由重試裝飾器處理；失敗結果不會進入 lru_cache
         logger.error(f"生成文字時發生錯誤: {e}")
-        return "您好！我是 AI 市民助理，很高興為您服務。"
+        raise
+
+    return text or DEFAULT_REPLY
+
+def cache_stats():
+    """generate_text 的 lru_cache 命中統計"""
+    # retry_on_error 的 wraps 不會複製 lru_cache 的 cache_info，需經由 __wrapped__ 取得
+    info = generate_text.__wrapped__.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'hit_rate': round(info.hits / lookups, 3) if lookups else 0,
+    }
+
+def _generate_single(temperature, prompt):
+    full_prompt = f"{SYSTEM_PROMPT}\n\n使用者訊息：{prompt}"
+    return gemini_breaker.call(_generate, full_prompt, temperature)
+
+def _generate_batch(temperature, prompts):
+    """將多則不含對話脈絡的提示合併為一次呼叫，回傳依序的回應；無法逐一對應時回傳 None
+
+    每則回應必須帶回對應的編號，編號缺漏、重複或順序不符時整批改為逐一呼叫，
+    不會把一則回應交給另一位使用者。
+    """
+    numbered = "\n".join(f"[{i}] {prompt}" for i, prompt in enumerate(prompts, 1))
+    full_prompt = f"""{SYSTEM_PROMPT}
+
+以下有 {len(prompts)} 則彼此獨立的使用者訊息，請分別回應，不要互相參照。
+{numbered}
+
+請只輸出 JSON 陣列，依序為每則訊息放入一個物件，例如 [{{"id": 1, "reply": "第 1 則的回應"}}, {{"id": 2, "reply": "第 2 則的回應"}}]。"""
+
+    max_tokens = min(GEMINI_MAX_OUTPUT_TOKENS * len(prompts), 8192)
+    text = gemini_breaker.call(_generate, full_prompt, temperature, False, max_tokens)
+    replies = parse_json_response(text)
+    if not isinstance(replies, list) or len(replies) != len(prompts):
+        return None
+    if not all(isinstance(reply, dict) and isinstance(reply.get('reply'), str) for reply in replies):
+        return None
+    if [reply.get('id') for reply in replies] != list(range(1, len(prompts) + 1)):
+        return None
+    return [truncate_reply(reply['reply'])[0] or DEFAULT_REPLY for reply in replies]
+
+prompt_batcher = None
+if GEMINI_MICROBATCH_WINDOW_MS > 0:
+    prompt_batcher = MicroBatcher('gemini', GEMINI_MICROBATCH_WINDOW_MS, GEMINI_MICROBATCH_MAX,
+                                  _generate_batch, _generate_single)
+
+def parse_json_response(text):
+    """從模型回應中取出 JSON（容許 ```json 區塊或前後說明文字）"""
+    match = JSON_BLOCK.search(text or "")
+    if not match:
+        return None
+    try:
+        return json.loads(match.group())
+    except ValueError:
+        return None
+
+@retry_on_error(fallback=None)
+def generate_json(prompt, temperature=0.3, system_prompt=SYSTEM_PROMPT, max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS):
+    """生成結構化（JSON）回應，無法取得或解析失敗時回傳 None"""
+    if model is None:
+        return None
+
+    try:
+        full_prompt = f"{system_prompt}\n\n{prompt}\n\n請只輸出 JSON，不要加入其他說明。"
+        text = gemini_breaker.call(_generate, full_prompt, temperature, False, max_output_tokens)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        logger.error(f"生成結構化回應時發生錯誤: {e}")
+        raise
+
+    result = parse_json_response(text)
+    if result is None:
+        logger.warning("無法解析 Gemini 的 JSON 回應")
+    return result
+
+def generate_reply_with_sentiment(message):
+    """以單次呼叫同時取得回應與情緒標籤，失敗時回傳 (None, None)"""
+    prompt = f"""請以市民助理的身份回應以下使用者訊息，並判斷使用者的情緒。
+使用者訊息：「{message}」
+
+輸出格式：{{"reply": "給使用者的回應", "sentiment": "positive、neutral 或 negative 其中之一"}}"""
+
+    result = generate_json(prompt, temperature=0.7)
+    if not isinstance(result, dict) or not result.get('reply'):
+        return None, None
+
+    reply, _ = truncate_reply(str(result['reply']))
+    sentiment = result.get('sentiment')
+    if sentiment not in ('positive', 'neutral', 'negative'):
+        sentiment = None
+    return reply, sentiment
 
-@retry_on_error()
 def report_environment_data(data):
     """生成環境數據報告"""
     if model is None:
@@ -100,7 +352,6 @@ def report_environment_data(data):
         logger.error(f"生成環境報告時發生錯誤: {e}")
         return "抱歉，無法生成環境報告，請稍後再試。"
 
-@retry_on_error()
 def analyze_user_sentiment(text):
     """分析使用者情緒"""
     if model is None:
@@ -117,7 +368,6 @@ def analyze_user_sentiment(text):
         logger.error(f"分析情緒時發生錯誤: {e}")
         return "抱歉，無法分析情緒，請稍後再試。"
 
-@retry_on_error()
 def generate_help_message():
     """生成幫助訊息"""
     if model is None:
@@ -0,0 +1,182 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from collections import defaultdict
+import os
+import random
+import re
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+import deadline
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 連線設定
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.3'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '3'))
+HTTP_MAX_RESPONSE_BYTES = int(os.getenv('HTTP_MAX_RESPONSE_BYTES', str(2 * 1024 * 1024)))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+
+# 可重試的 HTTP 狀態碼
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 例外訊息中的查詢字串可能帶有 API 金鑰，寫入日誌前先移除
+QUERY_STRING = re.compile(r'\?[^\s\'")]*')
+
+def redact(error):
+    """回傳移除網址查詢字串後的例外訊息"""
+    return QUERY_STRING.sub('?…', str(error))
+
+class ResponseTooLargeError(requests.RequestException):
+    """回應內容超過大小限制"""
+
+class DeadlineSession(requests.Session):
+    """依目前請求期限縮短逾時的 Session"""
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = deadline.clamp_timeout(kwargs.get('timeout'))
+        return super().request(method, url, **kwargs)
+
+class PooledHTTPClient:
+    """依主機共用連線池的 HTTP 客戶端"""
+
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 max_retries=HTTP_MAX_RETRIES, max_response_bytes=HTTP_MAX_RESPONSE_BYTES,
+                 pool_size=HTTP_POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.max_response_bytes = max_response_bytes
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def session_for(self, host):
+        """取得指定主機的共用 Session"""
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = DeadlineSession()
+                # 重試由本模組處理，連線池只負責連線重用
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+        return session
+
+    def backoff(self, attempt):
+        """計算帶隨機抖動的退避時間（full jitter）"""
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+    def request(self, method, url, retries=None, timeout=None, max_bytes=None, **kwargs):
+        """發送 HTTP 請求，含逾時、有限次數重試與回應大小限制"""
+        host = urlsplit(url).netloc
+        session = self.session_for(host)
+        counters = self._counters[host]
+        retries = self.max_retries if retries is None else retries
+        max_bytes = self.max_response_bytes if max_bytes is None else max_bytes
+
+        for attempt in range(retries + 1):
+            counters['requests'] += 1
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout,
+                                           stream=True, **kwargs)
+                self._read_limited(response, max_bytes)
+            except ResponseTooLargeError:
+                counters['too_large'] += 1
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                counters['errors'] += 1
+                if attempt == retries:
+                    logger.error(f"請求 {host} 重試 {retries} 次後失敗: {redact(e)}")
+                    raise
+                delay = self.backoff(attempt)
+                if not deadline.can_wait(delay):
+                    logger.warning(f"請求 {host} 已無足夠時間重試: {redact(e)}")
+                    raise
+                counters['retries'] += 1
+                logger.warning(f"請求 {host} 第 {attempt + 1} 次嘗試失敗，{delay:.2f} 秒後重試: {redact(e)}")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+                delay = self._retry_after(response) or self.backoff(attempt)
+                if not deadline.can_wait(delay):
+                    return response
+                counters['retries'] += 1
+                logger.warning(f"請求 {host} 回應 {response.status_code}，{delay:.2f} 秒後重試")
+                time.sleep(delay)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return min(float(value), HTTP_BACKOFF_MAX)
+        except ValueError:
+            return None
+
+    def _read_limited(self, response, max_bytes):
+        """讀取回應內容，超過上限時中斷連線"""
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            response.close()
+            raise ResponseTooLargeError(f"回應大小 {length} 超過上限 {max_bytes}", response=response)
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=16384):
+            size += len(chunk)
+            if size > max_bytes:
+                response.close()
+                raise ResponseTooLargeError(f"回應大小超過上限 {max_bytes}", response=response)
+            chunks.append(chunk)
+        response._content = b''.join(chunks)
+
+    def get_stats(self):
+        """回傳各主機的連線重用統計"""
+        stats = {}
+        for host, session in list(self._sessions.items()):
+            connections = 0
+            pooled_requests = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+            counters = self._counters[host]
+            stats[host] = {
+                'requests': pooled_requests,
+                'connections_opened': connections,
+                'connections_reused': max(pooled_requests - connections, 0),
+                'reuse_ratio': round(1 - connections / pooled_requests, 3) if pooled_requests else 0.0,
+                'retries': counters['retries'],
+                'errors': counters['errors'],
+                'too_large': counters['too_large'],
+            }
+        return stats
+
+# 全域共用的 HTTP 客戶端
+http_client = PooledHTTPClient()
@@ -0,0 +1,235 @@
+from collections import OrderedDict
+from functools import lru_cache
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from dotenv import load_dotenv
+from linebot.v3.messaging import (
+    Configuration, ApiClient, MessagingApi, PushMessageRequest, MulticastRequest, TextMessage
+)
+from linebot.v3.messaging.exceptions import ApiException
+from http_client import http_client
+import deadline
+from scheduler import QuotaPacer
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+
+# 回覆權杖約 1 分鐘內有效，超過此秒數直接改用 push
+REPLY_TOKEN_TTL = float(os.getenv('REPLY_TOKEN_TTL', '50'))
+# push 備援設定：依頻道速率限制平均送出，同一對象短時間內的多則訊息合併為一次請求
+PUSH_CALLS_PER_SECOND = float(os.getenv('PUSH_CALLS_PER_SECOND', '20'))
+PUSH_BATCH_WINDOW_MS = int(os.getenv('PUSH_BATCH_WINDOW_MS', '300'))
+PUSH_MAX_RETRIES = int(os.getenv('PUSH_MAX_RETRIES', '3'))
+# multicast 設定：每次最多 500 位收件者
+MULTICAST_CALLS_PER_SECOND = float(os.getenv('MULTICAST_CALLS_PER_SECOND', '10'))
+MULTICAST_MAX_RECIPIENTS = 500
+MAX_MESSAGES_PER_REQUEST = 5  # LINE 單次請求最多 5 則訊息
+
+REPLY_URL = 'https://api.line.me/v2/bot/message/reply'
+# 預先序列化的訊息內容快取筆數；罐頭回覆與快取中的新聞、說明文字會重複命中
+REPLY_PAYLOAD_CACHE_SIZE = int(os.getenv('REPLY_PAYLOAD_CACHE_SIZE', '256'))
+
+configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+
+@lru_cache(maxsize=REPLY_PAYLOAD_CACHE_SIZE)
+def render_messages(text):
+    """將文字訊息序列化為 JSON bytes；相同的文字只序列化一次"""
+    return json.dumps([{'type': 'text', 'text': text}], ensure_ascii=False).encode('utf-8')
+
+def reply_body(reply_token, messages):
+    """把回覆權杖接到預先序列化的訊息前面，組成 reply API 的請求內容"""
+    return (b'{"replyToken":"' + reply_token.encode('ascii') + b'","messages":' + messages
+            + b',"notificationDisabled":false}')
+
+def retry_after(error):
+    """讀取 429 回應的 Retry-After 秒數"""
+    headers = error.headers or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+def is_invalid_reply_token(status, body):
+    body = body.decode('utf-8', 'ignore') if isinstance(body, bytes) else str(body or '')
+    return status == 400 and 'reply token' in body.lower()
+
+class LineMessenger:
+    """發送 LINE 回覆；回覆權杖過期時改以 push 送出，push 在背景依速率限制批次發送"""
+
+    def __init__(self, configuration=configuration, calls_per_second=PUSH_CALLS_PER_SECOND,
+                 batch_window_ms=PUSH_BATCH_WINDOW_MS):
+        self.configuration = configuration
+        self.headers = {
+            'Authorization': f"Bearer {configuration.access_token}",
+            'Content-Type': 'application/json',
+        }
+        self.pacer = QuotaPacer(calls_per_second * 60)
+        self.multicast_pacer = QuotaPacer(MULTICAST_CALLS_PER_SECOND * 60)
+        self.batch_window = batch_window_ms / 1000.0
+        self.replies = 0
+        self.expired_tokens = 0
+        self.pushed_messages = 0
+        self.push_requests = 0
+        self.push_retries = 0
+        self.multicast_requests = 0
+        self.multicast_recipients = 0
+        self.failures = 0
+        self._pending = OrderedDict()  # 對象 -> (第一則排入時間, 訊息列表)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='line-push', daemon=True)
+        self._thread.start()
+
+    def send(self, reply_token, to, text, received_at=None):
+        """優先使用回覆權杖；權杖已過期或即將過期時改排入 push 佇列
+
+        received_at 為 webhook 事件的時間戳（秒），用來估計權杖剩餘時間。
+        """
+        token_age = time.time() - received_at if received_at else 0
+        if reply_token and token_age < REPLY_TOKEN_TTL:
+            try:
+                # 回覆權杖的期限與處理流程的期限分開計算；權杖只能使用一次，不重試，
+                # 否則第一次已送達但回應遺失時，重試會得到權杖失效而改用 push，造成重複訊息
+                with deadline.scope(None):
+                    response = http_client.post(REPLY_URL, data=reply_body(reply_token, render_messages(text)),
+                                                headers=self.headers, retries=0)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"發送 LINE 回應時發生錯誤：{e}")
+                return
+            if response.status_code == 200:
+                self.replies += 1
+                return
+            if not is_invalid_reply_token(response.status_code, response.content):
+                self.failures += 1
+                logger.error(f"發送 LINE 回應時發生錯誤：{response.status_code} {response.text}")
+                return
+            logger.warning("回覆權杖已失效，改用 push 送出")
+
+        self.expired_tokens += 1
+        if not to:
+            self.failures += 1
+            logger.error("回覆權杖已過期且沒有可 push 的對象，訊息未送出")
+            return
+        self.push(to, text)
+
+    def push(self, to, text):
+        """排入 push 佇列，在批次窗口內同一對象的訊息會合併送出"""
+        with self._cond:
+            entry = self._pending.get(to)
+            if entry is None:
+                self._pending[to] = (time.monotonic(), [text])
+            else:
+                entry[1].append(text)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    to, (queued_at, texts) = next(iter(self._pending.items()))
+                    wait = queued_at + self.batch_window - time.monotonic()
+                    if wait <= 0:
+                        del self._pending[to]
+                        break
+                    self._cond.wait(wait)
+
+            for i in range(0, len(texts), MAX_MESSAGES_PER_REQUEST):
+                self._push_request(to, texts[i:i + MAX_MESSAGES_PER_REQUEST])
+
+    def _push_request(self, to, texts):
+        # 重試時沿用同一個 retry key，LINE 會以 409 表示先前的請求已被接受，不會重複送達
+        retry_key = str(uuid.uuid4())
+        request = PushMessageRequest(to=to, messages=[TextMessage(text=text) for text in texts])
+        for attempt in range(PUSH_MAX_RETRIES + 1):
+            self.pacer.acquire()
+            self.push_requests += 1
+            try:
+                with ApiClient(self.configuration) as api_client:
+                    MessagingApi(api_client).push_message(request, x_line_retry_key=retry_key)
+                self.pushed_messages += len(texts)
+                return
+            except ApiException as e:
+                if e.status == 409:
+                    self.pushed_messages += len(texts)
+                    return
+                if (e.status == 429 or (e.status or 0) >= 500) and attempt < PUSH_MAX_RETRIES:
+                    delay = retry_after(e) or http_client.backoff(attempt)
+                    logger.warning(f"push 回應 {e.status}，{delay:.2f} 秒後重試")
+                    self.push_retries += 1
+                    time.sleep(delay)
+                    continue
+                logger.error(f"push 訊息失敗：{e.status} {e.reason}")
+            except Exception as e:
+                if attempt < PUSH_MAX_RETRIES:
+                    self.push_retries += 1
+                    time.sleep(http_client.backoff(attempt))
+                    continue
+                logger.error(f"push 訊息失敗：{e}")
+            self.failures += 1
+            return
+
+    def multicast(self, to, texts, retry_key):
+        """同步送出一次 multicast（最多 500 位收件者），回傳是否成功
+
+        retry_key 由呼叫端決定；程序中斷後以相同的 key 重送時，LINE 會回應 409 而不會重複送達。
+        """
+        request = MulticastRequest(to=list(to), messages=[TextMessage(text=text) for text in texts])
+        for attempt in range(PUSH_MAX_RETRIES + 1):
+            self.multicast_pacer.acquire()
+            self.multicast_requests += 1
+            try:
+                with ApiClient(self.configuration) as api_client:
+                    MessagingApi(api_client).multicast(request, x_line_retry_key=retry_key)
+                self.multicast_recipients += len(request.to)
+                return True
+            except ApiException as e:
+                if e.status == 409:
+                    logger.info(f"multicast {retry_key} 先前已送出，略過")
+                    return True
+                if (e.status == 429 or (e.status or 0) >= 500) and attempt < PUSH_MAX_RETRIES:
+                    delay = retry_after(e) or http_client.backoff(attempt)
+                    logger.warning(f"multicast 回應 {e.status}，{delay:.2f} 秒後重試")
+                    time.sleep(delay)
+                    continue
+                logger.error(f"multicast 失敗：{e.status} {e.reason}")
+            except Exception as e:
+                if attempt < PUSH_MAX_RETRIES:
+                    time.sleep(http_client.backoff(attempt))
+                    continue
+                logger.error(f"multicast 失敗：{e}")
+            self.failures += 1
+            return False
+
+    def get_stats(self):
+        with self._cond:
+            pending = sum(len(texts) for _, texts in self._pending.values())
+        cache = render_messages.cache_info()
+        return {
+            'replies': self.replies,
+            'payload_cache_hits': cache.hits,
+            'payload_cache_misses': cache.misses,
+            'expired_tokens': self.expired_tokens,
+            'push_pending': pending,
+            'push_requests': self.push_requests,
+            'pushed_messages': self.pushed_messages,
+            'push_retries': self.push_retries,
+            'multicast_requests': self.multicast_requests,
+            'multicast_recipients': self.multicast_recipients,
+            'failures': self.failures,
+        }
+
+# 全域共用的 LINE 訊息發送器
+messenger = LineMessenger()
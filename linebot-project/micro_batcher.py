@@ -0,0 +1,110 @@
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+import time
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """在短時間窗口內收集請求，將相容的請求合併成一次上游呼叫"""
+
+    def __init__(self, name, window_ms, max_batch, run_batch, run_single, workers=4):
+        """
+        run_batch(key, items) 回傳與 items 等長的結果列表，無法拆分時回傳 None；
+        run_single(key, item) 處理單一請求，也用於批次失敗時的逐一重送。
+        """
+        self.name = name
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.run_batch = run_batch
+        self.run_single = run_single
+        self.batch_sizes = Counter()
+        self.items = 0
+        self.upstream_calls = 0
+        self.fallbacks = 0
+        self.wait_seconds = 0.0
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-batch")
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._collect, name=f"{name}-collector", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, item):
+        """送出請求；key 相同的請求才會被合併"""
+        future = Future()
+        self._queue.put((key, item, future, time.monotonic()))
+        return future
+
+    def _collect(self):
+        while True:
+            pending = [self._queue.get()]
+            closes_at = time.monotonic() + self.window
+            while len(pending) < self.max_batch:
+                timeout = closes_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            groups = defaultdict(list)
+            for entry in pending:
+                groups[entry[0]].append(entry)
+            for key, entries in groups.items():
+                self._executor.submit(self._dispatch, key, entries)
+
+    def _dispatch(self, key, entries):
+        started = time.monotonic()
+        with self._stats_lock:
+            self.batch_sizes[len(entries)] += 1
+            self.items += len(entries)
+            self.upstream_calls += 1
+            self.wait_seconds += sum(started - enqueued for _, _, _, enqueued in entries)
+
+        if len(entries) == 1:
+            self._resolve(entries[0], key)
+            return
+
+        try:
+            results = self.run_batch(key, [item for _, item, _, _ in entries])
+        except Exception as e:
+            for _, _, future, _ in entries:
+                future.set_exception(e)
+            return
+
+        if results is None or len(results) != len(entries):
+            # 無法拆分回各請求時，改為逐一呼叫
+            logger.warning(f"{self.name} 批次結果無法解析，改為逐一處理 {len(entries)} 筆請求")
+            with self._stats_lock:
+                self.fallbacks += 1
+                self.upstream_calls += len(entries)
+            for entry in entries:
+                self._executor.submit(self._resolve, entry, key)
+            return
+
+        for (_, _, future, _), result in zip(entries, results):
+            future.set_result(result)
+
+    def _resolve(self, entry, key):
+        _, item, future, _ = entry
+        try:
+            future.set_result(self.run_single(key, item))
+        except Exception as e:
+            future.set_exception(e)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                'window_ms': round(self.window * 1000),
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                'requests': self.items,
+                'upstream_calls': self.upstream_calls,
+                'calls_saved': self.items - self.upstream_calls,
+                'fallbacks': self.fallbacks,
+                'avg_wait_ms': round(self.wait_seconds / self.items * 1000, 1) if self.items else 0,
+            }
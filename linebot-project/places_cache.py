@@ -0,0 +1,279 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 景點快取設定
+PLACES_CACHE_PATH = os.getenv('PLACES_CACHE_PATH', 'places_cache.json')
+PLACES_CELL_KM = float(os.getenv('PLACES_CELL_KM', '1.0'))
+# 實際抓取時放大半徑，讓附近的查詢能由同一次結果涵蓋
+PLACES_FETCH_RADIUS = int(os.getenv('PLACES_FETCH_RADIUS', '8000'))
+PLACES_CACHE_TTL = int(os.getenv('PLACES_CACHE_TTL', str(7 * 24 * 3600)))
+# 地名對應座標的保存筆數上限，超過時淘汰最久未使用的地名
+PLACES_GEOCODE_MAX = int(os.getenv('PLACES_GEOCODE_MAX', '2000'))
+# next_page_token 需要等一小段時間才會生效
+PAGE_TOKEN_DELAY = 2
+
+KM_PER_DEGREE = 111.32
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """等距圓柱近似距離，數公里內誤差可忽略"""
+    x = (lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.hypot(x, y) * KM_PER_DEGREE
+
+class PlacesIndex:
+    """以經緯度網格索引的景點快取
+
+    每次抓取後，完全落在抓取圓內的網格會被標記為「已涵蓋」；查詢圓碰到的網格
+    全部已涵蓋時直接由記憶體排序回傳，否則才呼叫 Places API。
+    """
+
+    def __init__(self, fetch=None, geocode=None, allow=None, path=PLACES_CACHE_PATH,
+                 cell_km=PLACES_CELL_KM, fetch_radius=PLACES_FETCH_RADIUS, ttl=PLACES_CACHE_TTL,
+                 geocode_max=PLACES_GEOCODE_MAX):
+        self.fetch = fetch
+        self.geocode = geocode
+        self.allow = allow
+        self.path = path
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.fetch_radius = fetch_radius
+        self.ttl = ttl
+        self.geocode_max = geocode_max
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.pages_prefetched = 0
+        self._places = {}      # place_id -> 景點資料
+        self._cells = {}       # (類型, 網格) -> place_id 集合
+        self._coverage = {}    # (類型, 網格) -> 抓取時間
+        self._geocodes = OrderedDict()  # 地名 -> (緯度, 經度, 查詢時間)，依最近使用排序
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # 下一頁預先抓取與寫檔都在背景執行
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='places')
+        self._load()
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _cell_bounds(self, cell):
+        row, col = cell
+        return (row * self.cell_deg, col * self.cell_deg,
+                (row + 1) * self.cell_deg, (col + 1) * self.cell_deg)
+
+    def _cells_touching(self, lat, lng, radius_km):
+        """列出與查詢圓相交的網格"""
+        lat_span = radius_km / KM_PER_DEGREE
+        lng_span = lat_span / max(math.cos(math.radians(lat)), 0.01)
+        min_row, min_col = self._cell(lat - lat_span, lng - lng_span)
+        max_row, max_col = self._cell(lat + lat_span, lng + lng_span)
+        cells = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                south, west, north, east = self._cell_bounds((row, col))
+                nearest_lat = min(max(lat, south), north)
+                nearest_lng = min(max(lng, west), east)
+                if distance_km(lat, lng, nearest_lat, nearest_lng) <= radius_km:
+                    cells.append((row, col))
+        return cells
+
+    def _cells_inside(self, lat, lng, radius_km):
+        """列出完全落在抓取圓內的網格（四個角都在圓內）"""
+        cells = []
+        for cell in self._cells_touching(lat, lng, radius_km):
+            south, west, north, east = self._cell_bounds(cell)
+            corners = ((south, west), (south, east), (north, west), (north, east))
+            if all(distance_km(lat, lng, c_lat, c_lng) <= radius_km for c_lat, c_lng in corners):
+                cells.append(cell)
+        return cells
+
+    def locate(self, text):
+        """將地名轉為座標；地理編碼結果會一併保存，與網格涵蓋共用有效期限"""
+        key = (text or "").strip()
+        with self._lock:
+            entry = self._geocodes.get(key)
+            if entry is not None:
+                if time.time() - entry[2] < self.ttl:
+                    self._geocodes.move_to_end(key)
+                    return entry[:2]
+                del self._geocodes[key]
+        if self.geocode is None:
+            return None
+        result = self.geocode(key)
+        if not result:
+            return None
+        point = (result['lat'], result['lng'])
+        with self._lock:
+            self._geocodes[key] = point + (time.time(),)
+            self._geocodes.move_to_end(key)
+            while len(self._geocodes) > self.geocode_max:
+                self._geocodes.popitem(last=False)
+        self._save_later()
+        return point
+
+    def covered(self, lat, lng, radius_m, place_type):
+        now = time.time()
+        with self._lock:
+            return all(
+                now - self._coverage.get((place_type, cell), 0) < self.ttl
+                for cell in self._cells_touching(lat, lng, radius_m / 1000)
+            )
+
+    def query(self, lat, lng, radius_m, place_type, limit=5):
+        """由記憶體中的景點依評分排序，回傳圓內前幾筆"""
+        radius_km = radius_m / 1000
+        with self._lock:
+            candidates = set()
+            for cell in self._cells_touching(lat, lng, radius_km):
+                candidates.update(self._cells.get((place_type, cell), ()))
+            places = [self._places[place_id] for place_id in candidates]
+
+        nearby = []
+        for place in places:
+            distance = distance_km(lat, lng, place['lat'], place['lng'])
+            if distance <= radius_km:
+                nearby.append((place, distance))
+        nearby.sort(key=lambda item: (-_prominence(item[0]), item[1]))
+        return [place for place, _ in nearby[:limit]]
+
+    def nearby(self, lat, lng, radius_m, place_type, limit=5):
+        """查詢附近景點；未涵蓋時才抓取。超過查詢配額時回傳 None"""
+        if self.covered(lat, lng, radius_m, place_type):
+            self.hits += 1
+            return self.query(lat, lng, radius_m, place_type, limit)
+
+        self.misses += 1
+        if self.allow is not None and not self.allow():
+            return None
+        fetch_radius = max(radius_m, self.fetch_radius)
+        self.fetches += 1
+        response = self.fetch(location=(lat, lng), radius=fetch_radius, type=place_type)
+        self._add_results(response.get('results', []), place_type)
+
+        # 還有後續分頁時結果並不完整，等所有分頁抓完才標記為已涵蓋
+        if response.get('next_page_token'):
+            self._executor.submit(self._prefetch, response['next_page_token'], place_type,
+                                  (lat, lng, fetch_radius))
+        else:
+            self._mark_covered(lat, lng, fetch_radius, place_type)
+        self._save_later()
+        return self.query(lat, lng, radius_m, place_type, limit)
+
+    def _mark_covered(self, lat, lng, radius_m, place_type):
+        with self._lock:
+            now = time.time()
+            for cell in self._cells_inside(lat, lng, radius_m / 1000):
+                self._coverage[(place_type, cell)] = now
+
+    def _prefetch(self, token, place_type, area):
+        """在背景依序抓取後續分頁，全部抓完後才標記涵蓋範圍"""
+        while token:
+            time.sleep(PAGE_TOKEN_DELAY)
+            if self.allow is not None and not self.allow():
+                return
+            try:
+                response = self.fetch(page_token=token)
+            except Exception as e:
+                logger.warning(f"預先抓取景點分頁失敗: {e}")
+                return
+            self.pages_prefetched += 1
+            self._add_results(response.get('results', []), place_type)
+            token = response.get('next_page_token')
+        self._mark_covered(*area, place_type)
+        self._save()
+
+    def _add_results(self, results, place_type):
+        with self._lock:
+            for result in results:
+                place_id = result.get('place_id')
+                location = result.get('geometry', {}).get('location')
+                if not place_id or not location:
+                    continue
+                self._places[place_id] = {
+                    'place_id': place_id,
+                    'name': result.get('name', '未知景點'),
+                    'rating': result.get('rating'),
+                    'user_ratings_total': result.get('user_ratings_total', 0),
+                    'lat': location['lat'],
+                    'lng': location['lng'],
+                }
+                self._cells.setdefault((place_type, self._cell(location['lat'], location['lng'])), set()).add(place_id)
+
+    def _save_later(self):
+        if self.path:
+            self._executor.submit(self._save)
+
+    def _save(self):
+        """寫入暫存檔後再取代，避免中途中斷留下損毀的檔案"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'places': list(self._places.values()),
+                'cells': [[place_type, row, col, sorted(ids)] for (place_type, (row, col)), ids in self._cells.items()],
+                'coverage': [[place_type, row, col, fetched_at]
+                             for (place_type, (row, col)), fetched_at in self._coverage.items()],
+                'geocodes': {text: list(entry) for text, entry in self._geocodes.items()},
+            }
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with self._save_lock:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"儲存景點快取失敗: {e}")
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取景點快取失敗: {e}")
+            return
+
+        now = time.time()
+        self._places = {place['place_id']: place for place in data.get('places', [])}
+        self._cells = {(place_type, (row, col)): set(ids) for place_type, row, col, ids in data.get('cells', [])}
+        self._coverage = {
+            (place_type, (row, col)): fetched_at
+            for place_type, row, col, fetched_at in data.get('coverage', [])
+            if now - fetched_at < self.ttl
+        }
+        # 舊版檔案的地名沒有查詢時間，無法判斷是否過期，一律捨棄重新查詢
+        geocodes = [
+            (text, tuple(entry)) for text, entry in data.get('geocodes', {}).items()
+            if len(entry) == 3 and now - entry[2] < self.ttl
+        ]
+        self._geocodes = OrderedDict(geocodes[-self.geocode_max:] if self.geocode_max > 0 else [])
+        logger.info(f"已載入 {len(self._places)} 筆景點快取，涵蓋 {len(self._coverage)} 個網格")
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'places': len(self._places),
+                'covered_cells': len(self._coverage),
+                'geocodes': len(self._geocodes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetches': self.fetches,
+                'pages_prefetched': self.pages_prefetched,
+            }
+
+def _prominence(place):
+    """以評分與評論數估計知名度，評論越多的高分景點越前面"""
+    return (place.get('rating') or 0) * math.log1p(place.get('user_ratings_total') or 0)
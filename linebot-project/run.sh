@@ -2,4 +2,5 @@
 
 source ../my-linebot-env/bin/activate
  
-python app.py 
\ No newline at end of file
+# 不開啟 debug／reloader，避免監看程序與服務程序各自啟動背景工作
+FLASK_DEBUG=false python app.py 
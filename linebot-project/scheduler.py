@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """在背景執行緒中定期執行的工作"""
+
+    def __init__(self, name, interval, func, initial_delay=0, jitter=0.1):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.initial_delay = initial_delay
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"task-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"排程工作 {self.name} 已啟動，每 {self.interval} 秒執行一次")
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """立即執行一次，例外只記錄不拋出"""
+        started = time.monotonic()
+        try:
+            self.func()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"排程工作 {self.name} 執行失敗: {e}")
+        finally:
+            self.runs += 1
+            self.last_run = time.time()
+            self.last_duration = time.monotonic() - started
+
+    def _loop(self):
+        if self._stop.wait(self.initial_delay):
+            return
+        while not self._stop.is_set():
+            self.run_once()
+            # 加入隨機抖動，避免多個 worker 同時打外部 API
+            wait = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+            if self._stop.wait(max(wait, 0)):
+                return
+
+    def get_stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+        }
+
+_tasks = {}
+
+def schedule(name, interval, func, initial_delay=0, jitter=0.1):
+    """建立並啟動排程工作；同名工作只會啟動一次"""
+    task = _tasks.get(name)
+    if task is None:
+        task = PeriodicTask(name, interval, func, initial_delay=initial_delay, jitter=jitter)
+        _tasks[name] = task
+    task.start()
+    return task
+
+def get_all_stats():
+    return {name: task.get_stats() for name, task in list(_tasks.items())}
+
+class QuotaPacer:
+    """依每分鐘配額平均分配外部 API 呼叫"""
+
+    def __init__(self, calls_per_minute):
+        self.min_interval = 60.0 / calls_per_minute if calls_per_minute else 0
+        self.calls = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """等待到下一個可用的呼叫時段"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+            self.calls += 1
+        if slot > now:
+            time.sleep(slot - now)
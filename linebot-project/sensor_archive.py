@@ -0,0 +1,259 @@
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import logging
+import numpy as np
+from dotenv import load_dotenv
+from scheduler import schedule
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 感測器歷史封存設定
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'sensor_archive')
+ARCHIVE_BLOCK_SIZE = int(os.getenv('ARCHIVE_BLOCK_SIZE', '4096'))
+ARCHIVE_FLUSH_INTERVAL = int(os.getenv('ARCHIVE_FLUSH_INTERVAL', '600'))
+# DHT11 的解析度為 1°C／1%，量化到 0.1 已不會損失精度
+COLUMNS = (('temperature', 10), ('humidity', 10))
+MAGIC = b'SAB1'
+# 區塊標頭：魔術字、旗標、筆數、內容長度、第一筆與最後一筆時間（毫秒）
+HEADER = struct.Struct('<4sHHIqq')
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('flags', '<u2'), ('count', '<u2'), ('length', '<u4'),
+                         ('first', '<i8'), ('last', '<i8')])
+FLAG_PARTIAL = 1  # 未滿的檔尾區塊，之後會被原地覆寫
+VARINT_MAX_BYTES = 10
+# 每筆至少佔 1 + len(COLUMNS) 個位元組，未達此筆數不可能裝滿一個區塊
+SEAL_THRESHOLD = (ARCHIVE_BLOCK_SIZE - HEADER.size) // (1 + len(COLUMNS))
+SEAL_CHECK_EVERY = 32
+
+def zigzag_encode(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+def zigzag_decode(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def varint_lengths(values):
+    """每個無號整數編碼成 varint 所需的位元組數"""
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, VARINT_MAX_BYTES):
+        lengths += (values >> np.uint64(7 * k)) > 0
+    return lengths
+
+def varint_encode(values):
+    """將 uint64 陣列編碼為 LEB128 varint 位元組（向量化）"""
+    lengths = varint_lengths(values)
+    width = int(lengths.max()) if len(values) else 1
+    k = np.arange(width, dtype=np.uint64)
+    groups = ((values[:, None] >> (np.uint64(7) * k)) & np.uint64(0x7f)).astype(np.uint8)
+    groups[np.arange(width) < (lengths[:, None] - 1)] |= 0x80
+    return groups[np.arange(width) < lengths[:, None]].tobytes()
+
+def varint_decode(data):
+    """將 varint 位元組（uint8 陣列，可為 mmap 的零複製視圖）解碼為 uint64 陣列"""
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.uint64) << (np.uint64(7) * positions.astype(np.uint64))
+    return np.add.reduceat(parts, starts)
+
+def quantize(readings):
+    """readings 為 [(時間毫秒, 讀數 dict)]，回傳時間與各欄位的整數陣列"""
+    timestamps = np.fromiter((ts for ts, _ in readings), dtype=np.int64, count=len(readings))
+    columns = [np.fromiter((round(values[name] * scale) for _, values in readings),
+                           dtype=np.int64, count=len(readings))
+               for name, scale in COLUMNS]
+    return timestamps, columns
+
+def encode_columns(timestamps, columns):
+    """時間以 delta-of-delta、數值以 delta 編碼，再以 zigzag varint 串接成單一內容"""
+    deltas = np.diff(timestamps, prepend=timestamps[0])
+    streams = [np.diff(deltas, prepend=0)] + [np.diff(column, prepend=0) for column in columns]
+    return [zigzag_encode(stream) for stream in streams]
+
+def encode_block(timestamps, columns, flags=0):
+    streams = encode_columns(timestamps, columns)
+    payload = b''.join(varint_encode(stream) for stream in streams)
+    header = HEADER.pack(MAGIC, flags, len(timestamps), len(payload), int(timestamps[0]), int(timestamps[-1]))
+    block = header + payload
+    return block + b'\0' * (ARCHIVE_BLOCK_SIZE - len(block))
+
+def decode_block(buffer):
+    """將單一區塊解碼為 (時間, 各欄位) NumPy 陣列；buffer 可為 mmap 切片"""
+    magic, _, count, length, first, _ = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("無效的封存區塊")
+    data = np.frombuffer(buffer, dtype=np.uint8, count=length, offset=HEADER.size)
+    streams = zigzag_decode(varint_decode(data)).reshape(1 + len(COLUMNS), count)
+    timestamps = first + np.cumsum(np.cumsum(streams[0]))
+    columns = [np.cumsum(stream) / scale for stream, (_, scale) in zip(streams[1:], COLUMNS)]
+    return timestamps, columns
+
+def block_capacity(timestamps, columns):
+    """回傳能放進單一區塊的最大前綴筆數"""
+    streams = encode_columns(timestamps, columns)
+    per_reading = sum(varint_lengths(stream) for stream in streams)
+    return int(np.searchsorted(np.cumsum(per_reading), ARCHIVE_BLOCK_SIZE - HEADER.size, side='right'))
+
+class SensorArchive:
+    """每個裝置一個由固定大小區塊組成的檔案，以 mmap 進行零複製範圍查詢"""
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.blocks_written = 0
+        self.readings = 0
+        self.scans = 0
+        self.blocks_decoded = 0
+        self._pending = {}  # 裝置 -> [(時間毫秒, 讀數)]
+        self._index = {}    # 裝置 -> (第一筆時間陣列, 最後一筆時間陣列)
+        self._tail = {}     # 裝置 -> 檔尾是否為未滿區塊（其讀數仍在 _pending 中）
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, device):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_-]', '_', device) + '.sab')
+
+    def append(self, values, device='default', timestamp=None):
+        """加入一筆讀數，區塊裝滿時寫入檔案"""
+        timestamp = int(time.time() * 1000) if timestamp is None else int(timestamp)
+        # 讀數已在 ingest_reading 驗證，缺少欄位時直接拋出，不以 0 填補
+        values = {name: float(values[name]) for name, _ in COLUMNS}
+        with self._lock:
+            self.readings += 1
+            # 先載入區塊索引，重啟後未滿的檔尾區塊會先放回 _pending
+            self._block_index(device)
+            pending = self._pending.setdefault(device, [])
+            pending.append((timestamp, values))
+            # 達到可能裝滿的筆數後，每隔幾筆才試算一次，避免每筆都重新編碼
+            if len(pending) >= SEAL_THRESHOLD and len(pending) % SEAL_CHECK_EVERY == 0:
+                self._seal(device, partial=False)
+
+    def flush(self):
+        """將所有未滿的區塊寫入檔案"""
+        with self._lock:
+            for device in list(self._pending):
+                self._seal(device, partial=True)
+
+    def _seal(self, device, partial):
+        """將待寫讀數切成區塊寫入檔案；呼叫端須持有鎖
+
+        partial=True 時未滿的讀數也寫成檔尾區塊，但仍留在記憶體中，
+        下次寫入時原地覆寫該區塊，避免每次定期寫入都留下大半空白的區塊。
+        """
+        # 必須先載入索引：重啟後第一次呼叫時會把檔尾區塊的讀數載回 _pending
+        firsts, lasts = self._block_index(device)
+        pending = self._pending.get(device)
+        replace_tail = self._tail.get(device, False)
+        if replace_tail:
+            firsts, lasts = firsts[:-1], lasts[:-1]
+        blocks, new_firsts, new_lasts, tail = [], [], [], False
+        while pending:
+            timestamps, columns = quantize(pending)
+            count = block_capacity(timestamps, columns)
+            if count >= len(pending):
+                if not partial:
+                    break
+                tail = True
+            blocks.append(encode_block(timestamps[:count], [column[:count] for column in columns],
+                                       flags=FLAG_PARTIAL if tail else 0))
+            new_firsts.append(timestamps[0])
+            new_lasts.append(timestamps[count - 1])
+            if tail:
+                break
+            pending = pending[count:]
+        self._pending[device] = pending
+        if not blocks:
+            return
+
+        path = self.path(device)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.seek(len(firsts) * ARCHIVE_BLOCK_SIZE)
+            f.write(b''.join(blocks))
+        self._index[device] = (np.append(firsts, new_firsts).astype(np.int64),
+                               np.append(lasts, new_lasts).astype(np.int64))
+        self._tail[device] = tail
+        self.blocks_written += len(blocks) - tail
+
+    def _block_index(self, device):
+        """以 mmap 上的跨步視圖一次讀出所有區塊標頭，只在第一次使用該裝置時執行"""
+        if device in self._index:
+            return self._index[device]
+        firsts = lasts = np.zeros(0, dtype=np.int64)
+        path = self.path(device)
+        if os.path.exists(path) and os.path.getsize(path) >= ARCHIVE_BLOCK_SIZE:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                headers = np.ndarray((len(mm) // ARCHIVE_BLOCK_SIZE,), dtype=HEADER_DTYPE,
+                                     buffer=mm, strides=(ARCHIVE_BLOCK_SIZE,))
+                firsts, lasts = headers['first'].copy(), headers['last'].copy()
+                if headers['flags'][-1] & FLAG_PARTIAL:
+                    # 重啟後把未滿的檔尾區塊載回記憶體，繼續填滿
+                    timestamps, columns = decode_block(mm[-ARCHIVE_BLOCK_SIZE:])
+                    self._tail[device] = True
+                    self._pending[device] = [
+                        (int(ts), {name: float(column[i]) for (name, _), column in zip(COLUMNS, columns)})
+                        for i, ts in enumerate(timestamps)
+                    ] + self._pending.get(device, [])
+                del headers
+        self._index[device] = (firsts, lasts)
+        return self._index[device]
+
+    def scan(self, start, end, device='default'):
+        """回傳 [start, end]（毫秒）範圍內的讀數，欄位為 NumPy 陣列"""
+        with self._lock:
+            firsts, lasts = self._block_index(device)
+            if self._tail.get(device):
+                # 檔尾區塊的讀數仍在記憶體中，直接從 _pending 回答
+                firsts, lasts = firsts[:-1], lasts[:-1]
+            pending = [reading for reading in self._pending.get(device, ()) if start <= reading[0] <= end]
+        # 區塊依時間附加，以二分搜尋找出與範圍重疊的區塊
+        lo = int(np.searchsorted(lasts, start, side='left'))
+        hi = int(np.searchsorted(firsts, end, side='right'))
+        parts = []
+        if hi > lo:
+            with open(self.path(device), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for block in range(lo, hi):
+                    view = memoryview(mm)[block * ARCHIVE_BLOCK_SIZE:(block + 1) * ARCHIVE_BLOCK_SIZE]
+                    parts.append(decode_block(view))
+                    view.release()
+            self.blocks_decoded += hi - lo
+        if pending:
+            timestamps, columns = quantize(pending)
+            parts.append((timestamps, [column / scale for column, (_, scale) in zip(columns, COLUMNS)]))
+        self.scans += 1
+
+        if not parts:
+            return {'timestamp': np.zeros(0, dtype=np.int64),
+                    **{name: np.zeros(0) for name, _ in COLUMNS}}
+        timestamps = np.concatenate([part[0] for part in parts])
+        mask = (timestamps >= start) & (timestamps <= end)
+        result = {'timestamp': timestamps[mask]}
+        for i, (name, _) in enumerate(COLUMNS):
+            result[name] = np.concatenate([part[1][i] for part in parts])[mask]
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'readings': self.readings,
+                'pending': sum(len(pending) for pending in self._pending.values()),
+                'blocks_written': self.blocks_written,
+                'block_size': ARCHIVE_BLOCK_SIZE,
+                'scans': self.scans,
+                'blocks_decoded': self.blocks_decoded,
+            }
+
+# 全域共用的感測器歷史封存
+archive = SensorArchive()
+
+def start():
+    """啟動未滿區塊的定期寫入"""
+    schedule('sensor-archive', ARCHIVE_FLUSH_INTERVAL, archive.flush, initial_delay=ARCHIVE_FLUSH_INTERVAL)
@@ -0,0 +1,55 @@
+import re
+
+# 繁體中文情緒詞典（本地分類器，不需呼叫 LLM）
+POSITIVE_WORDS = [
+    '開心', '高興', '快樂', '喜歡', '愛', '謝謝', '感謝', '多謝', '謝啦', '棒', '讚', '不錯',
+    '滿意', '期待', '幸福', '順利', '舒服', '輕鬆', '美好', '成功', '厲害', '感動', '興奮',
+    '太好了', '放心', '可愛', '有趣', '好玩', '溫暖', '哈哈', '貼心', '推薦', '完美', '優秀',
+    '好吃', '漂亮', '晴朗', '涼爽', '方便', '幫大忙', '😊', '😀', '😄', '😂', '❤', '👍', '🥰',
+]
+NEGATIVE_WORDS = [
+    '難過', '傷心', '生氣', '憤怒', '討厭', '煩', '失望', '擔心', '害怕', '焦慮', '糟糕',
+    '爛', '差勁', '痛苦', '累', '疲倦', '無聊', '麻煩', '抱怨', '不爽', '可惡', '氣死',
+    '崩潰', '鬱悶', '孤單', '寂寞', '壓力', '緊張', '後悔', '倒楣', '噁心', '恐怖', '危險',
+    '痛', '哭', '慘', '塞車', '悶熱', '太熱', '太冷', '很吵', '不方便', '不滿', '受不了',
+    '😢', '😭', '😡', '😠', '😞', '👎', '💔',
+]
+NEGATORS = ('不是', '沒有', '並不', '毫不', '不', '沒', '別', '未', '無')
+INTENSIFIERS = ('超級', '非常', '特別', '十分', '真的', '很', '超', '太', '好', '真', '最', '極')
+
+_WEIGHTS = {word: 1.0 for word in POSITIVE_WORDS}
+_WEIGHTS.update({word: -1.0 for word in NEGATIVE_WORDS})
+# 依長度由長到短排列，讓「不爽」優先於「爽」、「太好了」優先於「好」
+_LEXICON_PATTERN = re.compile('|'.join(
+    re.escape(word) for word in sorted(_WEIGHTS, key=len, reverse=True)
+))
+
+POSITIVE = 'positive'
+NEUTRAL = 'neutral'
+NEGATIVE = 'negative'
+
+def score(text):
+    """計算情緒分數，正值為正面、負值為負面"""
+    total = 0.0
+    for match in _LEXICON_PATTERN.finditer(text):
+        weight = _WEIGHTS[match.group()]
+        start = match.start()
+        for word in INTENSIFIERS:
+            if text.endswith(word, 0, start):
+                weight *= 1.5
+                start -= len(word)
+                break
+        if text.endswith(NEGATORS, 0, start):
+            # 「不開心」視為負面，「沒生氣」只減弱為接近中性
+            weight = -weight if weight > 0 else -weight * 0.5
+        total += weight
+    return total
+
+def classify(text, threshold=0.5):
+    """回傳 (情緒標籤, 分數)"""
+    value = score(text)
+    if value > threshold:
+        return POSITIVE, value
+    if value < -threshold:
+        return NEGATIVE, value
+    return NEUTRAL, value
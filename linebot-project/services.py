@@ -1,5 +1,4 @@
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import os
 from dotenv import load_dotenv
@@ -8,7 +7,15 @@ from collections import defaultdict
 import time
 from functools import lru_cache, wraps
 import logging
-from gemini_service import generate_text, report_environment_data, analyze_user_sentiment, generate_help_message
+from http_client import http_client
+from circuit_breaker import get_breaker, CircuitOpenError
+from deadline import DeadlineExceeded
+import deadline
+from gemini_service import generate_text, report_environment_data, analyze_user_sentiment, generate_help_message, generate_reply_with_sentiment
+import sentiment
+from weather_service import weather_engine, rule_based_advice
+from traffic_service import traffic_engine, congestion_level
+from places_cache import PlacesIndex
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +28,18 @@ NEWS_API_KEY = os.getenv('NEWS_API_KEY')
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# 外部 API 網址與逾時設定
+NEWS_API_URL = "https://newsapi.org/v2/top-headlines"
+MAPS_CONNECT_TIMEOUT = float(os.getenv('MAPS_CONNECT_TIMEOUT', '3.05'))
+MAPS_READ_TIMEOUT = float(os.getenv('MAPS_READ_TIMEOUT', '10'))
+MAPS_RETRY_TIMEOUT = int(os.getenv('MAPS_RETRY_TIMEOUT', '15'))
+TRAVEL_RADIUS = int(os.getenv('TRAVEL_RADIUS', '5000'))  # 景點查詢半徑（公尺）
+
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+# 情緒分析模式：local（本地詞典）、combined（回應與情緒同一次 LLM 呼叫）、llm（額外一次 LLM 呼叫）
+SENTIMENT_MODE = os.getenv('SENTIMENT_MODE', 'local')
+
 # 驗證 API 金鑰
 missing_keys = []
 if not NEWS_API_KEY:
@@ -37,7 +56,14 @@ if missing_keys:
 gmaps = None
 if GOOGLE_MAPS_API_KEY:
     try:
-        gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+        # 透過共用連線池發送請求，並限制逾時與重試總時間
+        gmaps = googlemaps.Client(
+            key=GOOGLE_MAPS_API_KEY,
+            connect_timeout=MAPS_CONNECT_TIMEOUT,
+            read_timeout=MAPS_READ_TIMEOUT,
+            retry_timeout=MAPS_RETRY_TIMEOUT,
+            requests_session=http_client.session_for('maps.googleapis.com')
+        )
         # 測試 API 金鑰是否有效
         gmaps.geocode('台北')
         logger.info("Google Maps API 初始化成功")
@@ -45,6 +71,15 @@ if GOOGLE_MAPS_API_KEY:
         logger.error(f"Google Maps API 初始化失敗: {e}")
         gmaps = None
 
+# 外部依賴的斷路器
+maps_breaker = get_breaker('maps')
+news_breaker = get_breaker('newsapi')
+
+def call_maps(method, *args, **kwargs):
+    """透過斷路器呼叫 Google Maps API"""
+    deadline.check("Google Maps 呼叫")
+    return maps_breaker.call(getattr(gmaps, method), *args, **kwargs)
+
 # API 使用量控制
 class APIRateLimiter:
     def __init__(self, daily_limit=1000):
@@ -71,87 +106,113 @@ class APIRateLimiter:
 # 建立 API 限制器實例
 api_limiter = APIRateLimiter()
 
-# 快取裝飾器
-def cache_with_timeout(timeout_seconds=300):
+class QuotaExceededError(Exception):
+    """今日的 API 查詢配額已用完"""
+
+class ServiceUnavailableError(Exception):
+    """外部服務暫時無法提供結果；訊息不含請求網址與金鑰，可安全寫入日誌"""
+
+# 快取裝飾器；斷路器開啟或服務失敗時回傳過期快取，沒有快取則回傳 fallback 訊息；錯誤結果不會進入快取
+def cache_with_timeout(timeout_seconds=300, fallback=None):
     def decorator(func):
         cache = {}
+        stats = {'hits': 0, 'misses': 0}
         def wrapper(*args, **kwargs):
             key = str(args) + str(kwargs)
             if key in cache:
                 result, timestamp = cache[key]
                 if datetime.now() - timestamp < timedelta(seconds=timeout_seconds):
+                    stats['hits'] += 1
                     return result
-            result = func(*args, **kwargs)
+            stats['misses'] += 1
+            try:
+                result = func(*args, **kwargs)
+            except DeadlineExceeded:
+                # 期限已過時，若有過期快取仍可立即回覆
+                if key in cache:
+                    return cache[key][0]
+                raise
+            except (CircuitOpenError, ServiceUnavailableError) as e:
+                logger.warning(f"{func.__name__} 依賴的服務無法使用: {e}")
+                if key in cache:
+                    return cache[key][0]
+                if fallback is None:
+                    raise
+                return fallback
             cache[key] = (result, datetime.now())
             return result
+        # 命中次數供 /metrics 觀察快取效果
+        wrapper.cache_stats = stats
         return wrapper
     return decorator
 
-@cache_with_timeout(300)  # 快取 5 分鐘
+def format_weather(record):
+    """將天氣資料表中的一筆資料格式化為回覆訊息"""
+    observed = datetime.fromtimestamp(record['observed_at'], TAIWAN_TZ) if record.get('observed_at') else None
+
+    message = f"📍 {record['location']}天氣實況：\n\n"
+    message += f"🌤️ {record['description']}\n"
+    message += f"🌡️ 溫度：{record['temperature']:.1f}°C（體感 {record['feels_like']:.1f}°C）\n"
+    message += f"💧 濕度：{record['humidity']}%\n"
+    if record.get('wind_speed') is not None:
+        message += f"🌬️ 風速：{record['wind_speed']} m/s\n"
+    if observed:
+        message += f"🕒 觀測時間：{observed.strftime('%Y-%m-%d %H:%M')}\n"
+
+    forecast = record.get('forecast', [])[:4]
+    if forecast:
+        message += "\n📅 未來預報：\n"
+        for slot in forecast:
+            slot_time = datetime.fromtimestamp(slot['time'], TAIWAN_TZ).strftime('%H:%M')
+            message += f"• {slot_time} {slot['description']} {slot['temperature']:.0f}°C 降雨機率 {slot['pop'] * 100:.0f}%\n"
+
+    advice = record.get('advice') or rule_based_advice(record)
+    message += f"\n💡 溫馨提示：\n{advice}"
+    return message
+
 def get_weather(location):
-    """獲取天氣資訊"""
-    if not GOOGLE_MAPS_API_KEY:
-        return "抱歉，天氣服務暫時無法使用。"
-        
+    """獲取天氣資訊（查詢定期更新的天氣資料表，不呼叫外部 API）"""
     try:
-        # 檢查 API 使用限制
-        if not api_limiter.check_limit('geocoding'):
-            return "抱歉，今日天氣查詢次數已達上限，請明天再試。"
-
-        # 獲取地點地理編碼
-        geocode_result = gmaps.geocode(location)
-        if not geocode_result:
-            return f"找不到 {location} 的位置資訊。"
-
-        # 獲取地點座標
-        location_lat = geocode_result[0]['geometry']['location']['lat']
-        location_lng = geocode_result[0]['geometry']['location']['lng']
-
-        # 獲取天氣資訊
-        weather_result = gmaps.timezone((location_lat, location_lng))
-        if not weather_result:
-            return f"{location} 目前沒有天氣資訊。"
-
-        # 獲取當前時間
-        current_time = datetime.now()
-        
-        # 構建天氣資訊
-        message = f"📍 {location}天氣實況：\n\n"
-        message += f"🕒 查詢時間：{current_time.strftime('%Y-%m-%d %H:%M')}\n"
-        message += f"🌍 時區：{weather_result['timeZoneName']}\n"
-        
-        # 使用 Gemini API 生成天氣建議
-        try:
-            prompt = f"""請根據以下資訊生成天氣建議：
-地點：{location}
-時間：{current_time.strftime('%Y-%m-%d %H:%M')}
-時區：{weather_result['timeZoneName']}
-
-請以市民助理的身份，給出適合的天氣建議和注意事項。"""
-            
-            advice = generate_text(prompt, temperature=0.5)
-            if advice:
-                message += f"\n💡 溫馨提示：\n{advice}"
-        except Exception as e:
-            logger.error(f"生成天氣建議時發生錯誤: {e}")
-            message += "\n💡 溫馨提示：\n• 天氣適宜，適合外出活動"
-            
-        return message
-        
+        record = weather_engine.lookup(location)
+        if record is None:
+            if weather_engine.resolve(location) is None:
+                return f"找不到 {location} 的天氣資訊，目前支援台灣各縣市與主要鄉鎮市區。"
+            return "抱歉，天氣資料更新中，請稍後再試。"
+        return format_weather(record)
     except Exception as e:
         logger.error(f"獲取天氣資訊時發生錯誤: {e}")
         return "抱歉，獲取天氣資訊時發生錯誤，請稍後再試。"
 
-@cache_with_timeout(300)  # 快取 5 分鐘
+def _fetch_news(category):
+    """向 NewsAPI 取得頭條新聞，伺服器錯誤時拋出例外以計入斷路器
+
+    例外訊息只保留狀態碼或例外類型：請求網址帶有 apiKey，不能出現在日誌或回覆中。
+    """
+    try:
+        response = http_client.get(NEWS_API_URL, params={
+            'country': 'tw',
+            'category': category,
+            'apiKey': NEWS_API_KEY
+        })
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise ServiceUnavailableError(f"NewsAPI 連線失敗（{type(e).__name__}）") from None
+    if response.status_code == 429 or response.status_code >= 500:
+        raise ServiceUnavailableError(f"NewsAPI 回應 {response.status_code}")
+    return response
+
+@cache_with_timeout(300, fallback="抱歉，新聞服務暫時無法使用，請稍後再試。")  # 快取 5 分鐘
 def get_news(category="general"):
     """獲取最新新聞"""
     try:
         # 使用 NewsAPI
-        url = f"https://newsapi.org/v2/top-headlines?country=tw&category={category}&apiKey={NEWS_API_KEY}"
-        response = requests.get(url)
+        response = news_breaker.call(_fetch_news, category)
+        if response.status_code != 200:
+            raise ServiceUnavailableError(f"NewsAPI 回應 {response.status_code}")
         data = response.json()
         
-        if response.status_code == 200 and data['articles']:
+        if data.get('articles'):
             news_list = data['articles'][:5]  # 獲取前 5 則新聞
             news_text = "📰 最新新聞：\n\n"
             
@@ -163,93 +224,86 @@ def get_news(category="general"):
             return news_text
         else:
             return "抱歉，無法獲取新聞資訊。"
+    except (CircuitOpenError, DeadlineExceeded, ServiceUnavailableError):
+        raise
     except Exception as e:
-        return f"獲取新聞資訊時發生錯誤：{str(e)}"
+        # 交由快取裝飾器回傳過期快取或通用訊息，錯誤不會被快取
+        raise ServiceUnavailableError(f"NewsAPI 回應無法解析（{type(e).__name__}）") from None
+
+def format_traffic(snapshot):
+    """將交通快照格式化為回覆訊息"""
+    updated = datetime.fromtimestamp(snapshot['updated_at'], TAIWAN_TZ).strftime('%H:%M')
+    label, icon = congestion_level(snapshot['index'])
+
+    message = f"🚗 {snapshot['city']}交通狀況（{updated} 更新）：\n"
+    message += f"{icon} 整體壅塞指數 {snapshot['index']:.2f}（{label}）\n\n"
+    corridors = sorted(snapshot['corridors'], key=lambda corridor: corridor['index'], reverse=True)
+    for corridor in corridors[:5]:  # 只顯示最壅塞的 5 條路廊
+        _, corridor_icon = congestion_level(corridor['index'])
+        message += (f"{corridor_icon} {corridor['origin']} → {corridor['destination']}："
+                    f"{corridor['actual_minutes']:.0f} 分鐘（平常 {corridor['baseline_minutes']:.0f} 分鐘）\n")
+    return message.rstrip()
 
-@cache_with_timeout(60)  # 快取 1 分鐘
 def get_traffic_info(location):
-    """使用 Google Maps API 獲取交通資訊"""
+    """獲取交通資訊（查詢定期更新的路廊快照，不呼叫外部 API）"""
     try:
-        # 檢查 API 使用限制
-        if not api_limiter.check_limit('directions'):
-            return "抱歉，今日交通資訊查詢次數已達上限，請明天再試。"
-
-        # 獲取地點地理編碼
-        if not api_limiter.check_limit('geocoding'):
-            return "抱歉，今日地址查詢次數已達上限，請明天再試。"
-
-        geocode_result = gmaps.geocode(location)
-        if not geocode_result:
-            return f"找不到 {location} 的位置資訊。"
-
-        # 獲取地點座標
-        location_lat = geocode_result[0]['geometry']['location']['lat']
-        location_lng = geocode_result[0]['geometry']['location']['lng']
-
-        # 獲取交通資訊
-        traffic_result = gmaps.directions(
-            origin=(location_lat, location_lng),
-            destination=(location_lat, location_lng),
-            mode="driving",
-            departure_time=datetime.now(),
-            traffic_model="best_guess"
-        )
-        
-        if not traffic_result:
-            return f"{location} 目前沒有交通資訊。"
-
-        # 獲取主要道路的交通狀況
-        roads = []
-        for step in traffic_result[0]['legs'][0]['steps']:
-            if 'traffic_speed_entry' in step:
-                road_name = step.get('html_instructions', '未知道路')
-                traffic_level = step['traffic_speed_entry']
-                roads.append(f"- {road_name}: {traffic_level}")
-
-        if not roads:
-            return f"{location} 目前交通狀況正常。"
-
-        # 格式化返回資訊
-        result = f"{location} 交通狀況：\n"
-        result += "\n".join(roads[:5])  # 只顯示前 5 條道路資訊
-        return result
-
+        name = weather_engine.resolve(location)
+        city = weather_engine.locations[name][2] if name else None
+        if city not in traffic_engine.corridors:
+            supported = "、".join(traffic_engine.corridors)
+            return f"目前沒有 {location} 的交通資訊，支援的縣市：{supported}。"
+        snapshot = traffic_engine.lookup(city)
+        if snapshot is None:
+            return "抱歉，交通資料更新中，請稍後再試。"
+        return format_traffic(snapshot)
     except Exception as e:
-        print(f"獲取交通資訊失敗: {e}")
-        return "獲取交通資訊時發生錯誤，請稍後再試。"
+        logger.error(f"獲取交通資訊時發生錯誤: {e}")
+        return "抱歉，獲取交通資訊時發生錯誤，請稍後再試。"
+
+def _geocode_point(location):
+    """地理編碼並回傳座標；找不到時回傳 None，超過查詢配額時拋出 QuotaExceededError"""
+    if not api_limiter.check_limit('geocoding'):
+        raise QuotaExceededError("今日地理編碼查詢次數已達上限")
+    result = call_maps('geocode', location)
+    return result[0]['geometry']['location'] if result else None
+
+# 景點快取：依網格索引，鄰近查詢共用同一次 Places 結果
+places_index = PlacesIndex(
+    fetch=lambda **kwargs: call_maps('places_nearby', **kwargs),
+    geocode=_geocode_point,
+    allow=lambda: api_limiter.check_limit('places')
+)
 
-@cache_with_timeout(300)  # 快取 5 分鐘
 def get_travel_info(location):
     """獲取旅遊資訊"""
     try:
-        # 檢查 API 使用限制
-        if not api_limiter.check_limit('places'):
-            return "抱歉，今日景點查詢次數已達上限，請明天再試。"
-
-        if not api_limiter.check_limit('geocoding'):
-            return "抱歉，今日地址查詢次數已達上限，請明天再試。"
-
-        # 使用 Google Maps Places API 獲取景點資訊
-        places_result = gmaps.places_nearby(
-            location=gmaps.geocode(location)[0]['geometry']['location'],
-            radius=5000,  # 5 公里範圍內
-            type='tourist_attraction'
-        )
+        point = places_index.locate(location)
+        if point is None:
+            return f"找不到 {location} 的位置資訊。"
 
-        if not places_result.get('results'):
+        # 查詢範圍內的網格都已抓取過時直接由快取排序，不呼叫 Places API
+        places = places_index.nearby(point[0], point[1], TRAVEL_RADIUS, 'tourist_attraction')
+        if places is None:
+            return "抱歉，今日景點查詢次數已達上限，請明天再試。"
+        if not places:
             return f"在 {location} 附近沒有找到景點資訊。"
 
         # 格式化返回資訊
         result = f"{location} 附近景點：\n"
-        for place in places_result['results'][:5]:  # 只顯示前 5 個景點
-            name = place.get('name', '未知景點')
-            rating = place.get('rating', '暫無評分')
-            result += f"- {name} (評分: {rating})\n"
+        for place in places:
+            rating = place.get('rating') or '暫無評分'
+            result += f"- {place['name']} (評分: {rating})\n"
 
         return result
 
+    except QuotaExceededError:
+        return "抱歉，今日景點查詢次數已達上限，請明天再試。"
+    except CircuitOpenError:
+        return "抱歉，旅遊資訊服務暫時無法使用，請稍後再試。"
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"獲取旅遊資訊失敗: {e}")
+        logger.error(f"獲取旅遊資訊失敗: {e}")
         return "獲取旅遊資訊時發生錯誤，請稍後再試。"
 
 def get_environment_info(location):
@@ -263,7 +317,7 @@ def get_environment_info(location):
             return "抱歉，今日環境查詢次數已達上限，請明天再試。"
 
         # 獲取地點地理編碼
-        geocode_result = gmaps.geocode(location)
+        geocode_result = call_maps('geocode', location)
         if not geocode_result:
             return f"找不到 {location} 的位置資訊。"
 
@@ -274,6 +328,10 @@ def get_environment_info(location):
         }
         
         return report_environment_data(environment_data)
+    except CircuitOpenError:
+        return "抱歉，環境服務暫時無法使用，請稍後再試。"
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"獲取環境信息時發生錯誤: {e}")
         return "抱歉，獲取環境信息時發生錯誤，請稍後再試。"
@@ -285,12 +343,23 @@ def get_help():
 def process_message(message):
     """處理用戶消息"""
     try:
-        # 分析用戶情緒
-        sentiment = analyze_user_sentiment(message)
-        logger.info(f"用戶情緒分析: {sentiment}")
-        
+        if SENTIMENT_MODE == 'combined':
+            reply, label = generate_reply_with_sentiment(message)
+            if reply:
+                logger.info(f"用戶情緒分析: {label or sentiment.classify(message)[0]}")
+                return reply
+        elif SENTIMENT_MODE == 'llm':
+            logger.info(f"用戶情緒分析: {analyze_user_sentiment(message)}")
+
         # 根據消息內容生成回應
-        return generate_text(message)
+        reply = generate_text(message)
+        if SENTIMENT_MODE != 'llm':
+            # 本地詞典分類只需數微秒，在回應生成後才執行
+            label, score = sentiment.classify(message)
+            logger.info(f"用戶情緒分析: {label} ({score:.1f})")
+        return reply
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"處理消息時發生錯誤: {e}")
         return "抱歉，處理消息時發生錯誤，請稍後再試。" 
\ No newline at end of file
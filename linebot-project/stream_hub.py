@@ -0,0 +1,176 @@
+from collections import deque
+import json
+import os
+import queue
+import threading
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 即時串流設定
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', '64'))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', '5000'))
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', '15'))
+ALL_TOPIC = 'all'
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+def topics_for(device, area=None):
+    """一筆讀數會發布到的主題：全部、裝置與所在區域"""
+    topics = [ALL_TOPIC, f"device:{device}"]
+    if area:
+        topics.append(f"area:{area}")
+    return topics
+
+def sse_frame(event, data):
+    """組出 Server-Sent Events 的訊息框（bytes）"""
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event}\ndata: {body}\n\n".encode('utf-8')
+
+class Topic:
+    """單一主題的有界環狀緩衝區，所有訂閱者共用，各自只記錄讀到哪一則"""
+
+    __slots__ = ('frames', 'seq', 'subscribers', 'cond')
+
+    def __init__(self, size):
+        self.frames = deque(maxlen=size)
+        self.seq = 0          # 已發布的訊息總數
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+class Subscriber:
+    __slots__ = ('topic', 'name', 'cursor', 'dropped')
+
+    def __init__(self, topic, name):
+        self.topic = topic
+        self.name = name
+        # 從最後一則開始，新連線先收到目前的讀數
+        self.cursor = topic.seq - min(1, len(topic.frames))
+        self.dropped = False
+
+class StreamHub:
+    """將每筆讀數序列化一次後廣播給所有訂閱者
+
+    發布端只把讀數交給廣播執行緒；廣播執行緒把訊息框附加到主題的環狀緩衝區，
+    每批只喚醒一次等待者，成本與訂閱人數無關。每位訂閱者以游標讀取，醒來時
+    一次取走所有未讀的訊息框；落後超過緩衝區長度時斷線，讓瀏覽器重新連線，
+    不會拖慢發布者或其他訂閱者。
+    """
+
+    def __init__(self, max_subscribers=STREAM_MAX_SUBSCRIBERS, buffer_size=STREAM_BUFFER_SIZE):
+        self.max_subscribers = max_subscribers
+        self.buffer_size = buffer_size
+        self.published = 0
+        self.deliveries = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._topics = {}  # 主題名稱 -> Topic
+        self._count = 0
+        self._lock = threading.Lock()
+        self._outbox = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._broadcast, name='stream-hub', daemon=True)
+        self._thread.start()
+
+    def _topic(self, name):
+        topic = self._topics.get(name)
+        if topic is None:
+            with self._lock:
+                topic = self._topics.setdefault(name, Topic(self.buffer_size))
+        return topic
+
+    def subscribe(self, name):
+        """加入訂閱者；超過上限時回傳 None"""
+        topic = self._topic(name)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._count += 1
+        with topic.cond:
+            topic.subscribers += 1
+            return Subscriber(topic, name)
+
+    def unsubscribe(self, subscriber):
+        with subscriber.topic.cond:
+            subscriber.topic.subscribers -= 1
+        with self._lock:
+            self._count -= 1
+            if subscriber.dropped:
+                self.dropped += 1
+
+    def publish(self, topics, event, data):
+        """交給廣播執行緒，不會因訂閱人數多而拖慢呼叫端"""
+        self._outbox.put((topics, event, data))
+
+    def _broadcast(self):
+        while True:
+            batch = [self._outbox.get()]
+            while True:
+                try:
+                    batch.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            touched = {}
+            for topics, event, data in batch:
+                # 每筆讀數只序列化一次，所有主題共用同一個訊息框
+                frame = sse_frame(event, data)
+                for name in topics:
+                    topic = self._topic(name)
+                    with topic.cond:
+                        topic.frames.append(frame)
+                        topic.seq += 1
+                    touched[name] = topic
+            for topic in touched.values():
+                with topic.cond:
+                    if topic.subscribers:
+                        topic.cond.notify_all()
+            self.published += len(batch)
+
+    def _next(self, subscriber, keepalive):
+        """取出訂閱者尚未讀取的訊息框；落後太多時標記為已斷線"""
+        topic = subscriber.topic
+        with topic.cond:
+            if subscriber.cursor == topic.seq:
+                topic.cond.wait(keepalive)
+            oldest = topic.seq - len(topic.frames)
+            if subscriber.cursor < oldest:
+                subscriber.dropped = True
+                return []
+            frames = list(topic.frames)[subscriber.cursor - oldest:] if subscriber.cursor < topic.seq else []
+            subscriber.cursor = topic.seq
+        return frames
+
+    def stream(self, subscriber, keepalive=STREAM_KEEPALIVE):
+        """依序產生訂閱者的訊息框，供 Flask 串流回應使用；連線中斷時自動取消訂閱"""
+        try:
+            while True:
+                frames = self._next(subscriber, keepalive)
+                if subscriber.dropped:
+                    logger.debug(f"串流訂閱者（{subscriber.name}）落後超過 {self.buffer_size} 則，已斷線")
+                    break
+                if not frames:
+                    yield KEEPALIVE_FRAME
+                    continue
+                self.deliveries += len(frames)
+                # 醒來時累積了多則就合併成一次寫入
+                yield b''.join(frames)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'topics': len(self._topics),
+                'published': self.published,
+                'deliveries': self.deliveries,
+                'dropped_subscribers': self.dropped,
+                'rejected': self.rejected,
+            }
+
+# 全域共用的即時串流中心
+stream_hub = StreamHub()
@@ -0,0 +1,103 @@
+import re
+import threading
+import logging
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 簡體 -> 繁體對照（每組「簡繁」兩字）；只收錄一對一、且簡體字在繁體中不是另一個常用字的組合。
+# 一對多的字（发、干、里、面、只、台、复、系、历、汇、钟、获、签、须……）與本身也是繁體常用字的
+# 簡體字（后、划、几、于、云、叶、党、夸、筑……）都不轉換，以免「后里」「划船」「茶几」被改寫
+CONVERSION_PAIRS = """
+气氣 温溫 湿濕 预預 报報 风風 阴陰 雾霧 阵陣 冻凍 热熱 凉涼 灾災 强強 级級 压壓 阳陽 晒曬 线線
+观觀 测測 时時 间間 现現 实實 况況 东東 门門 区區 县縣 乡鄉 镇鎮 岛島 湾灣 闻聞 经經 济濟 财財
+产產 业業 体體 运運 动動 娱娛 乐樂 国國 际際 会會 头頭 条條 视視 讯訊 网網 络絡 电電 脑腦 机機
+软軟 价價 钱錢 银銀 币幣 选選 举舉 总總 统統 长長 议議 员員 军軍 战戰 争爭 车車 辆輛 铁鐵 轨軌
+馆館 场場 桥橋 号號 飞飛 码碼 拥擁 挤擠 导導 离離 远遠 进進 转轉 弯彎 驾駕 驶駛 费費 单單 双雙
+点點 园園 庙廟 艺藝 览覽 买買 卖賣 饭飯 厅廳 宾賓 订訂 开開 关關 营營 楼樓 层層 环環 状狀 内內
+数數 传傳 质質 声聲 闹鬧 这這 个個 们們 么麼 吗嗎 为為 说說 请請 问問 帮幫 谢謝 对對 错錯 应應
+该該 让讓 给給 还還 没沒 从從 见見 将將 与與 样樣 边邊 过過 当當 无無 话話 语語 认認 识識 记記
+忆憶 听聽 读讀 写寫 书書 习習 学學 师師 医醫 药藥 护護 险險 图圖 爱愛 欢歡 兴興 务務 办辦 处處
+结結 证證 计計 设設 备備 资資 类類 节節 汤湯 鸡雞 鱼魚 饮飲 难難 伤傷 厌厭 烦煩 担擔 惊驚 虑慮
+烂爛 劲勁 溃潰 紧緊 张張 惨慘 闷悶 满滿 顺順 轻輕 奋奮 贴貼 优優 厉厲 卫衛 众眾 专專 丝絲 严嚴
+丢丟 两兩 临臨 丽麗 义義 乌烏 乱亂 亏虧 亚亞 亲親 亿億 仅僅 仓倉 仪儀 伞傘 伟偉 伦倫 伪偽 侠俠
+侣侶 侦偵 侧側 侨僑 俭儉 债債 倾傾 偿償 储儲 儿兒 兑兌 兰蘭 养養 兽獸 册冊 农農 决決 净淨 减減
+凤鳳 凭憑 凯凱 击擊 刘劉 则則 刚剛 创創 删刪 剂劑 剧劇 劝勸 励勵 劳勞 势勢 华華 协協 卢盧 却卻
+厂廠 厕廁 厦廈 变變 叙敘 叹嘆 吓嚇 启啟 吴吳 呜嗚 响響 哑啞 唤喚 喷噴 围圍 圆圓 圣聖 坏壞 块塊
+坚堅 坝壩 垫墊 墙牆 壮壯 壳殼 夹夾 夺奪 奖獎 妇婦 妈媽 婴嬰 宁寧 宝寶 宠寵 审審 宪憲 宫宮 宽寬
+寻尋 寿壽 尔爾 尘塵 尝嘗 属屬 岁歲 岂豈 岗崗 岭嶺 峡峽 帅帥 带帶 广廣 库庫 废廢 异異 弃棄 弹彈
+归歸 录錄 彻徹 径徑 忧憂 怀懷 态態 怜憐 恋戀 恳懇 悬懸 惧懼 惯慣 戏戲 户戶 执執 扩擴 扫掃 扬揚
+扰擾 抚撫 抛拋 抢搶 拟擬 拦攔 择擇 挂掛 挡擋 挥揮 损損 换換 摄攝 摇搖 敌敵 断斷 旧舊 昼晝 显顯
+晋晉 晓曉 暂暫 杀殺 杂雜 权權 来來 杨楊 极極 构構 枪槍 标標 栏欄 树樹 档檔 梦夢 检檢 横橫 欧歐
+残殘 毕畢 汉漢 沟溝 沪滬 泪淚 泽澤 洁潔 浅淺 浊濁 浏瀏 浓濃 润潤 涨漲 渐漸 渔漁 滚滾 滤濾 滩灘
+潜潛 灭滅 灯燈 灵靈 炉爐 炼煉 烟煙 烧燒 爷爺 牵牽 犹猶 狭狹 独獨 狮獅 猎獵 猪豬 献獻 玛瑪 画畫
+畅暢 疗療 疯瘋 痒癢 盐鹽 监監 盖蓋 盘盤 矿礦 砖磚 础礎 确確 碍礙 礼禮 祸禍 积積 称稱 税稅 稳穩
+穷窮 窃竊 竞競 笔筆 简簡 粮糧 纠糾 红紅 约約 纪紀 纯純 纲綱 纳納 纵縱 纷紛 纸紙 纹紋 纺紡 练練
+组組 细細 织織 终終 绍紹 绑綁 绕繞 绘繪 绝絕 继繼 绩績 绪緒 续續 维維 绵綿 综綜 绿綠 缓緩 编編
+缘緣 缩縮 缴繳 罗羅 罚罰 罢罷 职職 联聯 聪聰 肃肅 肠腸 肤膚 肿腫 胀脹 胁脅 胜勝 脚腳 脸臉 艰艱
+苍蒼 苹蘋 荣榮 莱萊 萝蘿 蓝藍 虚虛 虫蟲 虽雖 虾蝦 补補 装裝 规規 觉覺 讨討 训訓 讲講 许許 论論
+访訪 评評 诉訴 词詞 译譯 试試 诗詩 诚誠 询詢 详詳 误誤 课課 谁誰 调調 谈談 谱譜 贝貝 负負 贡貢
+责責 败敗 货貨 贫貧 购購 贵貴 贷貸 贺賀 赏賞 赔賠 赖賴 赚賺 赛賽 赵趙 赶趕 趋趨 跃躍 践踐 踪蹤
+轮輪 轰轟 载載 较較 辅輔 辉輝 输輸 辞辭 辽遼 达達 迁遷 违違 连連 迟遲 适適 递遞 逻邏 遗遺 邮郵
+邻鄰 郑鄭 酱醬 释釋 针針 钢鋼 钥鑰 铃鈴 铺鋪 链鏈 销銷 锁鎖 锅鍋 锦錦 键鍵 镜鏡 闭閉 闲閒 阅閱
+队隊 阶階 陆陸 陈陳 随隨 隐隱 顶頂 项項 顾顧 顿頓 领領 频頻 题題 颜顏 额額 饱飽 饼餅 驱驅 验驗
+骑騎 骗騙 鸟鳥 鸭鴨 麦麥 黄黃 齐齊 龙龍 龟龜 韩韓 岚嵐
+""".split()
+
+def _build_table():
+    table = {}
+    for pair in CONVERSION_PAIRS:
+        simplified, traditional = pair
+        if simplified != traditional:
+            table[ord(simplified)] = traditional
+    # 全形英數與符號轉為半形，全形空白轉為一般空白
+    table.update({code: chr(code - 0xFEE0) for code in range(0xFF01, 0xFF5F)})
+    table[0x3000] = ' '
+    # 常見的中文標點也折疊為半形，問句「台北天氣？」與「台北天氣?」視為相同
+    table.update({ord('。'): '.', ord('～'): '~', ord('…'): '...'})
+    return str.maketrans(table)
+
+# 預先編譯的轉換表，每則訊息只需一次 str.translate
+_TABLE = _build_table()
+_SPACES = re.compile(r'\s+')
+# 中日韓文字與全形符號之間的空白沒有意義（「台北 天氣」與「台北天氣」相同）
+_CJK_SPACE = re.compile(r'(?<=[⺀-鿿]) (?=[⺀-鿿])')
+_REPEATED_PUNCTUATION = re.compile(r'([?!.~,])\1+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s?!.~,]+$')
+
+class TextNormalizer:
+    """將使用者訊息轉為標準形式，供路由與所有快取鍵使用"""
+
+    def __init__(self, table=_TABLE):
+        self.table = table
+        self.messages = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+
+    def normalize(self, text):
+        """簡轉繁、全形轉半形、折疊空白與重複標點，並去除句尾標點"""
+        if not text:
+            return ''
+        result = text.translate(self.table)
+        result = _SPACES.sub(' ', result).strip()
+        result = _CJK_SPACE.sub('', result)
+        result = _REPEATED_PUNCTUATION.sub(r'\1', result)
+        result = _TRAILING_PUNCTUATION.sub('', result) or result
+        with self._lock:
+            self.messages += 1
+            if result != text:
+                self.changed += 1
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'messages': self.messages,
+                'changed': self.changed,
+                'table_size': len(self.table),
+            }
+
+# 全域共用的文字正規化
+text_normalizer = TextNormalizer()
+normalize = text_normalizer.normalize
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+import numpy as np
+from dotenv import load_dotenv
+from circuit_breaker import get_breaker
+from scheduler import schedule
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 交通資料設定
+TRAFFIC_REFRESH_INTERVAL = int(os.getenv('TRAFFIC_REFRESH_INTERVAL', '900'))
+TRAFFIC_CORRIDORS_PATH = os.getenv('TRAFFIC_CORRIDORS_PATH')
+
+# 各縣市的重點路廊：從轉運中心到主要目的地（一個起點 × N 個終點，只計 N 個 element）
+DEFAULT_CORRIDORS = {
+    '臺北市': {'hub': '台北車站', 'destinations': ['台北101', '松山機場', '內湖科學園區', '士林夜市', '南港展覽館']},
+    '新北市': {'hub': '板橋車站', 'destinations': ['新莊副都心', '三重區公所', '中和環球購物中心', '新店捷運站', '淡水老街']},
+    '桃園市': {'hub': '桃園火車站', 'destinations': ['桃園國際機場', '中壢火車站', '高鐵桃園站', '林口長庚醫院']},
+    '臺中市': {'hub': '台中火車站', 'destinations': ['台中高鐵站', '逢甲夜市', '台中國際機場', '中部科學園區', '豐原火車站']},
+    '臺南市': {'hub': '台南火車站', 'destinations': ['高鐵台南站', '安平古堡', '南部科學園區', '永康火車站']},
+    '高雄市': {'hub': '高雄車站', 'destinations': ['高雄國際機場', '左營高鐵站', '駁二藝術特區', '鳳山火車站', '夢時代購物中心']},
+}
+
+# 壅塞指數（實際行車時間 / 自由車流時間）對應的路況
+CONGESTION_LEVELS = [(1.2, '順暢', '🟢'), (1.5, '車多', '🟡'), (2.0, '壅塞', '🟠'), (float('inf'), '嚴重壅塞', '🔴')]
+
+def congestion_level(index):
+    for upper, label, icon in CONGESTION_LEVELS:
+        if index < upper:
+            return label, icon
+    return CONGESTION_LEVELS[-1][1:]
+
+def load_corridors(path=TRAFFIC_CORRIDORS_PATH):
+    """讀取路廊設定；未指定檔案時使用預設路廊"""
+    if not path:
+        return DEFAULT_CORRIDORS
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class TrafficEngine:
+    """定期以 Distance Matrix 批次抓取路廊行車時間，並保存交通快照"""
+
+    def __init__(self, corridors=None):
+        self.corridors = corridors or load_corridors()
+        self.client = None
+        self.limiter = None
+        self.breaker = get_breaker('maps')
+        # 各路廊的自由車流基準（秒），取 API 的無車流時間與歷史最小值
+        self._baselines = {}
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self.last_refresh = None
+        self.api_calls = 0
+
+    def refresh(self):
+        """抓取所有縣市的路廊行車時間並重新計算壅塞指數"""
+        if self.client is None:
+            return
+        rows = []  # (縣市, 起點, 終點, 自由車流秒數, 實際秒數)
+        for city, corridor in self.corridors.items():
+            if self.limiter is not None and not self.limiter.check_limit('distance_matrix'):
+                logger.warning("今日 Distance Matrix 查詢次數已達上限，停止更新交通資料")
+                break
+            try:
+                self.api_calls += 1
+                result = self.breaker.call(
+                    self.client.distance_matrix,
+                    origins=[corridor['hub']],
+                    destinations=corridor['destinations'],
+                    mode='driving',
+                    departure_time=datetime.now(),
+                    traffic_model='best_guess',
+                    language='zh-TW'
+                )
+            except Exception as e:
+                logger.warning(f"取得 {city} 路廊行車時間失敗: {e}")
+                continue
+            elements = result['rows'][0]['elements'] if result.get('rows') else []
+            for destination, element in zip(corridor['destinations'], elements):
+                if element.get('status') != 'OK':
+                    continue
+                free_flow = element['duration']['value']
+                actual = element.get('duration_in_traffic', element['duration'])['value']
+                rows.append((city, corridor['hub'], destination, free_flow, actual))
+
+        if rows:
+            self._build_snapshot(rows)
+        self.last_refresh = time.time()
+
+    def _build_snapshot(self, rows):
+        """一次向量化計算所有路廊與縣市的壅塞指數"""
+        cities = sorted({row[0] for row in rows})
+        city_codes = np.array([cities.index(row[0]) for row in rows])
+        free_flow = np.array([row[3] for row in rows], dtype=float)
+        actual = np.array([row[4] for row in rows], dtype=float)
+
+        keys = [(row[0], row[2]) for row in rows]
+        previous = np.array([self._baselines.get(key, np.inf) for key in keys])
+        # 至少 1 秒，API 回傳 0 秒的路段不會造成除以零
+        baseline = np.maximum(np.minimum(np.minimum(free_flow, actual), previous), 1.0)
+        self._baselines.update(zip(keys, baseline.tolist()))
+
+        index = actual / baseline
+        # 縣市整體指數：以基準時間加權，長路段影響較大
+        city_index = np.bincount(city_codes, weights=actual) / np.bincount(city_codes, weights=baseline)
+
+        snapshot = {}
+        for i, code in enumerate(city_codes):
+            city = cities[code]
+            entry = snapshot.setdefault(city, {
+                'city': city,
+                'index': float(city_index[code]),
+                'updated_at': time.time(),
+                'corridors': [],
+            })
+            entry['corridors'].append({
+                'origin': rows[i][1],
+                'destination': rows[i][2],
+                'baseline_minutes': baseline[i] / 60,
+                'actual_minutes': actual[i] / 60,
+                'index': float(index[i]),
+            })
+        with self._lock:
+            # 依縣市合併；本次抓取失敗的縣市保留上一次的快照（以 updated_at 標示時間）
+            self._snapshot = {**self._snapshot, **snapshot}
+
+    def lookup(self, city):
+        """查詢縣市的交通快照，沒有資料時回傳 None"""
+        return self._snapshot.get(city)
+
+    def get_stats(self):
+        return {
+            'cities': len(self._snapshot),
+            'corridors': sum(len(entry['corridors']) for entry in self._snapshot.values()),
+            'api_calls': self.api_calls,
+            'last_refresh': self.last_refresh,
+        }
+
+# 全域共用的交通快照
+traffic_engine = TrafficEngine()
+
+def start(client, limiter=None):
+    """啟動路廊行車時間的定期更新"""
+    if client is None:
+        logger.warning("Google Maps 客戶端未初始化，交通資料將不會更新")
+        return
+    traffic_engine.client = client
+    traffic_engine.limiter = limiter
+    schedule('traffic', TRAFFIC_REFRESH_INTERVAL, traffic_engine.refresh, initial_delay=5)
@@ -0,0 +1,335 @@
+import os
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+from http_client import http_client
+from circuit_breaker import get_breaker
+from scheduler import schedule, QuotaPacer
+from gemini_service import generate_json, DATA_SYSTEM_PROMPT
+
+load_dotenv()
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# OpenWeatherMap 設定
+WEATHER_API_KEY = os.getenv('WEATHER_API_KEY')
+OWM_BASE_URL = "https://api.openweathermap.org/data/2.5"
+WEATHER_REFRESH_INTERVAL = int(os.getenv('WEATHER_REFRESH_INTERVAL', '600'))
+FORECAST_REFRESH_INTERVAL = int(os.getenv('FORECAST_REFRESH_INTERVAL', '10800'))
+# OpenWeatherMap 免費方案每分鐘 60 次，保留餘裕給其他程序
+WEATHER_CALLS_PER_MINUTE = int(os.getenv('WEATHER_CALLS_PER_MINUTE', '50'))
+OWM_GROUP_SIZE = 20  # group API 單次最多 20 個城市
+FORECAST_SLOTS = 8   # 3 小時一筆，共 24 小時
+
+# 天氣建議：每次更新後批次生成，而不是每位使用者查詢時各呼叫一次
+WEATHER_ADVICE_ENABLED = os.getenv('WEATHER_ADVICE_ENABLED', 'true').lower() == 'true'
+WEATHER_ADVICE_CHUNK = int(os.getenv('WEATHER_ADVICE_CHUNK', '25'))
+WEATHER_ADVICE_CHARS = 60
+# 每個地點預留的輸出 token（中文約每字 1～2 個 token，另加地點名稱與 JSON 符號）
+ADVICE_TOKENS_PER_LOCATION = (WEATHER_ADVICE_CHARS + 20) * 2
+
+# 台灣各縣市（名稱, 緯度, 經度）
+TAIWAN_CITIES = [
+    ('臺北市', 25.0375, 121.5637), ('新北市', 25.0120, 121.4657), ('桃園市', 24.9936, 121.3010),
+    ('臺中市', 24.1477, 120.6736), ('臺南市', 22.9999, 120.2270), ('高雄市', 22.6273, 120.3014),
+    ('基隆市', 25.1276, 121.7392), ('新竹市', 24.8138, 120.9675), ('嘉義市', 23.4801, 120.4491),
+    ('新竹縣', 24.8387, 121.0177), ('苗栗縣', 24.5602, 120.8214), ('彰化縣', 24.0518, 120.5161),
+    ('南投縣', 23.9610, 120.9719), ('雲林縣', 23.7092, 120.4313), ('嘉義縣', 23.4518, 120.2555),
+    ('屏東縣', 22.5519, 120.5488), ('宜蘭縣', 24.7021, 121.7378), ('花蓮縣', 23.9872, 121.6016),
+    ('臺東縣', 22.7583, 121.1444), ('澎湖縣', 23.5711, 119.5793), ('金門縣', 24.4493, 118.3767),
+    ('連江縣', 26.1605, 119.9517),
+]
+
+# 常查詢的鄉鎮市區（名稱, 所屬縣市, 緯度, 經度）
+TAIWAN_DISTRICTS = [
+    ('信義區', '臺北市', 25.0330, 121.5654), ('大安區', '臺北市', 25.0264, 121.5434),
+    ('中山區', '臺北市', 25.0640, 121.5330), ('士林區', '臺北市', 25.0950, 121.5246),
+    ('內湖區', '臺北市', 25.0830, 121.5880), ('北投區', '臺北市', 25.1320, 121.5010),
+    ('萬華區', '臺北市', 25.0340, 121.4990), ('文山區', '臺北市', 24.9890, 121.5700),
+    ('松山區', '臺北市', 25.0500, 121.5770), ('南港區', '臺北市', 25.0550, 121.6070),
+    ('板橋區', '新北市', 25.0116, 121.4627), ('新莊區', '新北市', 25.0360, 121.4500),
+    ('三重區', '新北市', 25.0614, 121.4870), ('中和區', '新北市', 24.9990, 121.4990),
+    ('永和區', '新北市', 25.0080, 121.5150), ('新店區', '新北市', 24.9680, 121.5380),
+    ('淡水區', '新北市', 25.1690, 121.4410), ('汐止區', '新北市', 25.0630, 121.6580),
+    ('土城區', '新北市', 24.9720, 121.4430), ('林口區', '新北市', 25.0770, 121.3910),
+    ('中壢區', '桃園市', 24.9653, 121.2246), ('平鎮區', '桃園市', 24.9460, 121.2180),
+    ('八德區', '桃園市', 24.9280, 121.2840), ('龜山區', '桃園市', 25.0290, 121.3450),
+    ('西屯區', '臺中市', 24.1810, 120.6450), ('北屯區', '臺中市', 24.1820, 120.6860),
+    ('南屯區', '臺中市', 24.1380, 120.6430), ('豐原區', '臺中市', 24.2520, 120.7180),
+    ('大里區', '臺中市', 24.0990, 120.6780), ('太平區', '臺中市', 24.1260, 120.7190),
+    ('永康區', '臺南市', 23.0260, 120.2570), ('安平區', '臺南市', 22.9990, 120.1660),
+    ('新營區', '臺南市', 23.3100, 120.3160), ('善化區', '臺南市', 23.1320, 120.2970),
+    ('左營區', '高雄市', 22.6900, 120.2950), ('三民區', '高雄市', 22.6500, 120.3200),
+    ('鳳山區', '高雄市', 22.6270, 120.3570), ('前鎮區', '高雄市', 22.5950, 120.3140),
+    ('苓雅區', '高雄市', 22.6220, 120.3120), ('楠梓區', '高雄市', 22.7330, 120.3260),
+    ('岡山區', '高雄市', 22.7970, 120.2950), ('旗津區', '高雄市', 22.6130, 120.2700),
+    ('竹北市', '新竹縣', 24.8390, 121.0040), ('頭份市', '苗栗縣', 24.6880, 120.9090),
+    ('埔里鎮', '南投縣', 23.9650, 120.9670), ('斗六市', '雲林縣', 23.7120, 120.5410),
+    ('礁溪鄉', '宜蘭縣', 24.8270, 121.7700), ('羅東鎮', '宜蘭縣', 24.6770, 121.7660),
+    ('恆春鎮', '屏東縣', 22.0020, 120.7440),
+]
+
+LOCATION_SUFFIXES = ('市', '縣', '區', '鄉', '鎮')
+
+def _canonical_text(text):
+    return (text or "").strip().replace('台', '臺')
+
+class WeatherEngine:
+    """批次抓取全台天氣並保存在記憶體中的天氣資料表"""
+
+    def __init__(self, api_key=WEATHER_API_KEY, calls_per_minute=WEATHER_CALLS_PER_MINUTE):
+        self.api_key = api_key
+        self.pacer = QuotaPacer(calls_per_minute)
+        self.breaker = get_breaker('openweather')
+        # 地點 -> (緯度, 經度, 所屬縣市)
+        self.locations = {name: (lat, lng, name) for name, lat, lng in TAIWAN_CITIES}
+        self.locations.update({name: (lat, lng, city) for name, city, lat, lng in TAIWAN_DISTRICTS})
+        self._aliases = self._build_aliases()
+        self._owm_ids = {}     # 地點 -> OpenWeatherMap 城市 ID
+        self._current = {}     # 城市 ID -> 目前天氣
+        self._forecasts = {}   # 城市 ID -> 預報
+        self._advice = {}      # 城市 ID -> Gemini 生成的建議
+        self.advice_calls = 0
+        self.advice_fallbacks = 0
+        self._table = {}       # 地點 -> 合併後的天氣資料
+        self._lock = threading.Lock()
+        self.last_refresh = None
+
+    def _build_aliases(self):
+        """建立地名別名，縣市優先於同名的鄉鎮市區"""
+        aliases = {}
+        for name, (_, _, city) in self.locations.items():
+            candidates = [name]
+            base = name[:-1] if name.endswith(LOCATION_SUFFIXES) else name
+            if len(base) >= 2:
+                candidates.append(base)
+            for alias in candidates:
+                existing = aliases.get(alias)
+                # 同名時縣市優先；「新竹」、「嘉義」等對應到先列出的市
+                if existing is None or (name == city and self.locations[existing][2] != existing):
+                    aliases[alias] = name
+        # 比對句子時先試較長、較精確的名稱（同長度時鄉鎮市區優先）
+        self._alias_order = sorted(
+            aliases,
+            key=lambda alias: (len(alias), self.locations[aliases[alias]][2] != aliases[alias]),
+            reverse=True
+        )
+        return aliases
+
+    def resolve(self, text):
+        """將使用者輸入的地名轉為標準地點名稱"""
+        text = _canonical_text(text)
+        if text in self._aliases:
+            return self._aliases[text]
+        for alias in self._alias_order:
+            if alias in text:
+                return self._aliases[alias]
+        return None
+
+    def lookup(self, text):
+        """查詢地點的天氣資料，沒有資料時回傳 None"""
+        location = self.resolve(text)
+        if location is None:
+            return None
+        return self._table.get(location)
+
+    def records(self):
+        """目前資料表中所有地點的天氣資料"""
+        return dict(self._table)
+
+    def _get(self, path, params):
+        self.pacer.acquire()
+        return self.breaker.call(self._request, path, params)
+
+    def _request(self, path, params):
+        params = dict(params, appid=self.api_key, units='metric', lang='zh_tw')
+        response = http_client.get(f"{OWM_BASE_URL}/{path}", params=params)
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenWeatherMap {path} 回應 {response.status_code}")
+        return response.json()
+
+    def refresh_current(self):
+        """更新所有地點的目前天氣：已知城市 ID 以 group API 批次抓取"""
+        # 第一次以座標逐一查詢，取得 OpenWeatherMap 城市 ID
+        known = dict(self._owm_items())
+        unresolved = [name for name in self.locations if name not in known]
+        fetched = set()
+        for name in unresolved:
+            lat, lng, _ = self.locations[name]
+            try:
+                data = self._get('weather', {'lat': lat, 'lon': lng})
+            except Exception as e:
+                logger.warning(f"取得 {name} 天氣失敗: {e}")
+                continue
+            with self._lock:
+                self._owm_ids[name] = data['id']
+            self._current[data['id']] = self._parse_current(data)
+            fetched.add(data['id'])
+
+        ids = sorted({owm_id for _, owm_id in self._owm_items()} - fetched)
+        for start in range(0, len(ids), OWM_GROUP_SIZE):
+            chunk = ids[start:start + OWM_GROUP_SIZE]
+            try:
+                data = self._get('group', {'id': ','.join(str(i) for i in chunk)})
+                for item in data.get('list', []):
+                    self._current[item['id']] = self._parse_current(item)
+            except Exception as e:
+                logger.warning(f"批次取得天氣失敗（{len(chunk)} 個城市）: {e}")
+
+        self._rebuild_table()
+        self.last_refresh = time.time()
+        logger.info(f"天氣資料更新完成，共 {len(self._table)} 個地點")
+
+    def refresh_forecast(self):
+        """更新各城市的 24 小時預報（OpenWeatherMap 沒有批次預報 API）"""
+        for owm_id in sorted({owm_id for _, owm_id in self._owm_items()}):
+            try:
+                data = self._get('forecast', {'id': owm_id, 'cnt': FORECAST_SLOTS})
+            except Exception as e:
+                logger.warning(f"取得城市 {owm_id} 預報失敗: {e}")
+                continue
+            self._forecasts[owm_id] = [
+                {
+                    'time': item['dt'],
+                    'temperature': item['main']['temp'],
+                    'description': item['weather'][0]['description'] if item.get('weather') else '',
+                    'pop': item.get('pop', 0),
+                }
+                for item in data.get('list', [])
+            ]
+        self._rebuild_table()
+
+    def _owm_items(self):
+        """城市 ID 對照的快照；refresh_current 會在其他排程執行緒新增項目"""
+        with self._lock:
+            return list(self._owm_ids.items())
+
+    def _parse_current(self, data):
+        main = data.get('main', {})
+        return {
+            'description': data['weather'][0]['description'] if data.get('weather') else '',
+            'temperature': main.get('temp'),
+            'feels_like': main.get('feels_like'),
+            'temp_min': main.get('temp_min'),
+            'temp_max': main.get('temp_max'),
+            'humidity': main.get('humidity'),
+            'wind_speed': data.get('wind', {}).get('speed'),
+            'observed_at': data.get('dt'),
+        }
+
+    def _rebuild_table(self):
+        """合併目前天氣與預報，整張表一次替換"""
+        table = {}
+        with self._lock:
+            for name, owm_id in self._owm_ids.items():
+                current = self._current.get(owm_id)
+                if current is None:
+                    continue
+                table[name] = dict(
+                    current,
+                    location=name,
+                    city=self.locations[name][2],
+                    forecast=self._forecasts.get(owm_id, []),
+                    advice=self._advice.get(owm_id),
+                )
+            self._table = table
+
+    def refresh(self):
+        """更新目前天氣，接著批次生成天氣建議"""
+        self.refresh_current()
+        if WEATHER_ADVICE_ENABLED:
+            self.refresh_advice()
+
+    def refresh_advice(self):
+        """以單一（或分批）Gemini 呼叫產生所有城市的建議；失敗的城市改用規則式建議"""
+        # 共用同一個 OpenWeatherMap 城市 ID 的地點天氣相同，只需一則建議
+        representatives = {}
+        table = self._table
+        for name, owm_id in self._owm_items():
+            record = table.get(name)
+            if record is None:
+                continue
+            if owm_id not in representatives or record['location'] == record['city']:
+                representatives[owm_id] = record
+
+        items = sorted(representatives.items(), key=lambda item: item[1]['location'])
+        advice = {}
+        for start in range(0, len(items), WEATHER_ADVICE_CHUNK):
+            chunk = items[start:start + WEATHER_ADVICE_CHUNK]
+            self.advice_calls += 1
+            generated = generate_batch_advice([record for _, record in chunk])
+            for owm_id, record in chunk:
+                text = generated.get(record['location'])
+                if isinstance(text, str) and text.strip():
+                    advice[owm_id] = "• " + text.strip()[:WEATHER_ADVICE_CHARS * 2]
+                else:
+                    self.advice_fallbacks += 1
+
+        self._advice = advice
+        self._rebuild_table()
+        logger.info(f"天氣建議更新完成：{len(advice)}/{len(items)} 個城市由 Gemini 生成")
+
+    def get_stats(self):
+        return {
+            'locations': len(self._table),
+            'cities': len({owm_id for _, owm_id in self._owm_items()}),
+            'api_calls': self.pacer.calls,
+            'last_refresh': self.last_refresh,
+            'advice_calls': self.advice_calls,
+            'advice_fallbacks': self.advice_fallbacks,
+        }
+
+def generate_batch_advice(records):
+    """以一次 Gemini 呼叫為多個地點生成天氣建議，回傳 {地點: 建議}"""
+    lines = []
+    for record in records:
+        pop = max((slot.get('pop', 0) for slot in record.get('forecast', [])[:4]), default=0)
+        lines.append(
+            f"{record['location']}｜{record['description']}｜{record['temperature']:.1f}°C｜"
+            f"{record['feels_like']:.1f}°C｜{record['humidity']}%｜{pop * 100:.0f}%"
+        )
+    prompt = f"""以下是台灣各地目前的天氣資料（地點｜天氣｜氣溫｜體感溫度｜濕度｜未來 12 小時最高降雨機率）：
+{chr(10).join(lines)}
+
+請為每個地點寫一句不超過 {WEATHER_ADVICE_CHARS} 字的天氣建議與注意事項。
+輸出格式：{{"地點名稱": "建議", ...}}，地點名稱必須與上方完全相同。"""
+
+    # 輸出長度依批次大小預留，避免 JSON 被截斷而整批改用規則式建議
+    max_tokens = min(ADVICE_TOKENS_PER_LOCATION * len(records), 8192)
+    result = generate_json(prompt, temperature=0.5, system_prompt=DATA_SYSTEM_PROMPT, max_output_tokens=max_tokens)
+    return result if isinstance(result, dict) else {}
+
+def rule_based_advice(record):
+    """依天氣數據產生的規則式建議"""
+    tips = []
+    temperature = record.get('temperature')
+    humidity = record.get('humidity')
+    pop = max((slot.get('pop', 0) for slot in record.get('forecast', [])[:4]), default=0)
+    description = record.get('description', '')
+
+    if pop >= 0.5 or '雨' in description:
+        tips.append("• 可能會下雨，出門記得帶傘")
+    if temperature is not None and temperature >= 33:
+        tips.append("• 氣溫偏高，注意防曬並多補充水分")
+    elif temperature is not None and temperature <= 15:
+        tips.append("• 天氣寒冷，請注意保暖")
+    if humidity is not None and humidity >= 85:
+        tips.append("• 濕度高，體感較悶熱")
+    if (record.get('wind_speed') or 0) >= 10:
+        tips.append("• 風勢強勁，戶外活動請注意安全")
+    return "\n".join(tips) or "• 天氣適宜，適合外出活動"
+
+# 全域共用的天氣資料
+weather_engine = WeatherEngine()
+
+def start():
+    """啟動天氣資料的定期更新"""
+    if not WEATHER_API_KEY:
+        logger.warning("WEATHER_API_KEY 未設定，天氣資料將不會更新")
+        return
+    schedule('weather-current', WEATHER_REFRESH_INTERVAL, weather_engine.refresh)
+    schedule('weather-forecast', FORECAST_REFRESH_INTERVAL, weather_engine.refresh_forecast,
+             initial_delay=120)
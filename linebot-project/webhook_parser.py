@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import Event
+
+# 配置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LightSource:
+    __slots__ = ('type', 'user_id', 'group_id', 'room_id')
+
+    def __init__(self, data):
+        self.type = data.get('type')
+        self.user_id = data.get('userId')
+        self.group_id = data.get('groupId')
+        self.room_id = data.get('roomId')
+
+class LightMessage:
+    __slots__ = ('type', 'id', 'text')
+
+    def __init__(self, data):
+        self.type = data.get('type')
+        self.id = data.get('id')
+        self.text = data.get('text')
+
+class LightDeliveryContext:
+    __slots__ = ('is_redelivery',)
+
+    def __init__(self, data):
+        self.is_redelivery = bool(data.get('isRedelivery'))
+
+class LightEvent:
+    """只取出路由需要欄位的輕量事件，屬性名稱與 SDK 模型相同
+
+    完整的 SDK 模型在第一次讀取 model 時才建立。
+    """
+    __slots__ = ('raw', 'type', 'timestamp', 'reply_token', 'webhook_event_id',
+                 'source', 'message', 'delivery_context', '_model')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.type = raw.get('type')
+        self.timestamp = raw.get('timestamp')
+        self.reply_token = raw.get('replyToken')
+        self.webhook_event_id = raw.get('webhookEventId')
+        self.source = LightSource(raw.get('source') or {})
+        message = raw.get('message')
+        self.message = LightMessage(message) if message else None
+        self.delivery_context = LightDeliveryContext(raw.get('deliveryContext') or {})
+        self._model = None
+
+    @property
+    def model(self):
+        """完整的 SDK 事件模型（延遲建立）"""
+        if self._model is None:
+            self._model = Event.from_dict(self.raw)
+        return self._model
+
+class FastWebhookParser:
+    """驗證簽章並只解析一次 JSON 的 webhook 解析器"""
+
+    def __init__(self, channel_secret):
+        self.channel_secret = channel_secret.encode('utf-8')
+
+    def validate(self, body, signature):
+        digest = hmac.new(self.channel_secret, body, hashlib.sha256).digest()
+        return hmac.compare_digest(signature.encode('utf-8'), base64.b64encode(digest))
+
+    def parse(self, body, signature):
+        """body 為原始請求內容（bytes），回傳 LightEvent 列表"""
+        if not self.validate(body, signature or ''):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+        payload = json.loads(body)
+        return [LightEvent(raw) for raw in payload.get('events', [])]
+
+class WebhookRouter:
+    """依事件類型（與訊息類型）分派給處理函式，用法與 WebhookHandler.add 類似"""
+
+    def __init__(self, channel_secret):
+        self.parser = FastWebhookParser(channel_secret)
+        self.events = 0
+        self.unhandled = 0
+        self._handlers = {}
+
+    def add(self, event_type, message_type=None, hydrate=False):
+        """註冊處理函式；hydrate=True 時傳入完整的 SDK 事件模型"""
+        def decorator(func):
+            self._handlers[(event_type, message_type)] = (func, hydrate)
+            return func
+        return decorator
+
+    def handle(self, body, signature):
+        for event in self.parser.parse(body, signature):
+            self.events += 1
+            message_type = event.message.type if event.message else None
+            entry = self._handlers.get((event.type, message_type)) or self._handlers.get((event.type, None))
+            if entry is None:
+                self.unhandled += 1
+                logger.debug(f"沒有 {event.type}/{message_type} 事件的處理函式")
+                continue
+            func, hydrate = entry
+            func(event.model if hydrate else event)
+
+    def get_stats(self):
+        return {'events': self.events, 'unhandled': self.unhandled}